@@ -0,0 +1,221 @@
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "src"))
+
+import evaluation  # noqa: E402
+import logic  # noqa: E402
+from schemas import Direction, Status  # noqa: E402
+from service import Service  # noqa: E402
+from store import (  # noqa: E402
+    BoardLog, GameLog, SqliteStore, Store)
+
+
+DEFAULT_BASELINE = HERE / "baseline.json"
+BOARD = [
+    [2, 4, 8, 0],
+    [0, 2, 16, 4],
+    [4, 0, 2, 32],
+    [2, 8, 0, 2],
+]
+STUB_SUGGESTION = json.dumps({
+    "recommended_moves": [
+        {"direction": "LEFT", "reasoning": "stub", "confidence": 0.5}
+    ],
+    "game_analysis": "stub",
+})
+
+
+class StubAsyncGroq:
+
+    def __init__(self):
+        message = SimpleNamespace(content=STUB_SUGGESTION)
+        completion = SimpleNamespace(
+            choices=[SimpleNamespace(message=message)],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0))
+
+        async def create(**kwargs):
+            return completion
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=create))
+
+
+def measure(fn, samples: int, iterations: int) -> dict:
+    for _ in range(iterations):
+        fn()
+    per_op = []
+    for _ in range(samples):
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            fn()
+        per_op.append((time.perf_counter_ns() - start) / iterations)
+    per_op.sort()
+    median = statistics.median(per_op)
+    # Throughput comes from the median sample so that a few samples hit by
+    # scheduler noise do not fail the regression check.
+    return {
+        "ops_per_sec": 1e9 / median,
+        "p50_us": median / 1000,
+        "p99_us": per_op[min(len(per_op) - 1, int(len(per_op) * 0.99))]
+        / 1000,
+    }
+
+
+def _tmpfs_dir() -> str | None:
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _playing(service: Service, game_id: str):
+    directions = list(Direction)
+    service.restart_game(game_id)
+
+    def make_move():
+        _, status, _ = service.make_move(game_id, random.choice(directions))
+        if status in (Status.WIN, Status.LOSE):
+            service.restart_game(game_id)
+    return make_move
+
+
+def logic_cases() -> dict:
+    row = BOARD[0]
+    return {
+        "logic._compress_line_left": lambda: logic._compress_line_left(row),
+        "logic.move_left": lambda: logic.move_left(BOARD),
+        "logic.move_right": lambda: logic.move_right(BOARD),
+        "logic.move_up": lambda: logic.move_up(BOARD),
+        "logic.move_down": lambda: logic.move_down(BOARD),
+        "logic.is_lose": lambda: logic.is_lose(BOARD),
+        # spawn_tile fills the board in place, so each call gets a copy.
+        "logic.spawn_tile": lambda: logic.spawn_tile([r[:] for r in BOARD]),
+        "evaluation.evaluate_board": lambda: evaluation.evaluate_board(BOARD),
+    }
+
+
+def service_cases(tmp: Path) -> dict:
+    return {
+        "service.make_move[json]": _playing(
+            Service(BoardLog(Store(tmp / "store.json"))), "bench"),
+        "service.make_move[sqlite]": _playing(
+            Service(BoardLog(SqliteStore(tmp / "store.db"))), "bench"),
+        "service.make_move[log]": _playing(
+            Service(GameLog(tmp / "games.db")), "bench"),
+    }
+
+
+def api_cases(tmp: Path) -> dict:
+    from fastapi.testclient import TestClient
+    # Keep the module-level store off disk; the routes get a tmpfs one below.
+    os.environ["STORE_BACKEND"] = "json"
+    # The suggest case asks about one board; a cache would answer it.
+    os.environ.setdefault("SUGGESTION_CACHE_SIZE", "0")
+    import api
+
+    api.logger.setLevel(logging.WARNING)
+
+    store = GameLog(tmp / "api.db")
+    api.service = Service(store)
+    agent = api.get_agent()
+    agent._store = store
+    agent._async_client = StubAsyncGroq()
+    client = TestClient(api.app)
+    client.patch("/api/restart?game_id=bench")
+    directions = [d.value for d in Direction]
+
+    # A failing route would otherwise be timed as if it worked.
+    def move():
+        response = client.patch(
+            f"/api/move/{random.choice(directions)}?game_id=bench")
+        assert response.status_code == 200, response.text
+        if response.json()["status"] in ("WIN", "LOSE"):
+            client.patch("/api/restart?game_id=bench")
+
+    def suggest():
+        response = client.post("/api/suggest/1?game_id=bench")
+        assert response.status_code == 200, response.text
+
+    return {
+        "api.move": move,
+        "api.suggest": suggest,
+    }
+
+
+def run(samples: int, iterations: int) -> dict:
+    random.seed(0)
+    results = {}
+    with tempfile.TemporaryDirectory(dir=_tmpfs_dir()) as tmp:
+        cases = logic_cases()
+        cases.update(service_cases(Path(tmp)))
+        cases.update(api_cases(Path(tmp)))
+        for name, fn in cases.items():
+            # Each sample should take a similar time whatever the operation
+            # costs, so slow paths run fewer iterations per sample.
+            scale = iterations if name.startswith("logic.") else max(
+                1, iterations // 100)
+            results[name] = measure(fn, samples, scale)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, actual in results.items():
+        expected = baseline.get(name)
+        # An ungated case would never fail, so a missing entry does.
+        if expected is None:
+            regressions.append(
+                f"{name}: not in the baseline; refresh it with "
+                f"--update-baseline")
+            continue
+        floor = expected["ops_per_sec"] * (1 - tolerance)
+        if actual["ops_per_sec"] < floor:
+            regressions.append(
+                f"{name}: {actual['ops_per_sec']:.0f} ops/sec < "
+                f"{floor:.0f} ({expected['ops_per_sec']:.0f} baseline "
+                f"- {tolerance:.0%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the logic, service and API hot paths")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed ops/sec drop relative to the baseline")
+    parser.add_argument("--output", type=Path,
+                        help="write results here as well as to stdout")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.samples, args.iterations)
+    report = json.dumps(results, indent=2, sort_keys=True)
+    print(report)
+    if args.output:
+        args.output.write_text(report + "\n")
+    if args.update_baseline:
+        args.baseline.write_text(report + "\n")
+        return 0
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; skipping comparison",
+              file=sys.stderr)
+        return 0
+
+    regressions = compare(
+        results, json.loads(args.baseline.read_text()), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+HERE = Path(__file__).resolve().parent
+SRC = HERE.parent / "src"
+
+STUB_CONTENT = json.dumps({
+    "recommended_moves": [
+        {"direction": "LEFT", "reasoning": "stub", "confidence": 0.5}
+    ],
+    "game_analysis": "stub",
+})
+DIRECTIONS = ("UP", "DOWN", "LEFT", "RIGHT")
+ROUTES = ("restart", "move", "suggest", "stream")
+
+
+def stub_llm_app(latency_ms: float, tokens_per_s: float,
+                 completion_tokens: int) -> FastAPI:
+    """A Groq/OpenAI-compatible chat completions endpoint that answers
+    with a fixed suggestion after `latency_ms`, then emits
+    `completion_tokens` tokens at `tokens_per_s`."""
+    app = FastAPI()
+    # The content is split into as many pieces as there are tokens.
+    size = max(1, -(-len(STUB_CONTENT) // completion_tokens))
+    pieces = [STUB_CONTENT[i:i + size]
+              for i in range(0, len(STUB_CONTENT), size)]
+    token_delay = 1 / tokens_per_s if tokens_per_s > 0 else 0.0
+
+    def chunk(body: dict, choices: list, usage: dict | None = None) -> str:
+        data = {"id": body["id"], "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body["model"],
+                "choices": choices}
+        if usage is not None:
+            # Groq reports a stream's usage on the last chunk.
+            data["x_groq"] = {"id": body["id"], "usage": usage}
+        return f"data: {json.dumps(data)}\n\n"
+
+    @app.post("/openai/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        body["id"] = f"chatcmpl-{uuid.uuid4().hex}"
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        usage = {"prompt_tokens": prompt_tokens,
+                 "completion_tokens": len(pieces),
+                 "total_tokens": prompt_tokens + len(pieces)}
+        await asyncio.sleep(latency_ms / 1000)
+
+        if body.get("stream"):
+            async def events():
+                for piece in pieces:
+                    yield chunk(body, [{"index": 0, "finish_reason": None,
+                                        "delta": {"content": piece}}])
+                    await asyncio.sleep(token_delay)
+                yield chunk(body, [{"index": 0, "finish_reason": "stop",
+                                    "delta": {}}], usage)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(token_delay * len(pieces))
+        return JSONResponse({
+            "id": body["id"], "object": "chat.completion",
+            "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant",
+                                     "content": STUB_CONTENT}}],
+            "usage": usage,
+        })
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_in_thread(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def _start_api(port: int, llm_url: str, workers: int, store_path: Path,
+               log: Path | None) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(GROQ_API_KEY="stub", GROQ_BASE_URL=llm_url,
+               STORE_PATH=str(store_path))
+    # Repeated boards would otherwise be answered from the cache.
+    env.setdefault("SUGGESTION_CACHE_SIZE", "0")
+    # The API logs every request, which would drown out the report.
+    output = open(log, "ab") if log else subprocess.DEVNULL
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=SRC, env=env, stdout=output, stderr=subprocess.STDOUT)
+
+
+def _wait_until_ready(url: str, process: subprocess.Popen,
+                      timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API server exited with {process.returncode}")
+        try:
+            if httpx.get(f"{url}/metrics").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"API server at {url} did not start")
+
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {r: [] for r in ROUTES}
+        self.errors: dict[str, int] = {r: 0 for r in ROUTES}
+
+    def record(self, route: str, seconds: float, ok: bool) -> None:
+        self.latencies[route].append(seconds)
+        if not ok:
+            self.errors[route] += 1
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for route, latencies in recorder.latencies.items():
+        if not latencies:
+            continue
+        latencies = sorted(latencies)
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[route],
+            "error_rate": recorder.errors[route] / len(latencies),
+            "requests_per_sec": len(latencies) / elapsed,
+            "p50_ms": _percentile(latencies, 0.5) * 1000,
+            "p90_ms": _percentile(latencies, 0.9) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000,
+        }
+    total = sum(r["requests"] for r in routes.values())
+    errors = sum(r["errors"] for r in routes.values())
+    return {
+        "requests_per_sec": total / elapsed,
+        "error_rate": errors / total if total else 0.0,
+        "routes": routes,
+    }
+
+
+async def _request(client: httpx.AsyncClient, recorder: Recorder,
+                   route: str, method: str, path: str) -> dict | None:
+    start = time.perf_counter()
+    try:
+        if route == "stream":
+            async with client.stream(method, path) as response:
+                body = (await response.aread()).decode()
+            ok = response.status_code < 400 and "event: error" not in body
+            data = None
+        else:
+            response = await client.request(method, path)
+            ok = response.status_code < 400
+            data = response.json() if ok else None
+    except httpx.HTTPError:
+        ok, data = False, None
+    recorder.record(route, time.perf_counter() - start, ok)
+    return data
+
+
+async def _player(client: httpx.AsyncClient, recorder: Recorder,
+                  weights: list[float], deadline: float,
+                  rng: random.Random) -> None:
+    game_id = f"load-{uuid.uuid4().hex[:16]}"
+    route = "restart"
+    while time.perf_counter() < deadline:
+        if route == "restart":
+            await _request(client, recorder, route, "PATCH",
+                           f"/api/restart?game_id={game_id}")
+        elif route == "move":
+            data = await _request(
+                client, recorder, route, "PATCH",
+                f"/api/move/{rng.choice(DIRECTIONS)}?game_id={game_id}")
+            if data and data["status"] in ("WIN", "LOSE"):
+                route = "restart"
+                continue
+        elif route == "suggest":
+            await _request(client, recorder, route, "POST",
+                           f"/api/suggest/1?game_id={game_id}")
+        else:
+            await _request(client, recorder, route, "POST",
+                           f"/api/suggest/1/stream?game_id={game_id}")
+        route = rng.choices(ROUTES, weights)[0]
+
+
+async def run_stage(url: str, players: int, weights: list[float],
+                    duration: float, seed: int) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=players)
+    async with httpx.AsyncClient(base_url=url, limits=limits,
+                                 timeout=60.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _player(client, recorder, weights, start + duration,
+                    random.Random(f"{seed}:{i}"))
+            for i in range(players)))
+        elapsed = time.perf_counter() - start
+    return {"players": players, **summarize(recorder, elapsed)}
+
+
+def _parse_mix(text: str) -> list[float]:
+    mix = dict.fromkeys(ROUTES, 0.0)
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        if route not in mix:
+            raise argparse.ArgumentTypeError(
+                f"unknown route {route!r}; "
+                f"expected one of {', '.join(ROUTES)}")
+        mix[route] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("at least one route needs a weight")
+    return [mix[route] for route in ROUTES]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Drive simulated players against the API, with Groq "
+                    "replaced by a local stub, and report per-route "
+                    "throughput, error rates and latency percentiles")
+    parser.add_argument("--players", default="8,32,128",
+                        help="comma-separated concurrency levels, one stage "
+                             "each")
+    parser.add_argument("--duration", type=float, default=20.0,
+                        help="seconds per stage")
+    parser.add_argument("--mix", type=_parse_mix,
+                        default=_parse_mix("restart=1,move=8,suggest=1"),
+                        help="relative weights of restart, move, suggest and "
+                             "stream (streamed suggest) requests")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn worker processes for the API")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0,
+                        help="stub LLM time to first token")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=500.0)
+    parser.add_argument("--llm-completion-tokens", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--api-log", type=Path,
+                        help="append the API server's output to this file")
+    parser.add_argument("--output", type=Path,
+                        help="write results here as well as to stdout")
+    args = parser.parse_args()
+
+    llm_port, api_port = _free_port(), _free_port()
+    llm = _serve_in_thread(stub_llm_app(
+        args.llm_latency_ms, args.llm_tokens_per_s,
+        args.llm_completion_tokens), llm_port)
+    url = f"http://127.0.0.1:{api_port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        api = _start_api(api_port, f"http://127.0.0.1:{llm_port}",
+                         args.workers, Path(tmp) / "games.db", args.api_log)
+        try:
+            _wait_until_ready(url, api)
+            stages = []
+            for players in (int(p) for p in args.players.split(",")):
+                stage = asyncio.run(run_stage(
+                    url, players, args.mix, args.duration, args.seed))
+                stages.append(stage)
+                print(f"{players} players: "
+                      f"{stage['requests_per_sec']:.0f} req/s, "
+                      f"{stage['error_rate']:.1%} errors", file=sys.stderr)
+        finally:
+            api.terminate()
+            api.wait()
+            llm.should_exit = True
+
+    report = json.dumps({"stages": stages}, indent=2)
+    print(report)
+    if args.output:
+        args.output.write_text(report + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
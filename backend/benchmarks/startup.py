@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+SRC = HERE.parent / "src"
+
+# Runs in a fresh interpreter, as on a cold start, and prints the time in
+# milliseconds of each phase up to a warmed-up agent.
+CHILD = """
+import json, time
+start = time.perf_counter()
+phases = {}
+
+def phase(name):
+    global start
+    now = time.perf_counter()
+    phases[name] = (now - start) * 1000
+    start = now
+
+import api
+phase("import_api")
+from fastapi.testclient import TestClient
+client = TestClient(api.app)
+start = time.perf_counter()
+client.patch("/api/restart?game_id=startup")
+phase("first_restart")
+client.patch("/api/move/LEFT?game_id=startup")
+phase("first_move")
+api.get_agent()
+phase("agent")
+api.get_agent().warm_up()
+phase("warm_up")
+print(json.dumps(phases))
+"""
+
+
+def _parse_importtime(stderr: str, min_ms: float) -> dict[str, float]:
+    """Cumulative milliseconds of each module the child imported itself
+    and of each module those imported directly, as "parent/child"."""
+    imports, children = {}, []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        ms = int(cumulative) / 1000
+        # A module's imports are listed before the module itself.
+        if depth == 1:
+            children.append((name.strip(), ms))
+        elif depth == 0:
+            parent = name.strip()
+            imports[parent] = ms
+            for child, child_ms in children:
+                imports[f"{parent}/{child}"] = child_ms
+            children = []
+    return {k: ms for k, ms in imports.items() if ms >= min_ms}
+
+
+def measure(env: dict[str, str], min_ms: float) -> tuple[dict, dict]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD], cwd=SRC, env=env,
+        capture_output=True, text=True, check=True)
+    phases = json.loads(result.stdout.strip().splitlines()[-1])
+    return phases, _parse_importtime(result.stderr, min_ms)
+
+
+def _median(samples: list[dict]) -> dict:
+    keys = {k for sample in samples for k in sample}
+    return {k: statistics.median(s.get(k, 0.0) for s in samples)
+            for k in sorted(keys, key=lambda k: -samples[0].get(k, 0.0))}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Report cold-start time by phase and by import")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-import-ms", type=float, default=5.0,
+                        help="leave out imports cheaper than this")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update(STORE_PATH=str(Path(tmp) / "games.db"),
+                   GROQ_API_KEY=env.get("GROQ_API_KEY", "startup"))
+        env.pop("WARM_UP", None)
+        runs = [measure(env, args.min_import_ms) for _ in range(args.runs)]
+
+    phases = _median([p for p, _ in runs])
+    report = {
+        "phases_ms": phases,
+        "ready_for_moves_ms": (phases["import_api"] + phases["first_restart"]
+                               + phases["first_move"]),
+        "imports_ms": _median([i for _, i in runs]),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,23 @@
+import asyncio
+import math
 import os
-from groq import Groq
-from langchain_core.output_parsers import JsonOutputParser
+import time
+from collections.abc import AsyncIterator
+from functools import cached_property, partial
 from pydantic import ValidationError
 
-from schemas import AgentResponse, AgentConfig, Move, Board
+import logic
+from metrics import (
+    HEDGED_SUGGESTIONS, LLM_LATENCY, LLM_PARSE_FAILURES, LLM_TOKENS)
+from evaluation import board_metrics, evaluate_board, heuristic, rank_moves
+from expectimax import ExpectimaxSearch
+from positions import PositionTable
+from rollout import RolloutEvaluator
+from schemas import (
+    AgentResponse, AgentConfig, AgentBackend, Board, Direction, Move,
+    SuggestionSource)
 from store import Store
+from suggestion_cache import SuggestionCache
 
 
 SYSTEM_PROMPT = """You are an expert 2048 game strategist. Your role is to analyze the current board state and recommend the best moves.
@@ -29,47 +42,464 @@ When analyzing the board:
 Respond with valid JSON only, following the exact format specified."""
 
 
+class UnsupportedBoardError(ValueError):
+    pass
+
+
+# Expected-value gap at which a move's confidence drops to 1/e of the best.
+CONFIDENCE_SCALE = 1000.0
+
+
 class GameAgent:
 
     def __init__(self, config: AgentConfig, store: Store):
-        key = os.getenv("GROQ_API_KEY")
-        self._client = Groq(api_key=key) if key else None
+        self._api_key = os.getenv("GROQ_API_KEY")
+        # GROQ_BASE_URL points the client at any Groq-compatible server.
+        self._base_url = os.getenv("GROQ_BASE_URL")
+        self._semaphore = asyncio.Semaphore(config.max_concurrent_calls)
         self._store = store
         self._config = config
-        self._output_parser = JsonOutputParser(pydantic_object=AgentResponse)
+        self._search = ExpectimaxSearch(
+            config.search_depth, config.search_time_ms)
+        self._rollout = RolloutEvaluator(
+            config.rollout_playouts, config.rollout_policy,
+            config.rollout_time_ms)
+        self._cache = (
+            SuggestionCache(config.cache_size, config.cache_ttl_s)
+            if config.cache_size > 0 else None)
+        self._positions = (
+            PositionTable(config.position_table)
+            if config.position_table else None)
+        # LLM calls that outlived their hedge deadline, kept until done.
+        self._late: set[asyncio.Task] = set()
 
-    def invoke(self, num_suggestions: int) -> AgentResponse:
-        user_prompt = self._build_prompt(num_suggestions)
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt},
+    # groq and langchain_core take most of a cold start to import, so the
+    # client and the parser are only built when first needed.
+    @cached_property
+    def _async_client(self):
+        if not self._api_key:
+            return None
+        from groq import AsyncGroq
+        return AsyncGroq(api_key=self._api_key, base_url=self._base_url)
+
+    @cached_property
+    def _output_parser(self):
+        from langchain_core.output_parsers import JsonOutputParser
+        return JsonOutputParser(pydantic_object=AgentResponse)
+
+    def warm_up(self) -> None:
+        """Build what the first suggestion would otherwise pay for."""
+        if self._config.backend == AgentBackend.GROQ:
+            for name in ("_async_client", "_output_parser"):
+                getattr(self, name)
+            evaluate_board([[0] * 4] * 4)
+        elif self._config.backend == AgentBackend.EXPECTIMAX:
+            heuristic(0)
+
+    def close(self) -> None:
+        self._rollout.close()
+        if self._positions is not None:
+            self._positions.close()
+
+    def invoke(self, game_id: str, num_suggestions: int) -> AgentResponse:
+        """ainvoke for callers without an event loop."""
+        return asyncio.run(self.ainvoke(game_id, num_suggestions))
+
+    async def ainvoke(self, game_id: str,
+                      num_suggestions: int) -> AgentResponse:
+        board = await asyncio.to_thread(self._store.load, game_id)
+        return await self._ainvoke_board(board, num_suggestions)
+
+    async def astream(self, game_id: str, num_suggestions: int
+                      ) -> AsyncIterator[Move | AgentResponse]:
+        board = await asyncio.to_thread(self._store.load, game_id)
+        return self._stream_board(board, num_suggestions)
+
+    def cache_stats(self) -> dict[str, float]:
+        stats = self._cache.stats() if self._cache is not None else {}
+        if self._positions is not None:
+            stats.update({f"position_{name}": value for name, value
+                          in self._positions.stats().items()})
+        return stats
+
+    def _cache_key(self, num_suggestions: int) -> tuple:
+        return (num_suggestions, self._config.backend, self._config.model,
+                self._config.temperature)
+
+    # Suggestions are cached by bitboard, so only 4x4 boards are cached.
+    def _cache_bits(self, board: Board) -> int | None:
+        if len(board) != 4:
+            return None
+        try:
+            return logic.to_bitboard(board)
+        except ValueError:
+            return None
+
+    def _cached(self, bits: int | None, key: tuple,
+                num_suggestions: int) -> AgentResponse | None:
+        if bits is None:
+            return None
+        if self._positions is not None:
+            ranked = self._positions.lookup(bits)
+            if ranked is not None:
+                return self._solved_response(ranked, num_suggestions)
+        if self._cache is None:
+            return None
+        return self._cache.get(bits, key)
+
+    def _solved_response(self, ranked: list[tuple[Direction, float]],
+                         num_suggestions: int) -> AgentResponse:
+        if not ranked:
+            return AgentResponse(
+                recommended_moves=[],
+                game_analysis="No legal moves remain",
+                source=SuggestionSource.TABLE
+            )
+        best = ranked[0][1]
+        depth = self._positions.depth
+        moves = [
+            Move(
+                direction=direction,
+                reasoning=(f"Expected score {value:.0f} from a "
+                           f"{depth}-move search solved offline"),
+                confidence=math.exp((value - best) / CONFIDENCE_SCALE)
+            )
+            for direction, value in ranked[:num_suggestions]
+        ]
+        return AgentResponse(
+            recommended_moves=moves,
+            game_analysis=(f"Known position from the solved-position table; "
+                           f"{len(ranked)} legal move(s)"),
+            source=SuggestionSource.TABLE
+        )
+
+    def _remember(self, bits: int | None, key: tuple,
+                  response: AgentResponse, start: float) -> None:
+        if self._cache is not None and bits is not None:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._cache.put(bits, key, response, elapsed_ms)
+
+    def _fallback_response(self) -> AgentResponse:
+        return AgentResponse(
+            recommended_moves=[
+                Move(
+                    direction="UP",
+                    reasoning="Default recommendation due to parsing error",
+                    confidence=0.0
+                )
+            ],
+            game_analysis="Unable to analyze",
+            source=SuggestionSource.DEFAULT
+        )
+
+    def _greedy_response(self, board: Board, num_suggestions: int,
+                         reason: str) -> AgentResponse:
+        ranked = rank_moves(board)
+        if not ranked:
+            return AgentResponse(
+                recommended_moves=[],
+                game_analysis="No legal moves remain",
+                source=SuggestionSource.GREEDY
+            )
+
+        best = ranked[0][1]
+        moves = [
+            Move(
+                direction=direction,
+                reasoning=f"Board value {value:.0f} one move ahead",
+                confidence=math.exp((value - best) / CONFIDENCE_SCALE)
+            )
+            for direction, value in ranked[:num_suggestions]
         ]
-        chat_completion = self._client.chat.completions.create(
-            messages=messages,
-            model=self._config.model,
-            temperature=self._config.temperature
+        return AgentResponse(
+            recommended_moves=moves,
+            game_analysis=(f"{reason}; ranked {len(ranked)} legal move(s) "
+                           "one move ahead"),
+            source=SuggestionSource.GREEDY
         )
-        content = chat_completion.choices[0].message.content
+
+    async def _ainvoke_board(self, board: Board,
+                             num_suggestions: int) -> AgentResponse:
+        bits = self._cache_bits(board)
+        key = self._cache_key(num_suggestions)
+        cached = self._cached(bits, key, num_suggestions)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        if (self._config.backend == AgentBackend.GROQ
+                and self._config.hedge_timeout_ms):
+            return await self._ahedge(board, num_suggestions, bits, key, start)
+        try:
+            response = await self._acall(board, num_suggestions)
+        except UnsupportedBoardError:
+            raise
+        except ValueError:
+            LLM_PARSE_FAILURES.inc()
+            return self._fallback_response()
+        self._remember(bits, key, response, start)
+        return response
+
+    async def _acall(self, board: Board,
+                     num_suggestions: int) -> AgentResponse:
+        # The deadline covers queueing for a slot as well as the call.
+        async with asyncio.timeout(self._config.call_timeout_s):
+            async with self._semaphore:
+                if self._config.backend == AgentBackend.GROQ:
+                    return await self._ainvoke_llm(board, num_suggestions)
+                return await asyncio.to_thread(
+                    self._invoke_local, board, num_suggestions)
+
+    # Races the LLM against the local ranking: the LLM answer is used if it
+    # is valid and arrives within hedge_timeout_ms, the ranking otherwise.
+    async def _ahedge(self, board: Board, num_suggestions: int,
+                      bits: int | None, key: tuple,
+                      start: float) -> AgentResponse:
+        llm = asyncio.create_task(self._acall(board, num_suggestions))
+        ranked = partial(self._greedy_response, board, num_suggestions)
+        try:
+            await asyncio.wait(
+                {llm}, timeout=self._config.hedge_timeout_ms / 1000)
+        except asyncio.CancelledError:
+            llm.cancel()
+            raise
+        if not llm.done():
+            HEDGED_SUGGESTIONS.inc(outcome="deadline")
+            # A late answer is still cached for the next request.
+            self._late.add(llm)
+            llm.add_done_callback(
+                partial(self._remember_late, bits, key, start))
+            return ranked(f"The LLM did not answer within "
+                          f"{self._config.hedge_timeout_ms} ms")
+        try:
+            response = llm.result()
+        # Both langchain's OutputParserException and ValidationError.
+        except ValueError:
+            LLM_PARSE_FAILURES.inc()
+            HEDGED_SUGGESTIONS.inc(outcome="invalid")
+            return ranked("The LLM answer could not be parsed")
+        except Exception as e:
+            HEDGED_SUGGESTIONS.inc(outcome="error")
+            return ranked(f"The LLM call failed ({type(e).__name__})")
+        HEDGED_SUGGESTIONS.inc(outcome="llm")
+        self._remember(bits, key, response, start)
+        return response
+
+    def _remember_late(self, bits: int | None, key: tuple, start: float,
+                       task: asyncio.Task) -> None:
+        self._late.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if isinstance(error, ValueError):
+            LLM_PARSE_FAILURES.inc()
+        elif error is None:
+            self._remember(bits, key, task.result(), start)
+
+    # Yields each Move as soon as it is known, then the full AgentResponse.
+    async def _stream_board(self, board: Board, num_suggestions: int
+                            ) -> AsyncIterator[Move | AgentResponse]:
+        if self._config.backend != AgentBackend.GROQ:
+            cached = await self._ainvoke_board(board, num_suggestions)
+        else:
+            bits = self._cache_bits(board)
+            key = self._cache_key(num_suggestions)
+            cached = self._cached(bits, key, num_suggestions)
+        if cached is not None:
+            for move in cached.recommended_moves:
+                yield move
+            yield cached
+            return
+
+        start = time.perf_counter()
+        deadline = start + self._config.call_timeout_s
+        content, streamed = "", 0
+        await asyncio.wait_for(self._semaphore.acquire(),
+                               self._config.call_timeout_s)
+        try:
+            stream = await asyncio.wait_for(
+                self._async_client.chat.completions.create(
+                    messages=self._build_messages(board, num_suggestions),
+                    model=self._config.model,
+                    temperature=self._config.temperature,
+                    stream=True,
+                ),
+                deadline - time.perf_counter())
+            try:
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(
+                            anext(chunks), deadline - time.perf_counter())
+                    except StopAsyncIteration:
+                        break
+                    # Groq reports a stream's usage on its last chunk.
+                    if chunk.x_groq is not None:
+                        self._record_usage(chunk.x_groq.usage)
+                    delta = (chunk.choices[0].delta.content
+                             if chunk.choices else None)
+                    if not delta:
+                        continue
+                    content += delta
+                    # A move can only have completed once its object closed.
+                    if "}" not in delta:
+                        continue
+                    complete = self._complete_moves(content)
+                    for move in complete[streamed:]:
+                        if move is not None:
+                            yield move
+                    streamed = max(streamed, len(complete))
+            finally:
+                await stream.close()
+        finally:
+            self._semaphore.release()
+        LLM_LATENCY.observe(time.perf_counter() - start, mode="stream")
 
         try:
-            parsed = self._output_parser.parse(content)
-            return AgentResponse.model_validate(parsed)
-        except ValidationError:
+            response = self._parse_content(content)
+        # Both langchain's OutputParserException and ValidationError.
+        except ValueError:
+            LLM_PARSE_FAILURES.inc()
+            response = self._fallback_response()
+            if streamed:
+                response.recommended_moves = []
+            for move in response.recommended_moves:
+                yield move
+            yield response
+            return
+        for move in response.recommended_moves[streamed:]:
+            yield move
+        self._remember(bits, key, response, start)
+        yield response
+
+    def _complete_moves(self, content: str) -> list[Move | None]:
+        from langchain_core.utils.json import parse_partial_json
+        parsed = parse_partial_json(content)
+        if not isinstance(parsed, dict):
+            return []
+        moves = parsed.get("recommended_moves")
+        if not isinstance(moves, list):
+            return []
+        # The last move may still be streaming unless a later key started.
+        keys = list(parsed)
+        later_keys = keys[keys.index("recommended_moves") + 1:]
+        if not later_keys:
+            moves = moves[:-1]
+        complete = []
+        for move in moves:
+            try:
+                complete.append(Move.model_validate(move))
+            except ValidationError:
+                complete.append(None)
+        return complete
+
+    def _invoke_local(self, board: Board,
+                      num_suggestions: int) -> AgentResponse:
+        if len(board) != 4:
+            raise UnsupportedBoardError(
+                f"The {self._config.backend.value} backend only analyzes "
+                "4x4 boards")
+        if self._config.backend == AgentBackend.EXPECTIMAX:
+            return self._invoke_search(board, num_suggestions)
+        return self._invoke_rollout(board, num_suggestions)
+
+    async def _ainvoke_llm(self, board: Board,
+                           num_suggestions: int) -> AgentResponse:
+        with LLM_LATENCY.time(mode="async"):
+            chat_completion = await self._async_client.chat.completions.create(
+                messages=self._build_messages(board, num_suggestions),
+                model=self._config.model,
+                temperature=self._config.temperature
+            )
+        return self._parse_completion(chat_completion)
+
+    def _build_messages(self, board: Board,
+                        num_suggestions: int) -> list[dict[str, str]]:
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self._build_prompt(
+                board, num_suggestions)},
+        ]
+
+    def _record_usage(self, usage) -> None:
+        if usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens, kind="prompt")
+            LLM_TOKENS.inc(usage.completion_tokens, kind="completion")
+
+    def _parse_completion(self, chat_completion) -> AgentResponse:
+        self._record_usage(chat_completion.usage)
+        return self._parse_content(chat_completion.choices[0].message.content)
+
+    def _parse_content(self, content: str) -> AgentResponse:
+        parsed = self._output_parser.parse(content)
+        response = AgentResponse.model_validate(parsed)
+        response.source = SuggestionSource.LLM
+        return response
+
+    def _invoke_search(self, board: Board,
+                       num_suggestions: int) -> AgentResponse:
+        start = time.perf_counter()
+        ranked, depth = self._search.rank(logic.to_bitboard(board))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not ranked:
+            return AgentResponse(
+                recommended_moves=[],
+                game_analysis="No legal moves remain",
+                source=SuggestionSource.EXPECTIMAX
+            )
+
+        best = ranked[0][1]
+        moves = [
+            Move(
+                direction=direction,
+                reasoning=(f"Expected score {value:.0f} searching "
+                           f"{depth} move(s) ahead"),
+                confidence=math.exp((value - best) / CONFIDENCE_SCALE)
+            )
+            for direction, value in ranked[:num_suggestions]
+        ]
+        return AgentResponse(
+            recommended_moves=moves,
+            game_analysis=(f"Expectimax searched {depth} move(s) ahead in "
+                           f"{elapsed_ms:.1f} ms; "
+                           f"{len(ranked)} legal move(s)"),
+            source=SuggestionSource.EXPECTIMAX
+        )
+
+    def _invoke_rollout(self, board: Board,
+                        num_suggestions: int) -> AgentResponse:
+        start = time.perf_counter()
+        ranked = self._rollout.rank(logic.to_bitboard(board))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not ranked:
             return AgentResponse(
-                recommended_moves=[
-                    Move(
-                        direction="UP",
-                        reasoning="Default recommendation due to parsing error",
-                        confidence=0.0
-                    )
-                ],
-                game_analysis="Unable to analyze"
+                recommended_moves=[],
+                game_analysis="No legal moves remain",
+                source=SuggestionSource.ROLLOUT
+            )
+
+        moves = [
+            Move(
+                direction=stats.direction,
+                reasoning=(f"Mean final score {stats.mean_score:.0f} "
+                           f"(±{stats.score_stderr:.0f}) surviving "
+                           f"{stats.mean_moves:.0f} moves over "
+                           f"{stats.playouts} playouts"),
+                confidence=stats.confidence
             )
+            for stats in ranked[:num_suggestions]
+        ]
+        return AgentResponse(
+            recommended_moves=moves,
+            game_analysis=(f"Played {sum(s.playouts for s in ranked)} "
+                           f"playouts in {elapsed_ms:.0f} ms; "
+                           f"{len(ranked)} legal move(s)"),
+            source=SuggestionSource.ROLLOUT
+        )
 
-    def _build_prompt(self, num_suggestions: int) -> str:
-        board = self._store.load()
+    def _build_prompt(self, board: Board, num_suggestions: int) -> str:
         board_analysis = self._format_board_for_analysis(board)
-        metrics = self._calculate_board_metrics(board)
+        metrics = board_metrics(board)
 
         return f"""Analyze the following 2048 game state and recommend moves:
 
@@ -78,6 +508,10 @@ Board Metrics:
 - Empty spaces: {metrics['empty_spaces']}
 - Highest tile: {metrics['max_tile']}
 - Total value: {metrics['total_value']}
+- Possible merges: {metrics['merges']}
+- Monotonic rows/columns: {metrics['monotonic_lines']} of {metrics['lines']}
+- Roughness (tile exponent steps, lower is smoother): {metrics['roughness']}
+- Highest tile in a corner: {"yes" if metrics['max_in_corner'] else "no"}
 
 Provide exactly {num_suggestions} move recommendation(s).
 
@@ -98,11 +532,3 @@ Respond with the following JSON format (valid JSON only):
         for i, row in enumerate(board):
             board_str += f"Row {i}: {row}\n"
         return board_str
-
-    def _calculate_board_metrics(self, board: Board) -> dict:
-        flat = [val for row in board for val in row]
-        return {
-            "empty_spaces": sum(1 for val in flat if val == 0),
-            "max_tile": max(flat),
-            "total_value": sum(flat),
-        }
@@ -0,0 +1,106 @@
+import asyncio
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import AsyncIterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import logic
+from evaluation import board_metrics, rank_moves
+from expectimax import ExpectimaxSearch
+from schemas import Board, MAX_BOARD_SIZE, MIN_BOARD_SIZE
+
+
+# Boards per task: small enough that the first results stream back soon,
+# big enough that pickling is not most of the work.
+CHUNK_SIZE = 32
+
+
+def validate_board(board: Board) -> None:
+    """Raise ValueError unless `board` is a square board the game could
+    reach: a supported size, with empty cells or powers of two from 2."""
+    size = len(board)
+    if not MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE:
+        raise ValueError(f"size must be {MIN_BOARD_SIZE} to {MAX_BOARD_SIZE}")
+    if any(len(row) != size for row in board):
+        raise ValueError("board must be square")
+    for row in board:
+        for val in row:
+            if val and (val < 2 or val & (val - 1)):
+                raise ValueError(f"{val} is not a tile")
+    # 4x4 boards are searched as bitboards, which cap tiles at 2^15.
+    if size == 4:
+        logic.to_bitboard(board)
+
+
+def analyze_board(search: ExpectimaxSearch, board: Board) -> dict:
+    """Ranked moves and metrics of one board. 4x4 boards are ranked by
+    expectimax; other sizes, which it cannot search, one move deep."""
+    if len(board) == 4:
+        ranked, depth = search.rank(logic.to_bitboard(board))
+    else:
+        ranked = rank_moves(board)
+        depth = 1 if ranked else 0
+    return {
+        "moves": [{"direction": direction.value, "value": value}
+                  for direction, value in ranked],
+        "search_depth": depth,
+        "metrics": board_metrics(board),
+    }
+
+
+def analyze_boards(boards: list[Board], depth: int,
+                   time_budget_ms: int) -> list[dict]:
+    search = ExpectimaxSearch(depth, time_budget_ms)
+    return [analyze_board(search, board) for board in boards]
+
+
+class BatchAnalyzer:
+
+    def __init__(self, depth: int, time_budget_ms: int,
+                 workers: int | None = None):
+        self._depth = depth
+        self._time_budget_ms = time_budget_ms
+        self._workers = workers or os.cpu_count() or 1
+        self._executor: Executor | None = None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def analyze(self, boards: list[Board]) -> AsyncIterator[dict]:
+        """Yield the analysis of each board, in order, as soon as it and
+        every board before it are done. Only a few chunks per worker are
+        in flight, so a slow reader does not pile up results."""
+        if self._executor is None:
+            # The API runs threads, which forked workers would inherit
+            # mid-flight.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        chunks = iter(range(0, len(boards), CHUNK_SIZE))
+        pending = deque()
+
+        def submit() -> None:
+            start = next(chunks, None)
+            if start is not None:
+                pending.append(loop.run_in_executor(
+                    self._executor, analyze_boards,
+                    boards[start:start + CHUNK_SIZE], self._depth,
+                    self._time_budget_ms))
+
+        try:
+            for _ in range(2 * self._workers):
+                submit()
+            index = 0
+            while pending:
+                results = await pending.popleft()
+                submit()
+                for result in results:
+                    yield {"index": index, **result}
+                    index += 1
+        finally:
+            for future in pending:
+                future.cancel()
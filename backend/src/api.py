@@ -1,14 +1,39 @@
+import asyncio
+import json
 import logging
 import os
+import threading
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Annotated, TypeVar
+import orjson
 from dotenv import load_dotenv
-from fastapi import FastAPI, APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import (
+    FastAPI, APIRouter, Body, HTTPException, Query, Request, WebSocket,
+    WebSocketDisconnect)
+from fastapi.responses import (
+    PlainTextResponse, Response, StreamingResponse)
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
 
-from schemas import AgentResponse, AgentConfig, GameResponse, Direction
-from agent import GameAgent
-from store import Store
+from schemas import (
+    AgentResponse, AgentConfig, AgentBackend, BatchMoveResponse, Board,
+    ChannelEvent, ChannelMessage, ChannelRequest, GameResponse,
+    DEFAULT_TARGET, Direction, MAX_BITBOARD_TARGET, MAX_BOARD_SIZE,
+    MIN_BOARD_SIZE, Move, RolloutPolicy, Status)
+from agent import GameAgent, UnsupportedBoardError
+from analysis import BatchAnalyzer, validate_board
+from history import HistoryError
+from store import (
+    BoardLog, CachedStore, GameConflictError, GameLog, GameNotFoundError,
+    ReplayUnsupportedError, SqliteStore, Store)
 from service import Service
+import metrics
+import wire
 
 
 formatter = logging.Formatter(
@@ -21,45 +46,492 @@ logger.setLevel(logging.INFO)
 
 load_dotenv()
 router = APIRouter()
-store = Store()
-service = Service(store)
+store_backend = os.getenv("STORE_BACKEND", "log")
+# STORE_PATH overrides the backend's default file.
+store_path = os.getenv("STORE_PATH")
+store_args = {"path": Path(store_path)} if store_path else {}
+store_start = time.perf_counter()
+if store_backend == "log":
+    store = GameLog(
+        **store_args,
+        snapshot_interval=int(os.getenv("SNAPSHOT_INTERVAL", 64)),
+        capacity=int(os.getenv("STORE_CACHE_SIZE", 1024)),
+    )
+else:
+    store = BoardLog(CachedStore(
+        Store(**store_args) if store_backend == "json"
+        else SqliteStore(**store_args),
+        capacity=int(os.getenv("STORE_CACHE_SIZE", 1024)),
+        flush_interval=float(os.getenv("STORE_FLUSH_INTERVAL", 1.0)),
+    ))
+metrics.STARTUP_DURATION.set(time.perf_counter() - store_start, phase="store")
+service = Service(
+    store,
+    history_size=int(os.getenv("HISTORY_SIZE", 256)),
+    history_games=int(os.getenv("HISTORY_GAMES", 4096)),
+)
+analyzer = BatchAnalyzer(
+    depth=int(os.getenv("ANALYSIS_DEPTH", 2)),
+    time_budget_ms=int(os.getenv("ANALYSIS_TIME_MS", 50)),
+    workers=int(os.getenv("ANALYSIS_WORKERS", 0)) or None,
+)
 agent_config = AgentConfig(
     model=os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
     temperature=float(os.getenv("MODEL_TEMPERATURE", 0.2)),
+    backend=AgentBackend(os.getenv("AGENT_BACKEND", AgentBackend.GROQ)),
+    search_depth=int(os.getenv("SEARCH_DEPTH", 3)),
+    search_time_ms=int(os.getenv("SEARCH_TIME_MS", 20)),
+    rollout_playouts=int(os.getenv("ROLLOUT_PLAYOUTS", 200)),
+    rollout_policy=RolloutPolicy(os.getenv("ROLLOUT_POLICY", "RANDOM")),
+    rollout_time_ms=int(os.getenv("ROLLOUT_TIME_MS", 250)),
+    cache_size=int(os.getenv("SUGGESTION_CACHE_SIZE", 1024)),
+    cache_ttl_s=float(os.getenv("SUGGESTION_CACHE_TTL", 300)),
+    position_table=os.getenv("POSITION_TABLE"),
+    hedge_timeout_ms=int(os.getenv("HEDGE_TIMEOUT_MS", 0)),
+    max_concurrent_calls=int(os.getenv("MAX_CONCURRENT_SUGGESTIONS", 8)),
+    call_timeout_s=float(os.getenv("SUGGESTION_TIMEOUT", 15)),
 )
-agent = GameAgent(agent_config, store)
+# Built on first use (or by the WARM_UP hook) so that a cold start can
+# serve moves without paying for the LLM clients.
+agent: GameAgent | None = None
+agent_lock = threading.Lock()
+
+GameId = Annotated[
+    str, Query(min_length=1, max_length=64, pattern=r"^[A-Za-z0-9_-]+$")]
+MAX_BATCH_MOVES = 1000
+MAX_ANALYSIS_BOARDS = int(os.getenv("MAX_ANALYSIS_BOARDS", 10000))
+DISCONNECT_POLL_S = 0.25
+T = TypeVar("T")
+
+
+def get_agent() -> GameAgent:
+    global agent
+    if agent is None:
+        with agent_lock:
+            if agent is None:
+                start = time.perf_counter()
+                agent = GameAgent(agent_config, store)
+                metrics.STARTUP_DURATION.set(
+                    time.perf_counter() - start, phase="agent")
+    return agent
+
+
+def warm_up() -> None:
+    start = time.perf_counter()
+    get_agent().warm_up()
+    metrics.STARTUP_DURATION.set(time.perf_counter() - start, phase="warm_up")
+    logger.info("Warm-up finished; startup seconds=%s", {
+        phase: round(metrics.STARTUP_DURATION.value(phase=phase), 3)
+        for phase in ("store", "agent", "warm_up")})
+
+
+# Game routes build their bodies straight from the service's results: the
+# values are already valid, so a pydantic model would only add a second
+# validation and serialization pass. response_model still documents them.
+def _game_response(request: Request, game_id: str, board: Board,
+                   status: Status | None,
+                   legal_moves: list[Direction]) -> Response:
+    media_type = wire.negotiate(
+        request.headers.get("accept"),
+        (wire.HEX, wire.BINARY) if wire.compact(board) else ())
+    if media_type == wire.BINARY:
+        content = wire.pack_game(game_id, board, status, legal_moves)
+    else:
+        content = orjson.dumps({
+            "game_id": game_id,
+            "board": wire.encode_board(board, media_type),
+            "status": status,
+            "legal_moves": legal_moves,
+        })
+    return Response(content, media_type=media_type)
 
 
 @router.patch("/restart", response_model=GameResponse)
-def restart(request: Request):
-    logger.info("/api/restart called; client=%s", request.client)
-    response = GameResponse(board=service.restart_game(), status=None)
-    return JSONResponse(response.model_dump())
+def restart(
+    request: Request,
+    game_id: GameId | None = None,
+    size: Annotated[
+        int, Query(ge=MIN_BOARD_SIZE, le=MAX_BOARD_SIZE)] = 4,
+    target: Annotated[int, Query(ge=4)] = DEFAULT_TARGET,
+):
+    logger.info("/api/restart called; game=%s size=%d target=%d client=%s",
+                game_id, size, target, request.client)
+    if target & (target - 1):
+        raise HTTPException(
+            status_code=422, detail="Target must be a power of two")
+    if size == 4 and target > MAX_BITBOARD_TARGET:
+        raise HTTPException(
+            status_code=422,
+            detail=f"4x4 targets go up to {MAX_BITBOARD_TARGET}")
+    game_id = game_id or uuid.uuid4().hex
+    board, legal_moves = service.restart_game(game_id, size, target)
+    return _game_response(request, game_id, board, None, legal_moves)
 
 
 @router.patch("/move/{direction}", response_model=GameResponse)
-def move(direction: Direction, request: Request):
-    logger.info("/api/move/%s called; client=%s",
-                direction.name, request.client)
-    board, result = service.make_move(direction)
-    response = GameResponse(board=board, status=result)
-    return JSONResponse(response.model_dump())
+def move(direction: Direction, game_id: GameId, request: Request):
+    logger.info("/api/move/%s called; game=%s client=%s",
+                direction.name, game_id, request.client)
+    try:
+        board, result, legal_moves = service.make_move(game_id, direction)
+    except GameNotFoundError:
+        raise HTTPException(status_code=404, detail="Game not found")
+    except GameConflictError:
+        raise HTTPException(status_code=409, detail="Game changed; retry")
+    return _game_response(request, game_id, board, result, legal_moves)
+
+
+@router.patch("/moves", response_model=BatchMoveResponse)
+def moves(
+    directions: Annotated[
+        list[Direction], Body(min_length=1, max_length=MAX_BATCH_MOVES)],
+    game_id: GameId,
+    request: Request,
+):
+    logger.info("/api/moves called; game=%s moves=%d client=%s",
+                game_id, len(directions), request.client)
+    try:
+        board, statuses, legal_moves = service.make_moves(
+            game_id, directions)
+    except GameNotFoundError:
+        raise HTTPException(status_code=404, detail="Game not found")
+    except GameConflictError:
+        raise HTTPException(status_code=409, detail="Game changed; retry")
+    media_type = wire.negotiate(request.headers.get("accept"),
+                                (wire.HEX,) if wire.compact(board) else ())
+    return Response(orjson.dumps({
+        "game_id": game_id,
+        "board": wire.encode_board(board, media_type),
+        "statuses": statuses,
+        "legal_moves": legal_moves,
+    }), media_type=media_type)
+
+
+def _history_move(name: str, game_id: str, request: Request) -> Response:
+    logger.info("/api/%s called; game=%s client=%s",
+                name, game_id, request.client)
+    try:
+        board, legal_moves = getattr(service, name)(game_id)
+    except GameNotFoundError:
+        raise HTTPException(status_code=404, detail="Game not found")
+    except GameConflictError:
+        raise HTTPException(status_code=409, detail="Game changed; retry")
+    except HistoryError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _game_response(request, game_id, board, None, legal_moves)
+
+
+@router.patch("/undo", response_model=GameResponse)
+def undo(game_id: GameId, request: Request):
+    return _history_move("undo", game_id, request)
+
+
+@router.patch("/redo", response_model=GameResponse)
+def redo(game_id: GameId, request: Request):
+    return _history_move("redo", game_id, request)
+
+
+@router.get("/replay", response_model=GameResponse)
+def replay(game_id: GameId, move: Annotated[int, Query(ge=0)],
+           request: Request):
+    logger.info("/api/replay called; game=%s move=%d client=%s",
+                game_id, move, request.client)
+    try:
+        board, legal_moves = service.replay(game_id, move)
+    except GameNotFoundError:
+        raise HTTPException(status_code=404, detail="Move not found")
+    except ReplayUnsupportedError:
+        raise HTTPException(
+            status_code=501, detail="Replay needs STORE_BACKEND=log")
+    return _game_response(request, game_id, board, None, legal_moves)
+
+
+async def _analysis_lines(boards: list[Board]) -> AsyncIterator[bytes]:
+    async for result in analyzer.analyze(boards):
+        yield orjson.dumps(result) + b"\n"
+
+
+@router.post("/analyze")
+async def analyze(
+    boards: Annotated[
+        list[Board], Body(min_length=1, max_length=MAX_ANALYSIS_BOARDS)],
+    request: Request,
+):
+    """Rank the moves of every board and measure it, without touching any
+    game or the LLM. Streams one JSON line per board, in order."""
+    logger.info("/api/analyze called; boards=%d client=%s",
+                len(boards), request.client)
+    for i, board in enumerate(boards):
+        try:
+            validate_board(board)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Board {i}: {e}")
+    return StreamingResponse(
+        _analysis_lines(boards), media_type="application/x-ndjson")
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def _cancel_on_disconnect(request: Request, coro: Awaitable[T]) -> T:
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
 
 
 @router.post("/suggest/{num_suggestions}", response_model=AgentResponse)
-def suggest(num_suggestions: int, request: Request):
-    logger.info("/api/suggest called; client=%s", request.client)
+async def suggest(num_suggestions: int, game_id: GameId, request: Request):
+    logger.info("/api/suggest called; game=%s client=%s",
+                game_id, request.client)
     try:
-        output: AgentResponse = agent.invoke(num_suggestions)
+        output: AgentResponse = await _cancel_on_disconnect(
+            request, get_agent().ainvoke(game_id, num_suggestions))
+    except ClientDisconnected:
+        logger.info("/api/suggest cancelled; client=%s disconnected",
+                    request.client)
+        return Response(status_code=499)
+    except GameNotFoundError:
+        raise HTTPException(status_code=404, detail="Game not found")
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Agent timed out")
+    except UnsupportedBoardError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.exception("Agent invocation error: %s", e)
         raise HTTPException(status_code=500, detail="Agent invocation failed")
-    return JSONResponse(output.model_dump())
+    return Response(output.model_dump_json(), media_type=wire.JSON)
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
-app = FastAPI(title="2048 API")
+async def _suggestion_events(
+    suggestions: AsyncIterator[Move | AgentResponse],
+) -> AsyncIterator[str]:
+    try:
+        async for item in suggestions:
+            if isinstance(item, Move):
+                yield _sse_event("move", item.model_dump(mode="json"))
+            else:
+                yield _sse_event(
+                    "analysis", {"game_analysis": item.game_analysis})
+    except TimeoutError:
+        yield _sse_event("error", {"detail": "Agent timed out"})
+    except Exception as e:
+        logger.exception("Agent streaming error: %s", e)
+        yield _sse_event("error", {"detail": "Agent invocation failed"})
+
+
+@router.post("/suggest/{num_suggestions}/stream")
+async def suggest_stream(num_suggestions: int, game_id: GameId,
+                         request: Request):
+    logger.info("/api/suggest/stream called; game=%s client=%s",
+                game_id, request.client)
+    try:
+        suggestions = await get_agent().astream(game_id, num_suggestions)
+    except GameNotFoundError:
+        raise HTTPException(status_code=404, detail="Game not found")
+    # StreamingResponse stops iterating, which closes the LLM stream, as
+    # soon as the client disconnects.
+    return StreamingResponse(
+        _suggestion_events(suggestions),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class GameChannel:
+    """One WebSocket per game: the client sends ChannelMessages and gets
+    GAME frames (a GameResponse), SUGGESTION frames (an AgentResponse) and
+    ERROR frames back. Suggestions run alongside moves and are pushed when
+    ready."""
+
+    def __init__(self, websocket: WebSocket, game_id: str):
+        self._websocket = websocket
+        self._game_id = game_id
+        self._send_lock = asyncio.Lock()
+        self._suggestions: set[asyncio.Task] = set()
+
+    async def run(self) -> None:
+        try:
+            try:
+                board, legal_moves = await run_in_threadpool(
+                    service.state, self._game_id)
+            except GameNotFoundError:
+                board, legal_moves = await run_in_threadpool(
+                    service.restart_game, self._game_id)
+            await self._send_game(board, None, legal_moves)
+            while True:
+                text = await self._websocket.receive_text()
+                start = time.perf_counter()
+                try:
+                    message = ChannelMessage.model_validate_json(text)
+                except ValidationError as e:
+                    await self._send_error("Invalid message: " + "; ".join(
+                        error["msg"] for error in e.errors()))
+                    continue
+                await self._handle(message)
+                metrics.REQUEST_LATENCY.observe(
+                    time.perf_counter() - start,
+                    route=f"game_channel_{message.type.value.lower()}")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in self._suggestions:
+                task.cancel()
+
+    async def _handle(self, message: ChannelMessage) -> None:
+        if message.type == ChannelRequest.SUGGEST:
+            task = asyncio.create_task(
+                self._suggest(message.num_suggestions))
+            self._suggestions.add(task)
+            task.add_done_callback(self._suggestions.discard)
+            return
+        try:
+            if message.type == ChannelRequest.RESTART:
+                board, legal_moves = await run_in_threadpool(
+                    service.restart_game, self._game_id, message.size,
+                    message.target)
+                status = None
+            else:
+                board, status, legal_moves = await run_in_threadpool(
+                    service.make_move, self._game_id, message.direction)
+        except GameNotFoundError:
+            await self._send_error("Game not found")
+            return
+        except GameConflictError:
+            await self._send_error("Game changed; retry")
+            return
+        await self._send_game(board, status, legal_moves)
+
+    async def _suggest(self, num_suggestions: int) -> None:
+        try:
+            output = await get_agent().ainvoke(
+                self._game_id, num_suggestions)
+        except GameNotFoundError:
+            await self._send_error("Game not found")
+        except TimeoutError:
+            await self._send_error("Agent timed out")
+        except UnsupportedBoardError as e:
+            await self._send_error(str(e))
+        except Exception as e:
+            logger.exception("Agent invocation error: %s", e)
+            await self._send_error("Agent invocation failed")
+        else:
+            await self._send(ChannelEvent.SUGGESTION, output.model_dump())
+
+    async def _send_game(self, board, status, legal_moves) -> None:
+        await self._send(ChannelEvent.GAME, {
+            "game_id": self._game_id, "board": board, "status": status,
+            "legal_moves": legal_moves})
+
+    async def _send_error(self, detail: str) -> None:
+        await self._send(ChannelEvent.ERROR, {"detail": detail})
+
+    async def _send(self, event: ChannelEvent, data: dict) -> None:
+        # Suggestion tasks and the receive loop share the socket.
+        async with self._send_lock:
+            await self._websocket.send_text(
+                orjson.dumps({"type": event, **data}).decode())
+
+
+@router.websocket("/ws")
+async def game_channel(websocket: WebSocket, game_id: GameId | None = None):
+    await websocket.accept()
+    game_id = game_id or uuid.uuid4().hex
+    logger.info("/api/ws opened; game=%s client=%s",
+                game_id, websocket.client)
+    await GameChannel(websocket, game_id).run()
+    logger.info("/api/ws closed; game=%s client=%s",
+                game_id, websocket.client)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    store.start()
+    # Warming up in the background keeps it off the first request's path
+    # without delaying readiness.
+    warm = (asyncio.create_task(asyncio.to_thread(warm_up))
+            if os.getenv("WARM_UP", "").lower() in ("1", "true") else None)
+    yield
+    if warm is not None:
+        await warm
+    if agent is not None:
+        agent.close()
+        logger.info("Suggestion cache stats=%s", agent.cache_stats())
+    analyzer.close()
+    store.close()
+    logger.info("Store flushed on shutdown; stats=%s", store.stats())
+
+
+app = FastAPI(title="2048 API", lifespan=lifespan)
 app.include_router(router, prefix="/api")
 
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Routing fills in the matched route; unmatched paths are not recorded.
+    route = request.scope.get("route")
+    if route is None or route.name == "metrics_endpoint":
+        return response
+    body = response.body_iterator
+
+    # Streaming routes send headers long before they finish, so latency is
+    # recorded once the body has been sent (or the client went away).
+    async def timed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            metrics.REQUEST_LATENCY.observe(
+                time.perf_counter() - start, route=route.name)
+
+    response.body_iterator = timed_body()
+    return response
+
+
+def _samples(stats: dict[str, float], names: dict[str, tuple[str, ...]],
+             scale: float = 1) -> dict[tuple[str, ...], float]:
+    """Metric samples, keyed by label values, for the stats in `names`;
+    absent stats (a disabled cache, a store without one) are left out."""
+    return {labels: stats[name] * scale
+            for name, labels in names.items() if name in stats}
+
+
+def _suggestion_cache_stats() -> dict[str, float]:
+    return agent.cache_stats() if agent is not None else {}
+
+
+metrics.STORE_CACHE_EVENTS.collect_from(lambda: _samples(store.stats(), {
+    name: (name,) for name in
+    ("hits", "misses", "flushes", "flushed_boards", "replayed_moves")}))
+metrics.STORE_CACHE_ENTRIES.collect_from(lambda: _samples(
+    store.stats(), {"cached": ("cached",), "dirty": ("dirty",)}))
+metrics.SUGGESTION_CACHE_LOOKUPS.collect_from(lambda: _samples(
+    _suggestion_cache_stats(), {"hits": ("hit",), "misses": ("miss",)}))
+metrics.SUGGESTION_CACHE_HIT_RATIO.collect_from(lambda: _samples(
+    _suggestion_cache_stats(), {"hit_rate": ()}))
+metrics.SUGGESTION_CACHE_SAVED_LATENCY.collect_from(lambda: _samples(
+    _suggestion_cache_stats(), {"saved_latency_ms": ()}, scale=0.001))
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return PlainTextResponse(
+        metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 origins = os.getenv("ALLOWED_ORIGINS", "").split(",")
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,104 @@
+import numpy as np
+
+import logic
+from schemas import Board, Direction
+
+
+# Boards are (N, 4, 4) uint8 arrays of tile exponents (0 for empty), the
+# same nibbles the bitboard engine packs, so rows can be moved with the
+# bitboard row transitions.
+DIRECTIONS = list(Direction)
+
+_ROW_LEFT = np.array(
+    [logic.move_left_bits(row) for row in range(0x10000)], dtype=np.uint16)
+
+
+def from_boards(boards: list[Board]) -> np.ndarray:
+    values = np.array(boards, dtype=np.uint32).reshape(-1, 4, 4)
+    exponents = np.zeros(values.shape, dtype=np.uint8)
+    filled = values > 0
+    exponents[filled] = np.log2(values[filled]).astype(np.uint8)
+    return exponents
+
+
+def to_boards(boards: np.ndarray) -> list[Board]:
+    values = np.where(boards > 0, 1 << boards.astype(np.uint32), 0)
+    return values.tolist()
+
+
+def init_boards(n: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.integers(0, 2, size=(n, 4, 4), dtype=np.uint8)
+
+
+def _move_rows_left(rows: np.ndarray) -> np.ndarray:
+    rows = rows.astype(np.int32)
+    keys = (rows[..., 0] << 12 | rows[..., 1] << 8
+            | rows[..., 2] << 4 | rows[..., 3])
+    moved = _ROW_LEFT[keys]
+    return np.stack(
+        [moved >> 12, moved >> 8 & 0xF, moved >> 4 & 0xF, moved & 0xF],
+        axis=-1,
+    ).astype(np.uint8)
+
+
+def _move_all(boards: np.ndarray, direction: Direction) -> np.ndarray:
+    if direction == Direction.LEFT:
+        return _move_rows_left(boards)
+    if direction == Direction.RIGHT:
+        return _move_rows_left(boards[:, :, ::-1])[:, :, ::-1]
+    columns = boards.transpose(0, 2, 1)
+    if direction == Direction.UP:
+        return _move_rows_left(columns).transpose(0, 2, 1)
+    return _move_rows_left(columns[:, :, ::-1])[:, :, ::-1].transpose(0, 2, 1)
+
+
+# `directions` is either one Direction for every game or an (N,) array of
+# indices into DIRECTIONS; the returned mask marks games the move changed.
+def move(boards: np.ndarray, directions: Direction | np.ndarray
+         ) -> tuple[np.ndarray, np.ndarray]:
+    if isinstance(directions, Direction):
+        moved = _move_all(boards, directions)
+    else:
+        moved = boards.copy()
+        for index, direction in enumerate(DIRECTIONS):
+            selected = np.flatnonzero(directions == index)
+            if selected.size:
+                moved[selected] = _move_all(boards[selected], direction)
+    changed = (moved != boards).any(axis=(1, 2))
+    return np.ascontiguousarray(moved), changed
+
+
+def spawn_tiles(boards: np.ndarray, rng: np.random.Generator,
+                mask: np.ndarray | None = None) -> np.ndarray:
+    flat = boards.reshape(len(boards), 16).copy()
+    empty = flat == 0
+    counts = empty.sum(axis=1)
+    targets = counts > 0
+    if mask is not None:
+        targets &= mask
+    games = np.flatnonzero(targets)
+    # Pick the k-th empty cell uniformly and a 2 or 4 with equal odds,
+    # as logic.spawn_tile does.
+    k = (rng.random(games.size) * counts[games]).astype(np.int64)
+    cells = (empty[games].cumsum(axis=1) > k[:, None]).argmax(axis=1)
+    flat[games, cells] = rng.integers(1, 3, size=games.size, dtype=np.uint8)
+    return flat.reshape(boards.shape)
+
+
+def step(boards: np.ndarray, directions: Direction | np.ndarray,
+         rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    moved, changed = move(boards, directions)
+    return spawn_tiles(moved, rng, changed), changed
+
+
+def is_win(boards: np.ndarray,
+           exponent: int = logic.WIN_EXPONENT) -> np.ndarray:
+    # Any tile at or past the target wins, as in logic.is_win.
+    return (boards >= exponent).any(axis=(1, 2))
+
+
+def is_lose(boards: np.ndarray) -> np.ndarray:
+    full = (boards != 0).all(axis=(1, 2))
+    horizontal = (boards[:, :, 1:] == boards[:, :, :-1]).any(axis=(1, 2))
+    vertical = (boards[:, 1:, :] == boards[:, :-1, :]).any(axis=(1, 2))
+    return full & ~horizontal & ~vertical
@@ -0,0 +1,242 @@
+import argparse
+import random
+import struct
+import sys
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from pathlib import Path
+
+import numpy as np
+
+import logic
+from expectimax import ExpectimaxSearch
+from schemas import Direction
+
+
+# File layout: a header (magic, step count, game count), then one packed
+# STEP_DTYPE record per move in game order, then zero padding to an 8-byte
+# boundary and the uint64 index of game offsets (game i is records
+# offsets[i]:offsets[i + 1]). Integers are little-endian.
+MAGIC = b"2048TRJ1"
+HEADER = struct.Struct("<8sQQ")
+STEP_DTYPE = np.dtype([
+    ("board", "<u8"),      # bitboard before the move, as logic packs it
+    ("direction", "u1"),   # index into DIRECTIONS
+    ("reward", "<u4"),     # score gained by the move's merges
+])
+OFFSET_DTYPE = np.dtype("<u8")
+DIRECTIONS = list(Direction)
+MAX_GAME_MOVES = 100000
+
+Policy = Callable[[int, list[Direction], random.Random], Direction]
+
+
+def _row_reward(row: int) -> int:
+    tiles = [e for e in (row >> 12, row >> 8 & 0xF, row >> 4 & 0xF, row & 0xF)
+             if e != 0]
+    reward, i = 0, 0
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1] and tiles[i] < 0xF:
+            reward += 2 << tiles[i]
+            i += 2
+        else:
+            i += 1
+    return reward
+
+
+@cache
+def _reward_tables() -> tuple[list[int], list[int]]:
+    left = [_row_reward(row) for row in range(0x10000)]
+    right = [left[logic.reverse_row(row)] for row in range(0x10000)]
+    return left, right
+
+
+def move_reward(bits: int, direction: Direction) -> int:
+    left, right = _reward_tables()
+    if direction in (Direction.UP, Direction.DOWN):
+        bits = logic.transpose_bits(bits)
+    table = left if direction in (Direction.LEFT, Direction.UP) else right
+    return (table[bits >> 48] + table[bits >> 32 & 0xFFFF]
+            + table[bits >> 16 & 0xFFFF] + table[bits & 0xFFFF])
+
+
+def random_policy(bits: int, legal: list[Direction],
+                  rng: random.Random) -> Direction:
+    return rng.choice(legal)
+
+
+def greedy_policy(bits: int, legal: list[Direction],
+                  rng: random.Random) -> Direction:
+    # Most empty cells after the move, then the biggest merge reward.
+    def empty_after(direction: Direction) -> tuple[int, int]:
+        moved = logic.BIT_MOVES[direction](bits)
+        return (len(logic.empty_cells_bits(moved)),
+                move_reward(bits, direction))
+    return max(legal, key=empty_after)
+
+
+class ExpectimaxPolicy:
+
+    def __init__(self, max_depth: int = 2, time_budget_ms: int = 20):
+        self._search = ExpectimaxSearch(max_depth, time_budget_ms)
+
+    def __call__(self, bits: int, legal: list[Direction],
+                 rng: random.Random) -> Direction:
+        ranked, _ = self._search.rank(bits)
+        return ranked[0][0]
+
+
+POLICIES: dict[str, Callable[[], Policy]] = {
+    "random": lambda: random_policy,
+    "greedy": lambda: greedy_policy,
+    "expectimax": ExpectimaxPolicy,
+}
+
+
+def play_game(policy: Policy, rng: random.Random) -> np.ndarray:
+    """Play one game to a win or loss and return its STEP_DTYPE records."""
+    boards, directions, rewards = [], [], []
+    bits = logic.init_bits(rng)
+    while len(boards) < MAX_GAME_MOVES and not logic.is_win_bits(bits):
+        legal = [d for d in DIRECTIONS if d in logic.legal_moves_bits(bits)]
+        if not legal:
+            break
+        direction = policy(bits, legal, rng)
+        boards.append(bits)
+        directions.append(DIRECTIONS.index(direction))
+        rewards.append(move_reward(bits, direction))
+        bits = logic.spawn_bits(logic.BIT_MOVES[direction](bits), rng)
+
+    steps = np.empty(len(boards), dtype=STEP_DTYPE)
+    steps["board"] = boards
+    steps["direction"] = directions
+    steps["reward"] = rewards
+    return steps
+
+
+def _play_games(policy: Policy, seed: int, first: int,
+                count: int) -> list[np.ndarray]:
+    # Every game has its own seed, so the output does not depend on how the
+    # games were split between workers.
+    return [play_game(policy, random.Random(f"{seed}:{i}"))
+            for i in range(first, first + count)]
+
+
+class DatasetWriter:
+
+    def __init__(self, path: Path):
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, 0, 0))
+        self._offsets = [0]
+
+    def __enter__(self) -> "DatasetWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write_game(self, steps: np.ndarray) -> None:
+        self._file.write(steps.astype(STEP_DTYPE, copy=False).tobytes())
+        self._offsets.append(self._offsets[-1] + len(steps))
+
+    @property
+    def num_steps(self) -> int:
+        return self._offsets[-1]
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        # The header is written last, so an interrupted file reads as empty
+        # rather than as a truncated index.
+        self._file.write(b"\0" * (-self._file.tell() % OFFSET_DTYPE.itemsize))
+        self._file.write(np.array(self._offsets, dtype=OFFSET_DTYPE).tobytes())
+        self._file.seek(0)
+        self._file.write(HEADER.pack(
+            MAGIC, self._offsets[-1], len(self._offsets) - 1))
+        self._file.close()
+
+
+def generate(path: Path, games: int, policy: Policy, seed: int = 0,
+             workers: int = 1, chunk: int = 64) -> int:
+    """Play `games` games and write them to `path`; returns the step count.
+
+    With more than one worker the policy must be picklable."""
+    starts = range(0, games, chunk)
+    counts = [min(chunk, games - start) for start in starts]
+    with DatasetWriter(path) as writer:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                batches = executor.map(
+                    _play_games, [policy] * len(counts),
+                    [seed] * len(counts), starts, counts)
+                for batch in batches:
+                    for steps in batch:
+                        writer.write_game(steps)
+        else:
+            for start, count in zip(starts, counts):
+                for steps in _play_games(policy, seed, start, count):
+                    writer.write_game(steps)
+        return writer.num_steps
+
+
+class Dataset:
+    """Read-only view of a dataset file; arrays share the file mapping."""
+
+    def __init__(self, path: Path):
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not a trajectory dataset")
+        magic, num_steps, num_games = HEADER.unpack(
+            self._map[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a trajectory dataset")
+        end = HEADER.size + num_steps * STEP_DTYPE.itemsize
+        index = end + -end % OFFSET_DTYPE.itemsize
+        self.steps = self._map[HEADER.size:end].view(STEP_DTYPE)
+        self.offsets = self._map[
+            index:index + (num_games + 1) * OFFSET_DTYPE.itemsize
+        ].view(OFFSET_DTYPE)
+
+    @property
+    def boards(self) -> np.ndarray:
+        return self.steps["board"]
+
+    @property
+    def directions(self) -> np.ndarray:
+        return self.steps["direction"]
+
+    @property
+    def rewards(self) -> np.ndarray:
+        return self.steps["reward"]
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+    def game(self, i: int) -> np.ndarray:
+        return self.steps[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self.game(i)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Play games and write their trajectories to a dataset")
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", choices=sorted(POLICIES),
+                        default="random")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    steps = generate(args.output, args.games, POLICIES[args.policy](),
+                     args.seed, args.workers)
+    print(f"Wrote {args.games} games ({steps} steps) to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+from collections.abc import Sequence
+from dataclasses import dataclass
+from functools import cache
+
+import logic
+from schemas import Board, Direction
+
+
+# Per-line features are packed into one integer per row so that a board's
+# totals are the sum of eight lookups (four rows, four columns).
+_FIELD_BITS = 16
+_FIELD_MASK = (1 << _FIELD_BITS) - 1
+_EMPTY, _MERGES, _MONOTONIC, _ROUGHNESS = (
+    i * _FIELD_BITS for i in range(4))
+
+
+@dataclass(frozen=True)
+class Evaluation:
+    empty: int
+    merges: int            # adjacent equal tiles along rows and columns
+    monotonic_lines: int   # rows and columns whose tiles are in order
+    lines: int
+    roughness: int         # exponent steps between neighbouring tiles
+    max_tile: int
+    max_in_corner: bool
+    value: float           # board_value; what search and ranking maximize
+
+
+def _line_features(line: Sequence[int]) -> tuple[int, int, int, int]:
+    """Empty cells, merges, monotonic (0 or 1) and roughness of a line of
+    tile exponents. Empty cells are skipped when comparing neighbours."""
+    tiles = [e for e in line if e != 0]
+    pairs = list(zip(tiles, tiles[1:]))
+    merges = sum(1 for a, b in pairs if a == b)
+    monotonic = (all(a <= b for a, b in pairs)
+                 or all(a >= b for a, b in pairs))
+    roughness = sum(abs(a - b) for a, b in pairs)
+    return len(line) - len(tiles), merges, int(monotonic), roughness
+
+
+def _line_value(line: Sequence[int]) -> float:
+    """A line's share of board_value: empty cells and merges count for it;
+    tiles out of order, weighted towards big ones, and big tiles at all
+    count against it."""
+    empty, merges, _, _ = _line_features(line)
+    mono_left = sum(max(0, a**4 - b**4) for a, b in zip(line, line[1:]))
+    mono_right = sum(max(0, b**4 - a**4) for a, b in zip(line, line[1:]))
+    return (200000 + 270 * empty + 700 * merges
+            - 47 * min(mono_left, mono_right)
+            - 11 * sum(e**3.5 for e in line))
+
+
+def _row_exponents(row: int) -> list[int]:
+    return [row >> 12, row >> 8 & 0xF, row >> 4 & 0xF, row & 0xF]
+
+
+@cache
+def _feature_tables() -> tuple[list[int], list[int], list[int],
+                               list[float]]:
+    features, maxima, ends, values = [], [], [], []
+    for row in range(0x10000):
+        line = _row_exponents(row)
+        empty, merges, monotonic, roughness = _line_features(line)
+        features.append(empty << _EMPTY | merges << _MERGES
+                        | monotonic << _MONOTONIC | roughness << _ROUGHNESS)
+        maxima.append(max(line))
+        ends.append(max(line[0], line[-1]))
+        values.append(_line_value(line))
+    return features, maxima, ends, values
+
+
+def heuristic(bits: int) -> float:
+    """board_value of a 4x4 bitboard, for search leaves: the value lookups
+    of evaluate without the rest of its features."""
+    table = _feature_tables()[3]
+    cols = logic.transpose_bits(bits)
+    return (table[bits >> 48] + table[bits >> 32 & 0xFFFF]
+            + table[bits >> 16 & 0xFFFF] + table[bits & 0xFFFF]
+            + table[cols >> 48] + table[cols >> 32 & 0xFFFF]
+            + table[cols >> 16 & 0xFFFF] + table[cols & 0xFFFF])
+
+
+def evaluate(bits: int) -> Evaluation:
+    features, maxima, ends, values = _feature_tables()
+    cols = logic.transpose_bits(bits)
+    r0, r1, r2, r3 = (bits >> 48, bits >> 32 & 0xFFFF, bits >> 16 & 0xFFFF,
+                      bits & 0xFFFF)
+    c0, c1, c2, c3 = (cols >> 48, cols >> 32 & 0xFFFF, cols >> 16 & 0xFFFF,
+                      cols & 0xFFFF)
+    total = (features[r0] + features[r1] + features[r2] + features[r3]
+             + features[c0] + features[c1] + features[c2] + features[c3])
+    top = max(maxima[r0], maxima[r1], maxima[r2], maxima[r3])
+    return Evaluation(
+        # Every empty cell is counted once in its row and once in its column.
+        empty=(total >> _EMPTY & _FIELD_MASK) // 2,
+        merges=total >> _MERGES & _FIELD_MASK,
+        monotonic_lines=total >> _MONOTONIC & _FIELD_MASK,
+        lines=8,
+        roughness=total >> _ROUGHNESS & _FIELD_MASK,
+        max_tile=1 << top if top else 0,
+        max_in_corner=max(ends[r0], ends[r3]) == top,
+        value=(values[r0] + values[r1] + values[r2] + values[r3]
+               + values[c0] + values[c1] + values[c2] + values[c3]),
+    )
+
+
+def evaluate_board(board: Board) -> Evaluation:
+    """Evaluate a board of any size; 4x4 boards use the row tables."""
+    if len(board) == 4:
+        try:
+            return evaluate(logic.to_bitboard(board))
+        except ValueError:
+            pass
+    exponents = [[v.bit_length() - 1 if v else 0 for v in row]
+                 for row in board]
+    lines = exponents + [list(column) for column in zip(*exponents)]
+    features = [_line_features(line) for line in lines]
+    top = max(max(row) for row in exponents)
+    corners = (exponents[0][0], exponents[0][-1], exponents[-1][0],
+               exponents[-1][-1])
+    return Evaluation(
+        empty=sum(f[0] for f in features[:len(board)]),
+        merges=sum(f[1] for f in features),
+        monotonic_lines=sum(f[2] for f in features),
+        lines=len(lines),
+        roughness=sum(f[3] for f in features),
+        max_tile=1 << top if top else 0,
+        max_in_corner=top in corners,
+        value=sum(_line_value(line) for line in lines),
+    )
+
+
+def board_metrics(board: Board) -> dict:
+    """Evaluation of `board` under the names the prompt and analyses use."""
+    evaluation = evaluate_board(board)
+    return {
+        "empty_spaces": evaluation.empty,
+        "max_tile": evaluation.max_tile,
+        "total_value": sum(map(sum, board)),
+        "merges": evaluation.merges,
+        "monotonic_lines": evaluation.monotonic_lines,
+        "lines": evaluation.lines,
+        "roughness": evaluation.roughness,
+        "max_in_corner": evaluation.max_in_corner,
+    }
+
+
+def _points(board: Board) -> int:
+    # A 2^e tile took (e - 1) * 2^e points of merges to build, so a move
+    # scores the difference in points between the boards either side of it.
+    return sum((v.bit_length() - 2) * v for row in board for v in row if v)
+
+
+def board_value(evaluation: Evaluation) -> float:
+    """Score of an evaluated board of any size; higher is better. It sums
+    _line_value over rows and columns, the same score expectimax gives its
+    leaves (see heuristic)."""
+    return evaluation.value
+
+
+# board_value rewards merges still to be made, which a single move ahead
+# cannot cash in, so rank_moves weights points actually scored well above
+# it: the most points win and the board breaks ties. Chosen from greedy
+# self-play, where it outlasted lower weights.
+POINTS_WEIGHT = 5000
+
+
+def rank_moves(board: Board) -> list[tuple[Direction, float]]:
+    """Legal moves ordered best first by the points each scores, weighted,
+    plus the value of the board it leaves, looking a single move ahead."""
+    points = _points(board)
+    ranked = []
+    for direction in Direction:
+        after = logic.slide(board, direction)
+        if after != board:
+            ranked.append((direction,
+                           POINTS_WEIGHT * (_points(after) - points)
+                           + board_value(evaluate_board(after))))
+    ranked.sort(key=lambda m: -m[1])
+    return ranked
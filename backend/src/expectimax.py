@@ -0,0 +1,76 @@
+import time
+
+import logic
+from evaluation import heuristic
+from schemas import Direction
+
+
+MOVES = tuple(logic.BIT_MOVES.items())
+# logic.spawn_tile picks 2 and 4 with equal probability.
+SPAWNS = ((1, 0.5), (2, 0.5))
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class ExpectimaxSearch:
+
+    def __init__(self, max_depth: int, time_budget_ms: int):
+        self._max_depth = max_depth
+        self._time_budget = time_budget_ms / 1000
+
+    def rank(self, bits: int) -> tuple[list[tuple[Direction, float]], int]:
+        """Return legal moves ordered best first with their expected values,
+        and the deepest search depth that completed within the budget."""
+        children = [(d, fn(bits)) for d, fn in MOVES]
+        children = [(d, child) for d, child in children if child != bits]
+        if not children:
+            return [], 0
+        # Threads share this object, so each call keeps its own state.
+        search = _Search()
+        ranked, depth = [], 0
+        start = time.perf_counter()
+        for d in range(1, self._max_depth + 1):
+            try:
+                values = [(direction, search.chance(child, d - 1))
+                          for direction, child in children]
+            except SearchTimeout:
+                break
+            ranked, depth = sorted(values, key=lambda m: -m[1]), d
+            # Depth 1 always completes so there is an answer to return.
+            search.deadline = start + self._time_budget
+        return ranked, depth
+
+
+class _Search:
+    """The transposition table and deadline of one rank call."""
+
+    def __init__(self):
+        self.table: dict[tuple[int, int], float] = {}
+        self.deadline: float | None = None
+
+    def chance(self, bits: int, depth: int) -> float:
+        if depth == 0:
+            return heuristic(bits)
+        empty = logic.empty_cells_bits(bits)
+        total = 0.0
+        for shift in empty:
+            for exponent, probability in SPAWNS:
+                total += probability * self.best(
+                    bits | exponent << shift, depth)
+        return total / len(empty)
+
+    def best(self, bits: int, depth: int) -> float:
+        key = (bits, depth)
+        if key in self.table:
+            return self.table[key]
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        best = 0.0
+        for _, fn in MOVES:
+            child = fn(bits)
+            if child != bits:
+                best = max(best, self.chance(child, depth - 1))
+        self.table[key] = best
+        return best
@@ -0,0 +1,96 @@
+import logic
+from schemas import Board, Direction
+
+
+DIRECTIONS = list(Direction)
+
+
+class HistoryError(LookupError):
+    pass
+
+
+class GameHistory:
+    """The last `capacity` positions of one game in a ring buffer.
+
+    Each position is one fixed-size record: the board packed as its 8-byte
+    bitboard (one exponent byte per tile for sizes other than 4x4), then a
+    byte for the move that reached it (0 for none, else 1 + its index in
+    DIRECTIONS). Spawns need no record of their own: seeded games draw
+    them from the seed and move number. Positions are numbered by the move
+    count they follow; undo and redo only move the current one."""
+
+    def __init__(self, board: Board, move: int, capacity: int):
+        self._size = len(board)
+        self._board_bytes = 8 if self._size == 4 else self._size ** 2
+        self._record = self._board_bytes + 1
+        self._capacity = capacity
+        self._data = bytearray(capacity * self._record)
+        # Oldest kept, current and newest (redo limit) position numbers.
+        self._first = self._current = self._last = move
+        self._write(move, board, None)
+
+    @property
+    def move(self) -> int:
+        return self._current
+
+    def matches(self, board: Board, move: int) -> bool:
+        """Whether the current position is `board` after `move` moves."""
+        offset = self._offset(self._current)
+        return (move == self._current and len(board) == self._size
+                and self._data[offset:offset + self._board_bytes]
+                == self._pack(board))
+
+    def push(self, board: Board, direction: Direction) -> None:
+        """Record a move from the current position; it can no longer be
+        redone past it. The oldest position is dropped once full."""
+        self._current = self._last = self._current + 1
+        if self._last - self._first == self._capacity:
+            self._first += 1
+        self._write(self._current, board, direction)
+
+    def peek_undo(self) -> tuple[Board, int]:
+        """The position before the current one and its move number."""
+        if self._current == self._first:
+            raise HistoryError("Nothing to undo")
+        return self._board(self._current - 1), self._current - 1
+
+    def peek_redo(self) -> tuple[Board, Direction]:
+        """The position after the current one and the move reaching it."""
+        if self._current == self._last:
+            raise HistoryError("Nothing to redo")
+        move = self._current + 1
+        code = self._data[self._offset(move) + self._board_bytes]
+        return self._board(move), DIRECTIONS[code - 1]
+
+    def undo(self) -> None:
+        self.peek_undo()
+        self._current -= 1
+
+    def redo(self) -> None:
+        self.peek_redo()
+        self._current += 1
+
+    def _offset(self, move: int) -> int:
+        return move % self._capacity * self._record
+
+    def _write(self, move: int, board: Board,
+               direction: Direction | None) -> None:
+        offset = self._offset(move)
+        self._data[offset:offset + self._board_bytes] = self._pack(board)
+        self._data[offset + self._board_bytes] = (
+            0 if direction is None else DIRECTIONS.index(direction) + 1)
+
+    def _board(self, move: int) -> Board:
+        offset = self._offset(move)
+        packed = self._data[offset:offset + self._board_bytes]
+        if self._size == 4:
+            return logic.from_bitboard(int.from_bytes(packed, "big"))
+        return [[1 << e if e else 0
+                 for e in packed[r * self._size:(r + 1) * self._size]]
+                for r in range(self._size)]
+
+    def _pack(self, board: Board) -> bytes:
+        if self._size == 4:
+            return logic.to_bitboard(board).to_bytes(8, "big")
+        return bytes(v.bit_length() - 1 if v else 0
+                     for row in board for v in row)
@@ -1,9 +1,18 @@
 import random
-from schemas import Board
+from functools import cache
 
+from schemas import Board, DEFAULT_TARGET, Direction
 
-def init_board() -> Board:
-    return [[random.choice([0, 2]) for _ in range(4)] for _ in range(4)]
+
+def game_rng(seed: int, move: int) -> random.Random:
+    # Move 0 builds the initial board; move n spawns the tile after the
+    # n-th applied move, so any position can be replayed from the seed.
+    return random.Random(f"{seed}:{move}")
+
+
+def init_board(rng: random.Random | None = None, size: int = 4) -> Board:
+    rng = rng or random
+    return [[rng.choice([0, 2]) for _ in range(size)] for _ in range(size)]
 
 
 def _compress_line_left(line: list[int]) -> list[int]:
@@ -20,58 +29,271 @@ def _compress_line_left(line: list[int]) -> list[int]:
         else:
             merged.append(non_empty[i])
             i += 1
-    return merged + [0 for _ in range(4-len(merged))]
+    return merged + [0 for _ in range(len(line)-len(merged))]
 
 
-def _rotate_board_clockwise(board: Board) -> Board:
-    return [[board[3-c][r] for c in range(4)] for r in range(4)]
+# Line transitions are looked up by the line's tiles. Tables small enough
+# to precompute (every line of tiles up to 32768) are filled up front; for
+# wider lines the table fills as lines are seen, up to a fixed size, and
+# lines beyond that are compressed directly.
+_PRECOMPUTE_LIMIT = 1 << 12
+_LINE_TABLE_LIMIT = 1 << 16
+_TILES = [0] + [1 << e for e in range(1, 16)]
 
 
-def move_left(board: Board) -> Board:
-    return [_compress_line_left(board[r]) for r in range(4)]
+@cache
+def _line_table(size: int) -> dict[tuple[int, ...], tuple[int, ...]]:
+    table = {}
+    if len(_TILES) ** size <= _PRECOMPUTE_LIMIT:
+        for key in range(len(_TILES) ** size):
+            line = [_TILES[key // len(_TILES) ** i % len(_TILES)]
+                    for i in range(size)]
+            table[tuple(line)] = tuple(_compress_line_left(line))
+    return table
 
 
-def move_down(board: Board) -> Board:
-    board = _rotate_board_clockwise(board)
-    board = move_left(board)
-    board = _rotate_board_clockwise(board)
-    board = _rotate_board_clockwise(board)
-    return _rotate_board_clockwise(board)
+def _move_line_left(line: list[int] | tuple[int, ...]) -> tuple[int, ...]:
+    table = _line_table(len(line))
+    key = tuple(line)
+    moved = table.get(key)
+    if moved is None:
+        moved = tuple(_compress_line_left(list(line)))
+        if len(table) < _LINE_TABLE_LIMIT:
+            table[key] = moved
+    return moved
+
+
+def move_left(board: Board) -> Board:
+    return [list(_move_line_left(row)) for row in board]
 
 
 def move_right(board: Board) -> Board:
-    board = _rotate_board_clockwise(board)
-    board = _rotate_board_clockwise(board)
-    board = move_left(board)
-    board = _rotate_board_clockwise(board)
-    return _rotate_board_clockwise(board)
+    return [list(_move_line_left(row[::-1]))[::-1] for row in board]
 
 
 def move_up(board: Board) -> Board:
-    board = _rotate_board_clockwise(board)
-    board = _rotate_board_clockwise(board)
-    board = _rotate_board_clockwise(board)
-    board = move_left(board)
-    return _rotate_board_clockwise(board)
+    columns = [_move_line_left(column) for column in zip(*board)]
+    return [list(row) for row in zip(*columns)]
+
+
+def move_down(board: Board) -> Board:
+    columns = [_move_line_left(column[::-1])[::-1]
+               for column in zip(*board)]
+    return [list(row) for row in zip(*columns)]
 
 
-def spawn_tile(board: Board) -> Board:
-    empty = [(r, c) for r in range(4) for c in range(4) if board[r][c] == 0]
-    r, c = random.choice(empty)
-    board[r][c] = random.choice([2, 4])
+def spawn_tile(board: Board, rng: random.Random | None = None) -> Board:
+    rng = rng or random
+    empty = [(r, c) for r, row in enumerate(board)
+             for c, val in enumerate(row) if val == 0]
+    r, c = rng.choice(empty)
+    board[r][c] = rng.choice([2, 4])
     return board
 
 
-def is_win(board: Board) -> bool:
-    return any(board[r][c] == 2048 for r in range(4) for c in range(4))
+def is_win(board: Board, target: int = DEFAULT_TARGET) -> bool:
+    return any(val >= target for row in board for val in row)
+
+
+def legal_moves(board: Board) -> set[Direction]:
+    # A direction is legal if some tile has an empty or equal neighbour on
+    # that side; no board needs to be moved to find out.
+    last = len(board) - 1
+    legal = set()
+    for r, row in enumerate(board):
+        for c, val in enumerate(row):
+            if val == 0:
+                continue
+            if c > 0 and row[c-1] in (0, val):
+                legal.add(Direction.LEFT)
+            if c < last and row[c+1] in (0, val):
+                legal.add(Direction.RIGHT)
+            if r > 0 and board[r-1][c] in (0, val):
+                legal.add(Direction.UP)
+            if r < last and board[r+1][c] in (0, val):
+                legal.add(Direction.DOWN)
+    return legal
 
 
 def is_lose(board: Board) -> bool:
-    return all(
-        new_board == board for new_board in [
-            move_left(board),
-            move_right(board),
-            move_up(board),
-            move_down(board),
+    return not legal_moves(board)
+
+
+# Bitboard engine: the board packed into a 64-bit int, 4 bits per tile
+# holding the exponent (0 for empty), row 0 in the most significant 16 bits
+# and column 0 in the most significant nibble of each row.
+
+def reverse_row(row: int) -> int:
+    return ((row & 0xF) << 12 | (row >> 4 & 0xF) << 8
+            | (row >> 8 & 0xF) << 4 | row >> 12)
+
+
+def _compress_row_left(row: int) -> int:
+    line = [row >> 12, row >> 8 & 0xF, row >> 4 & 0xF, row & 0xF]
+    non_empty = [v for v in line if v != 0]
+    merged = []
+    i = 0
+    while i < len(non_empty):
+        # Exponent 15 is the largest a nibble can hold, so it never merges.
+        if (i + 1 < len(non_empty) and non_empty[i] == non_empty[i + 1]
+                and non_empty[i] < 0xF):
+            merged.append(non_empty[i] + 1)
+            i += 2
+        else:
+            merged.append(non_empty[i])
+            i += 1
+    merged += [0 for _ in range(4-len(merged))]
+    return merged[0] << 12 | merged[1] << 8 | merged[2] << 4 | merged[3]
+
+
+_ROW_LEFT = [_compress_row_left(row) for row in range(0x10000)]
+_ROW_RIGHT = [reverse_row(_ROW_LEFT[reverse_row(row)])
+              for row in range(0x10000)]
+
+
+def to_bitboard(board: Board) -> int:
+    bits = 0
+    for row in board:
+        for val in row:
+            exponent = val.bit_length() - 1 if val > 0 else 0
+            if val != 0 and (val != 1 << exponent or not 1 <= exponent <= 0xF):
+                raise ValueError(f"Tile value {val} cannot be packed")
+            bits = bits << 4 | exponent
+    return bits
+
+
+def from_bitboard(bits: int) -> Board:
+    return [
+        [
+            1 << e if (e := bits >> (60 - 16*r - 4*c) & 0xF) else 0
+            for c in range(4)
         ]
-    )
+        for r in range(4)
+    ]
+
+
+def transpose_bits(bits: int) -> int:
+    a1 = bits & 0xF0F00F0FF0F00F0F
+    a2 = bits & 0x0000F0F00000F0F0
+    a3 = bits & 0x0F0F00000F0F0000
+    a = a1 | a2 << 12 | a3 >> 12
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | b2 >> 24 | b3 << 24
+
+
+def _apply_rows(bits: int, table: list[int]) -> int:
+    return (table[bits >> 48] << 48 | table[bits >> 32 & 0xFFFF] << 32
+            | table[bits >> 16 & 0xFFFF] << 16 | table[bits & 0xFFFF])
+
+
+def move_left_bits(bits: int) -> int:
+    return _apply_rows(bits, _ROW_LEFT)
+
+
+def move_right_bits(bits: int) -> int:
+    return _apply_rows(bits, _ROW_RIGHT)
+
+
+def move_up_bits(bits: int) -> int:
+    return transpose_bits(_apply_rows(transpose_bits(bits), _ROW_LEFT))
+
+
+def move_down_bits(bits: int) -> int:
+    return transpose_bits(_apply_rows(transpose_bits(bits), _ROW_RIGHT))
+
+
+_FULL = 0xFFFFFFFFFFFFFFFF
+_NIBBLE_LOW_BITS = 0x1111111111111111
+_NOT_FIRST_COLUMN = 0x0FFF0FFF0FFF0FFF
+_NOT_LAST_COLUMN = 0xFFF0FFF0FFF0FFF0
+_NOT_FIRST_ROW = 0x0000FFFFFFFFFFFF
+_NOT_LAST_ROW = 0xFFFFFFFFFFFF0000
+
+
+def _zero_nibbles(bits: int) -> int:
+    return ~(bits | bits >> 1 | bits >> 2 | bits >> 3) & _NIBBLE_LOW_BITS
+
+
+def _full_nibbles(bits: int) -> int:
+    return bits & bits >> 1 & bits >> 2 & bits >> 3 & _NIBBLE_LOW_BITS
+
+
+def _can_slide(bits: int, occupied: int, neighbour: int, mask: int) -> bool:
+    # Some tile's neighbour (already shifted onto the tile's nibble) is
+    # empty or holds the same exponent, other than 15, which never merges.
+    free = _zero_nibbles(neighbour) | (
+        _zero_nibbles(bits ^ neighbour) & ~_full_nibbles(bits))
+    return occupied & free & mask != 0
+
+
+def legal_moves_bits(bits: int) -> set[Direction]:
+    occupied = ~_zero_nibbles(bits) & _NIBBLE_LOW_BITS
+    legal = set()
+    if _can_slide(bits, occupied, bits >> 4, _NOT_FIRST_COLUMN):
+        legal.add(Direction.LEFT)
+    if _can_slide(bits, occupied, bits << 4 & _FULL, _NOT_LAST_COLUMN):
+        legal.add(Direction.RIGHT)
+    if _can_slide(bits, occupied, bits >> 16, _NOT_FIRST_ROW):
+        legal.add(Direction.UP)
+    if _can_slide(bits, occupied, bits << 16 & _FULL, _NOT_LAST_ROW):
+        legal.add(Direction.DOWN)
+    return legal
+
+
+def is_lose_bits(bits: int) -> bool:
+    return not legal_moves_bits(bits)
+
+
+# Exponent of DEFAULT_TARGET, for engines that keep exponents.
+WIN_EXPONENT = DEFAULT_TARGET.bit_length() - 1
+
+
+def is_win_bits(bits: int, exponent: int = WIN_EXPONENT) -> bool:
+    return any(bits >> s & 0xF >= exponent for s in range(0, 64, 4))
+
+
+def empty_cells_bits(bits: int) -> list[int]:
+    """Shifts of the empty nibbles, in the row-major order spawn_tile
+    scans the board."""
+    return [s for s in range(60, -4, -4) if not bits >> s & 0xF]
+
+
+def spawn_bits(bits: int, rng: random.Random | None = None) -> int:
+    # Draws match spawn_tile's, so a seeded game spawns the same tiles on
+    # either engine.
+    rng = rng or random
+    shift = rng.choice(empty_cells_bits(bits))
+    return bits | rng.choice((1, 2)) << shift
+
+
+def init_bits(rng: random.Random | None = None) -> int:
+    # Same draws as init_board: each cell is empty or a 2.
+    rng = rng or random
+    bits = 0
+    for _ in range(16):
+        bits = bits << 4 | rng.choice((0, 1))
+    return bits
+
+
+MOVES = {
+    Direction.UP: move_up,
+    Direction.DOWN: move_down,
+    Direction.LEFT: move_left,
+    Direction.RIGHT: move_right,
+}
+
+BIT_MOVES = {
+    Direction.UP: move_up_bits,
+    Direction.DOWN: move_down_bits,
+    Direction.LEFT: move_left_bits,
+    Direction.RIGHT: move_right_bits,
+}
+
+
+def slide(board: Board, direction: Direction) -> Board:
+    # 4x4 boards go through the bitboard engine, as Service moves them.
+    if len(board) == 4:
+        return from_bitboard(BIT_MOVES[direction](to_bitboard(board)))
+    return MOVES[direction](board)
@@ -0,0 +1,260 @@
+import bisect
+import functools
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...],
+                   extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = ()):
+        self.name = name
+        self._documentation = documentation
+        self._labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels[n] for n in self._labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(
+                tuple(labels[n] for n in self._labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self._documentation}",
+                 f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}"
+                             f"{_format_labels(self._labels, key)} "
+                             f"{_format_value(value)}")
+        return lines
+
+
+class Gauge:
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = ()):
+        self.name = name
+        self._documentation = documentation
+        self._labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(labels[n] for n in self._labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(
+                tuple(labels[n] for n in self._labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self._documentation}",
+                 f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}"
+                             f"{_format_labels(self._labels, key)} "
+                             f"{_format_value(value)}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self._documentation = documentation
+        self._labels = labels
+        self._buckets = buckets
+        # Per label set: a count per bucket (plus +Inf), then the sum.
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[n] for n in self._labels)
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self._buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(tuple(labels[n] for n in self._labels))
+            return sum(entry[0]) if entry else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self._documentation}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                bounds = [repr(b) for b in self._buckets] + ["+Inf"]
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    le = _format_labels(self._labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                labels = _format_labels(self._labels, key)
+                lines.append(f"{self.name}_sum{labels} {total!r}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Collector:
+    """A counter or gauge kept elsewhere, such as a cache's own hit counts:
+    its values are read from the `collect_from` callable at each render."""
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 labels: tuple[str, ...] = ()):
+        self.name = name
+        self._documentation = documentation
+        self._kind = kind
+        self._labels = labels
+        self._collect: Callable[[], dict[tuple[str, ...], float]] = dict
+
+    def collect_from(
+            self, collect: Callable[[], dict[tuple[str, ...], float]]
+    ) -> None:
+        self._collect = collect
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self._documentation}",
+                 f"# TYPE {self.name} {self._kind}"]
+        for key, value in sorted(self._collect().items()):
+            lines.append(f"{self.name}"
+                         f"{_format_labels(self._labels, key)} "
+                         f"{_format_value(value)}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: list[Counter | Gauge | Histogram | Collector] = []
+
+    def counter(self, name: str, documentation: str,
+                labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str,
+              labels: tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str,
+                  labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name: str, documentation: str, kind: str,
+                  labels: tuple[str, ...] = ()) -> Collector:
+        metric = Collector(name, documentation, kind, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(
+            line + "\n" for metric in self._metrics
+            for line in metric.render())
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable:
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+REGISTRY = Registry()
+REQUEST_LATENCY = REGISTRY.histogram(
+    "api_request_duration_seconds",
+    "Time to produce a response, by route.", ("route",))
+STORE_LATENCY = REGISTRY.histogram(
+    "store_operation_duration_seconds",
+    "Time spent in the backing store, by operation.", ("operation",))
+LLM_LATENCY = REGISTRY.histogram(
+    "llm_request_duration_seconds",
+    "Time until a Groq completion finished, by call mode.", ("mode",))
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total",
+    "Tokens reported by Groq, by kind (prompt or completion).", ("kind",))
+LLM_PARSE_FAILURES = REGISTRY.counter(
+    "llm_parse_failures_total",
+    "Completions that could not be parsed and fell back to the default "
+    "move.")
+HEDGED_SUGGESTIONS = REGISTRY.counter(
+    "hedged_suggestions_total",
+    "Hedged suggestions, by outcome (llm, deadline, invalid, error).",
+    ("outcome",))
+STARTUP_DURATION = REGISTRY.gauge(
+    "startup_duration_seconds",
+    "Time spent on one-off initialization, by phase (store, agent, "
+    "warm_up).", ("phase",))
+STORE_CACHE_EVENTS = REGISTRY.collector(
+    "store_cache_events_total",
+    "Store cache activity, by event (hits, misses, flushes, flushed_boards, "
+    "replayed_moves).", "counter", ("event",))
+STORE_CACHE_ENTRIES = REGISTRY.collector(
+    "store_cache_entries",
+    "Games held by the store cache, by state (cached, dirty).", "gauge",
+    ("state",))
+SUGGESTION_CACHE_LOOKUPS = REGISTRY.collector(
+    "suggestion_cache_lookups_total",
+    "Suggestion cache lookups, by result (hit, miss).", "counter",
+    ("result",))
+SUGGESTION_CACHE_HIT_RATIO = REGISTRY.collector(
+    "suggestion_cache_hit_ratio",
+    "Share of suggestion cache lookups that hit.", "gauge")
+SUGGESTION_CACHE_SAVED_LATENCY = REGISTRY.collector(
+    "suggestion_cache_saved_latency_seconds_total",
+    "Agent latency avoided by suggestion cache hits.", "counter")
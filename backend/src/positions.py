@@ -0,0 +1,175 @@
+import argparse
+import math
+import mmap
+import random
+import struct
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from expectimax import ExpectimaxSearch
+from schemas import Direction
+from symmetry import canonicalize
+
+
+# File layout: a header (magic, entry count, search depth), then one RECORD
+# per canonical bitboard in ascending board order: the board, then the
+# expected value of each move in DIRECTIONS order (NaN where the move is
+# illegal). The depth is the shallowest any position's search completed
+# within its budget. Integers and floats are little-endian.
+MAGIC = b"2048POS1"
+HEADER = struct.Struct("<8sQQ")
+RECORD = struct.Struct("<Q4f")
+BOARD = struct.Struct("<Q")
+DIRECTIONS = list(Direction)
+
+
+class PositionTable:
+    """Read-only table of solved positions. The file is memory-mapped, so
+    opening it reads nothing and processes share the page cache."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not a position table")
+        magic, self._count, self.depth = HEADER.unpack_from(self._map)
+        if (magic != MAGIC
+                or len(self._map) < HEADER.size + self._count * RECORD.size):
+            raise ValueError(f"{path} is not a position table")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def lookup(self, bits: int) -> list[tuple[Direction, float]] | None:
+        """Legal moves of the board ordered best first with their expected
+        values, or None if the board was not solved."""
+        canonical, symmetry = canonicalize(bits)
+        offset = self._find(canonical)
+        with self._lock:
+            if offset is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        values = RECORD.unpack_from(self._map, offset)[1:]
+        ranked = [(symmetry.unmap_direction(direction), value)
+                  for direction, value in zip(DIRECTIONS, values)
+                  if not math.isnan(value)]
+        ranked.sort(key=lambda m: -m[1])
+        return ranked
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": self._count}
+
+    def close(self) -> None:
+        self._map.close()
+
+    def _find(self, canonical: int) -> int | None:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = HEADER.size + mid * RECORD.size
+            board = BOARD.unpack_from(self._map, offset)[0]
+            if board == canonical:
+                return offset
+            if board < canonical:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+
+def write_table(path: Path, solved: dict[int, list[float]],
+                depth: int) -> None:
+    """Write `solved` (canonical board -> values in DIRECTIONS order)."""
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(solved), depth))
+        for board in sorted(solved):
+            f.write(RECORD.pack(board, *solved[board]))
+
+
+def common_positions(boards, limit: int) -> list[int]:
+    """The `limit` most frequent canonical boards among `boards`."""
+    counts = Counter(canonicalize(int(bits))[0] for bits in boards)
+    return [board for board, _ in counts.most_common(limit)]
+
+
+def _solve(boards: list[int], depth: int, time_budget_ms: int
+           ) -> tuple[list[tuple[int, list[float]]], int]:
+    search = ExpectimaxSearch(depth, time_budget_ms)
+    solved = []
+    for board in boards:
+        ranked, reached = search.rank(board)
+        if not ranked:
+            continue
+        depth = min(depth, reached)
+        values = dict(ranked)
+        solved.append((board, [values.get(d, math.nan) for d in DIRECTIONS]))
+    return solved, depth
+
+
+def solve(boards: list[int], depth: int, time_budget_ms: int,
+          workers: int = 1, chunk: int = 256
+          ) -> tuple[dict[int, list[float]], int]:
+    """Solve `boards`. Returns them (canonical board -> values in
+    DIRECTIONS order) and the shallowest depth any search completed."""
+    batches = [boards[i:i + chunk] for i in range(0, len(boards), chunk)]
+    args = (batches, [depth] * len(batches),
+            [time_budget_ms] * len(batches))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_solve, *args))
+    else:
+        results = list(map(_solve, *args))
+    solved = {board: values for batch, _ in results
+              for board, values in batch}
+    return solved, min((reached for _, reached in results), default=depth)
+
+
+def main() -> int:
+    # Positions come from self-play, so building a table needs NumPy.
+    import dataset
+
+    parser = argparse.ArgumentParser(
+        description="Solve the most common positions of self-play games "
+                    "and write them to a position table")
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--dataset", type=Path,
+                        help="take positions from this dataset instead of "
+                             "playing new games")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", choices=sorted(dataset.POLICIES),
+                        default="greedy")
+    parser.add_argument("--positions", type=int, default=100000,
+                        help="number of distinct positions to solve")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--time-ms", type=int, default=1000,
+                        help="search budget per position")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.dataset:
+        boards = dataset.Dataset(args.dataset).boards
+    else:
+        policy = dataset.POLICIES[args.policy]()
+        boards = [int(bits) for i in range(args.games)
+                  for bits in dataset.play_game(
+                      policy, random.Random(f"{args.seed}:{i}"))["board"]]
+    positions = common_positions(boards, args.positions)
+    solved, depth = solve(positions, args.depth, args.time_ms, args.workers)
+    write_table(args.output, solved, depth)
+    print(f"Wrote {len(solved)} positions solved {depth} moves deep to "
+          f"{args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import math
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+
+import logic
+from schemas import Direction, RolloutPolicy
+
+
+MAX_PLAYOUT_MOVES = 100000
+
+
+@dataclass
+class MoveStats:
+    direction: Direction
+    playouts: int
+    mean_score: float
+    mean_moves: float
+    score_stderr: float
+    confidence: float = 0.0
+
+
+_NIBBLE_TWOS = 0x2222222222222222
+
+
+def _spawn(bits: int, rng: random.Random) -> tuple[int, bool]:
+    spawned = logic.spawn_bits(bits, rng)
+    # A spawned 4 (exponent 2) is the only new nibble with its 2s bit set.
+    return spawned, (spawned ^ bits) & _NIBBLE_TWOS != 0
+
+
+def _empty_count(bits: int) -> int:
+    return len(logic.empty_cells_bits(bits))
+
+
+def _score(bits: int, fours: int) -> int:
+    # A 2^e tile built from spawned 2s earned (e - 1) * 2^e points through
+    # merges; spawned 4s were never merged into, so they earned nothing.
+    total = 0
+    for s in range(0, 64, 4):
+        e = bits >> s & 0xF
+        if e > 1:
+            total += (e - 1) << e
+    return total - 4 * fours
+
+
+def _playout(bits: int, policy: RolloutPolicy,
+             rng: random.Random) -> tuple[int, int]:
+    bits, four = _spawn(bits, rng)
+    fours, moves = int(four), 1
+    while moves < MAX_PLAYOUT_MOVES:
+        children = [child for fn in logic.BIT_MOVES.values()
+                    if (child := fn(bits)) != bits]
+        if not children:
+            break
+        if policy == RolloutPolicy.GREEDY:
+            bits = max(children, key=_empty_count)
+        else:
+            bits = rng.choice(children)
+        bits, four = _spawn(bits, rng)
+        fours += four
+        moves += 1
+    return _score(bits, fours), moves
+
+
+# Each worker plays every candidate move in turn so that all moves get a
+# fair share of the budget however many workers there are.
+def run_playouts(children: list[int], policy: RolloutPolicy, count: int,
+                 seed: int, deadline: float) -> list[list[tuple[int, int]]]:
+    rng = random.Random(seed)
+    results = [[] for _ in children]
+    for i in range(count):
+        if i > 0 and time.time() > deadline:
+            break
+        for bits, child_results in zip(children, results):
+            child_results.append(_playout(bits, policy, rng))
+    return results
+
+
+def _probability_greater(a: MoveStats, b: MoveStats) -> float:
+    spread = math.hypot(a.score_stderr, b.score_stderr)
+    if spread == 0:
+        return 1.0 if a.mean_score >= b.mean_score else 0.0
+    z = (a.mean_score - b.mean_score) / spread
+    return 0.5 * (1 + math.erf(z / math.sqrt(2)))
+
+
+class RolloutEvaluator:
+
+    def __init__(self, playouts: int, policy: RolloutPolicy,
+                 time_budget_ms: int, workers: int | None = None):
+        self._playouts = playouts
+        self._policy = policy
+        self._time_budget = time_budget_ms / 1000
+        self._workers = workers or os.cpu_count() or 1
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+    def rank(self, bits: int) -> list[MoveStats]:
+        children = [(d, fn(bits)) for d, fn in logic.BIT_MOVES.items()]
+        children = [(d, child) for d, child in children if child != bits]
+        if not children:
+            return []
+
+        # The agent ranks from several threads; only one builds the pool.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers)
+            executor = self._executor
+        deadline = time.time() + self._time_budget
+        chunk = math.ceil(self._playouts / self._workers)
+        futures = [
+            executor.submit(
+                run_playouts, [child for _, child in children], self._policy,
+                min(chunk, self._playouts - start), random.getrandbits(64),
+                deadline)
+            for start in range(0, self._playouts, chunk)
+        ]
+        per_worker = [future.result() for future in futures]
+
+        ranked = []
+        for i, (direction, _) in enumerate(children):
+            results = [r for worker in per_worker for r in worker[i]]
+            scores = [score for score, _ in results]
+            stderr = (statistics.stdev(scores) / math.sqrt(len(scores))
+                      if len(scores) > 1 else 0.0)
+            ranked.append(MoveStats(
+                direction=direction,
+                playouts=len(results),
+                mean_score=statistics.fmean(scores),
+                mean_moves=statistics.fmean(m for _, m in results),
+                score_stderr=stderr,
+            ))
+        ranked.sort(key=lambda m: (-m.mean_score, -m.mean_moves))
+
+        # Confidence is the chance, under a normal approximation of each
+        # mean, that the best move really beats the runner-up, or that
+        # another move really beats the best.
+        best = ranked[0]
+        best.confidence = (_probability_greater(best, ranked[1])
+                           if len(ranked) > 1 else 1.0)
+        for stats in ranked[1:]:
+            stats.confidence = _probability_greater(stats, best)
+        return ranked
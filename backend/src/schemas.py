@@ -1,8 +1,13 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from enum import Enum
 
 
 Board = list[list[int]]
+MIN_BOARD_SIZE = 3
+MAX_BOARD_SIZE = 8
+DEFAULT_TARGET = 2048
+# 4x4 games run on bitboards, whose 4-bit cells top out at 2^15.
+MAX_BITBOARD_TARGET = 32768
 
 
 class Status(str, Enum):
@@ -11,22 +16,100 @@ class Status(str, Enum):
     NOOP = "NOOP"
 
 
+class Direction(str, Enum):
+    UP = "UP"
+    DOWN = "DOWN"
+    LEFT = "LEFT"
+    RIGHT = "RIGHT"
+
+
 class GameResponse(BaseModel):
+    game_id: str = Field(
+        ...,
+        description="Identifier of the game the board belongs to"
+    )
     board: Board = Field(
         ...,
-        description="4x4 game board state with tile values"
+        description="Game board state with tile values, row by row"
     )
     status: Status | None = Field(
         ...,
         description="Game status: 'WIN', 'LOSE', 'NOOP', or None if ongoing"
     )
+    legal_moves: list[Direction] = Field(
+        ...,
+        description="Directions that would change the board; empty once lost"
+    )
 
 
-class Direction(str, Enum):
-    UP = "UP"
-    DOWN = "DOWN"
-    LEFT = "LEFT"
-    RIGHT = "RIGHT"
+class BatchMoveResponse(BaseModel):
+    game_id: str = Field(
+        ...,
+        description="Identifier of the game the board belongs to"
+    )
+    board: Board = Field(
+        ...,
+        description="Game board state after the last applied move"
+    )
+    statuses: list[Status | None] = Field(
+        ...,
+        description="Status after each applied move; stops at 'WIN' or 'LOSE'"
+    )
+    legal_moves: list[Direction] = Field(
+        ...,
+        description="Directions that would change the final board"
+    )
+
+
+class ChannelRequest(str, Enum):
+    MOVE = "MOVE"
+    RESTART = "RESTART"
+    SUGGEST = "SUGGEST"
+
+
+class ChannelEvent(str, Enum):
+    GAME = "GAME"
+    SUGGESTION = "SUGGESTION"
+    ERROR = "ERROR"
+
+
+class ChannelMessage(BaseModel):
+    type: ChannelRequest = Field(
+        ...,
+        description="What to do: 'MOVE', 'RESTART' or 'SUGGEST'"
+    )
+    direction: Direction | None = Field(
+        None,
+        description="Direction to move; required for 'MOVE'"
+    )
+    num_suggestions: int = Field(
+        1,
+        ge=1,
+        le=4,
+        description="Number of moves to suggest for 'SUGGEST'"
+    )
+    size: int = Field(
+        4,
+        ge=MIN_BOARD_SIZE,
+        le=MAX_BOARD_SIZE,
+        description="Board size for 'RESTART'"
+    )
+    target: int = Field(
+        DEFAULT_TARGET,
+        ge=4,
+        description="Winning tile for 'RESTART'; a power of two"
+    )
+
+    @model_validator(mode="after")
+    def check_fields(self) -> "ChannelMessage":
+        if self.type == ChannelRequest.MOVE and self.direction is None:
+            raise ValueError("MOVE needs a direction")
+        if self.target & (self.target - 1):
+            raise ValueError("Target must be a power of two")
+        if self.size == 4 and self.target > MAX_BITBOARD_TARGET:
+            raise ValueError(
+                f"4x4 targets go up to {MAX_BITBOARD_TARGET}")
+        return self
 
 
 class Move(BaseModel):
@@ -46,6 +129,15 @@ class Move(BaseModel):
     )
 
 
+class SuggestionSource(str, Enum):
+    LLM = "LLM"
+    GREEDY = "GREEDY"
+    EXPECTIMAX = "EXPECTIMAX"
+    ROLLOUT = "ROLLOUT"
+    TABLE = "TABLE"
+    DEFAULT = "DEFAULT"
+
+
 class AgentResponse(BaseModel):
     recommended_moves: list[Move] = Field(
         ...,
@@ -55,6 +147,23 @@ class AgentResponse(BaseModel):
         ...,
         description="High-level analysis of the current game state"
     )
+    source: SuggestionSource | None = Field(
+        None,
+        description=("What produced the suggestion: 'LLM', 'GREEDY' (local "
+                     "one-move ranking), 'EXPECTIMAX', 'ROLLOUT', 'TABLE' "
+                     "(solved-position table) or 'DEFAULT' (parse failure)")
+    )
+
+
+class AgentBackend(str, Enum):
+    GROQ = "GROQ"
+    EXPECTIMAX = "EXPECTIMAX"
+    ROLLOUT = "ROLLOUT"
+
+
+class RolloutPolicy(str, Enum):
+    RANDOM = "RANDOM"
+    GREEDY = "GREEDY"
 
 
 class AgentConfig(BaseModel):
@@ -68,3 +177,64 @@ class AgentConfig(BaseModel):
         le=2,
         description="Temperature for LLM sampling"
     )
+    backend: AgentBackend = Field(
+        AgentBackend.GROQ,
+        description=("Suggestion engine: 'GROQ' (LLM), 'EXPECTIMAX' (local "
+                     "search) or 'ROLLOUT' (Monte Carlo playouts)")
+    )
+    search_depth: int = Field(
+        3,
+        ge=1,
+        le=6,
+        description="Maximum number of moves the local search looks ahead"
+    )
+    search_time_ms: int = Field(
+        20,
+        gt=0,
+        description="Wall-clock budget in milliseconds for the local search"
+    )
+    rollout_playouts: int = Field(
+        200,
+        gt=0,
+        description="Maximum number of playouts per legal move"
+    )
+    rollout_policy: RolloutPolicy = Field(
+        RolloutPolicy.RANDOM,
+        description="Move policy used during playouts: 'RANDOM' or 'GREEDY'"
+    )
+    rollout_time_ms: int = Field(
+        250,
+        gt=0,
+        description="Wall-clock budget in milliseconds for the playouts"
+    )
+    cache_size: int = Field(
+        1024,
+        ge=0,
+        description="Maximum number of cached suggestions (0 disables caching)"
+    )
+    cache_ttl_s: float = Field(
+        300.0,
+        gt=0,
+        description="Seconds a cached suggestion stays valid"
+    )
+    position_table: str | None = Field(
+        None,
+        description=("Path of a solved-position table consulted before the "
+                     "cache and any backend")
+    )
+    hedge_timeout_ms: int = Field(
+        0,
+        ge=0,
+        description=("Milliseconds to wait for the LLM before answering with "
+                     "the local one-move ranking (0 always waits)")
+    )
+    max_concurrent_calls: int = Field(
+        8,
+        gt=0,
+        description="Maximum number of suggestion calls in flight at once"
+    )
+    call_timeout_s: float = Field(
+        15.0,
+        gt=0,
+        description="Deadline in seconds for a suggestion, including queueing"
+    )
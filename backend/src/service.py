@@ -1,40 +1,205 @@
+import random
+import threading
+from collections import OrderedDict
+
 import logic
-from schemas import Board, Direction, Status
-from store import Store
+from history import GameHistory, HistoryError
+from schemas import Board, DEFAULT_TARGET, Direction, Status
+from store import BoardLog, GameConflictError, GameHead, GameLog
 
 
 class Service:
 
-    def __init__(self, store: Store):
-        self._store = store
-
-    def restart_game(self) -> Board:
-        board = logic.init_board()
-        self._store.save(board)
-        return board
-
-    def make_move(self, direction: Direction) -> tuple[Board, Status | None]:
-        board = self._store.load()
-        after_move = self._move(board, direction)
-        if after_move == board:
-            return board, Status.NOOP
-
-        after_tile = logic.spawn_tile(after_move)
-        if logic.is_win(after_tile):
-            return after_tile, Status.WIN
-        if logic.is_lose(after_tile):
-            return after_tile, Status.LOSE
-
-        self._store.save(after_tile)
-        return after_tile, None
-
-    def _move(self, board: Board, direction: Direction) -> Board:
-        if direction == Direction.UP:
-            board = logic.move_up(board)
-        elif direction == Direction.DOWN:
-            board = logic.move_down(board)
-        elif direction == Direction.LEFT:
-            board = logic.move_left(board)
+    def __init__(self, games: GameLog | BoardLog, history_size: int = 256,
+                 history_games: int = 4096):
+        self._games = games
+        # Undo history of the most recently played games, in memory only.
+        self._history_size = history_size
+        self._history_games = history_games
+        self._histories: OrderedDict[str, GameHistory] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def restart_game(self, game_id: str, size: int = 4,
+                     target: int = DEFAULT_TARGET
+                     ) -> tuple[Board, list[Direction]]:
+        seed = random.getrandbits(63)
+        board = logic.init_board(logic.game_rng(seed, 0), size)
+        head = self._games.create(game_id, seed, board, target)
+        with self._lock:
+            self._histories.pop(game_id, None)
+        self._record(game_id, head, [])
+        return board, self._ordered(logic.legal_moves(board))
+
+    def make_move(self, game_id: str, direction: Direction
+                  ) -> tuple[Board, Status | None, list[Direction]]:
+        return self._retrying(
+            game_id, lambda head: self._make_move(game_id, head, direction))
+
+    def make_moves(self, game_id: str, directions: list[Direction]
+                   ) -> tuple[Board, list[Status | None], list[Direction]]:
+        return self._retrying(
+            game_id, lambda head: self._make_moves(game_id, head, directions))
+
+    def undo(self, game_id: str) -> tuple[Board, list[Direction]]:
+        """Take back the last move; the board comes from the history, so
+        nothing is replayed. Raises HistoryError if there is none."""
+        return self._retrying(
+            game_id, lambda head: self._undo(game_id, head))
+
+    def redo(self, game_id: str) -> tuple[Board, list[Direction]]:
+        """Play the last undone move again. Seeded games draw the same
+        spawn, so the log rebuilds the same board."""
+        return self._retrying(
+            game_id, lambda head: self._redo(game_id, head))
+
+    def _retrying(self, game_id: str, attempt):
+        """Run `attempt` on the game's head, once more on a conflict. The
+        store drops a head another worker made stale, so the retry sees the
+        current game; a second conflict is a race lost to another request.
+        Attempts that write nothing verify their head instead."""
+        try:
+            return attempt(self._games.head(game_id))
+        except GameConflictError:
+            return attempt(self._games.head(game_id))
+
+    def _make_move(self, game_id: str, head: GameHead, direction: Direction
+                   ) -> tuple[Board, Status | None, list[Direction]]:
+        board, status, legal = self._step(
+            head.board, direction, self._rng(head, 1), head.target)
+        if status is None:
+            self._games.append(game_id, head, [direction], board)
+            self._record(game_id, head, [(board, direction)])
+        else:
+            self._games.verify(game_id, head)
+        return board, status, self._ordered(legal)
+
+    def _make_moves(self, game_id: str, head: GameHead,
+                    directions: list[Direction]
+                    ) -> tuple[Board, list[Status | None], list[Direction]]:
+        board = last_saveable = head.board
+        saved = []
+        steps = []
+        statuses = []
+        legal = set()
+        for direction in directions:
+            board, status, legal = self._step(
+                board, direction, self._rng(head, len(saved) + 1),
+                head.target)
+            statuses.append(status)
+            if status is None:
+                last_saveable = board
+                saved.append(direction)
+                steps.append((board, direction))
+            elif status != Status.NOOP:
+                break
+
+        if saved:
+            self._games.append(game_id, head, saved, last_saveable)
+            self._record(game_id, head, steps)
+        else:
+            self._games.verify(game_id, head)
+        return board, statuses, self._ordered(legal)
+
+    def _undo(self, game_id: str, head: GameHead
+              ) -> tuple[Board, list[Direction]]:
+        with self._lock:
+            history = self._history(game_id, head)
+            if history is None:
+                raise HistoryError("Nothing to undo")
+            board, move = history.peek_undo()
+        self._games.rewind(game_id, head, move, board)
+        self._moved(game_id, head, history, history.undo)
+        return board, self._ordered(logic.legal_moves(board))
+
+    def _redo(self, game_id: str, head: GameHead
+              ) -> tuple[Board, list[Direction]]:
+        with self._lock:
+            history = self._history(game_id, head)
+            if history is None:
+                raise HistoryError("Nothing to redo")
+            board, direction = history.peek_redo()
+        self._games.append(game_id, head, [direction], board)
+        self._moved(game_id, head, history, history.redo)
+        return board, self._ordered(logic.legal_moves(board))
+
+    def state(self, game_id: str) -> tuple[Board, list[Direction]]:
+        board = self._games.head(game_id).board
+        return board, self._ordered(logic.legal_moves(board))
+
+    def replay(self, game_id: str, move: int
+               ) -> tuple[Board, list[Direction]]:
+        board = self._games.replay(game_id, move)
+        return board, self._ordered(logic.legal_moves(board))
+
+    def _history(self, game_id: str, head: GameHead) -> GameHistory | None:
+        """The game's history if it ends on `head`. Board stores count no
+        moves, so only their boards are compared."""
+        history = self._histories.get(game_id)
+        if history is None:
+            return None
+        move = head.moves if head.seed is not None else history.move
+        if not history.matches(head.board, move):
+            # Moves made elsewhere, e.g. by another worker, were missed.
+            del self._histories[game_id]
+            return None
+        self._histories.move_to_end(game_id)
+        return history
+
+    def _record(self, game_id: str, head: GameHead,
+                steps: list[tuple[Board, Direction]]) -> None:
+        """Add the positions `steps` reached from `head` to the history."""
+        if self._history_size < 2:
+            return
+        with self._lock:
+            history = self._history(game_id, head)
+            if history is None:
+                history = self._histories[game_id] = GameHistory(
+                    head.board, head.moves, self._history_size)
+                while len(self._histories) > self._history_games:
+                    self._histories.popitem(last=False)
+            for board, direction in steps:
+                history.push(board, direction)
+
+    def _moved(self, game_id: str, head: GameHead, history: GameHistory,
+               move) -> None:
+        # The store accepted the change, so only a racing request could
+        # have touched the history since it was read.
+        with self._lock:
+            if self._history(game_id, head) is history:
+                move()
+
+    def _rng(self, head: GameHead, offset: int) -> random.Random | None:
+        # Board stores keep no seed, so their spawns use the global RNG.
+        if head.seed is None:
+            return None
+        return logic.game_rng(head.seed, head.moves + offset)
+
+    def _step(self, board: Board, direction: Direction,
+              rng: random.Random | None = None,
+              target: int = DEFAULT_TARGET
+              ) -> tuple[Board, Status | None, set[Direction]]:
+        if len(board) == 4:
+            bits = logic.to_bitboard(board)
+            legal = logic.legal_moves_bits(bits)
+            if direction not in legal:
+                return board, Status.NOOP, legal
+            after_tile = logic.spawn_tile(
+                logic.from_bitboard(logic.BIT_MOVES[direction](bits)), rng)
+            legal = logic.legal_moves_bits(logic.to_bitboard(after_tile))
         else:
-            board = logic.move_right(board)
-        return board
+            legal = logic.legal_moves(board)
+            if direction not in legal:
+                return board, Status.NOOP, legal
+            after_tile = logic.spawn_tile(
+                logic.MOVES[direction](board), rng)
+            legal = logic.legal_moves(after_tile)
+
+        if logic.is_win(after_tile, target):
+            return after_tile, Status.WIN, legal
+        if not legal:
+            return after_tile, Status.LOSE, legal
+        return after_tile, None, legal
+
+    def _ordered(self, legal: set[Direction]) -> list[Direction]:
+        return [direction for direction in Direction if direction in legal]
+
@@ -1,24 +1,613 @@
 import json
+import logging
+import math
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
 from pathlib import Path
 
-from schemas import Board
+import logic
+from metrics import STORE_LATENCY, timed
+from schemas import Board, DEFAULT_TARGET, Direction
 
 
 DEFAULT_PATH = Path(__file__).resolve().parent.parent / "store.json"
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "store.db"
+DEFAULT_LOG_PATH = Path(__file__).resolve().parent.parent / "games.db"
+
+logger = logging.getLogger("model.store")
+
+
+class GameNotFoundError(KeyError):
+    pass
+
+
+class GameConflictError(Exception):
+    pass
+
+
+class ReplayUnsupportedError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class GameHead:
+    generation: int
+    seed: int | None
+    moves: int
+    board: Board
+    target: int = DEFAULT_TARGET
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+# 4x4 boards are stored as their 8-byte bitboard; other sizes, and 4x4
+# boards with tiles too big for a nibble, as one exponent byte per tile.
+def _pack_board(board: Board) -> bytes:
+    if len(board) == 4:
+        try:
+            return logic.to_bitboard(board).to_bytes(8, "big")
+        except ValueError:
+            pass
+    return bytes(val.bit_length() - 1 if val else 0
+                 for row in board for val in row)
+
+
+def _unpack_board(packed: bytes) -> Board:
+    if len(packed) == 8:
+        return logic.from_bitboard(int.from_bytes(packed, "big"))
+    size = math.isqrt(len(packed))
+    return [[1 << e if e else 0 for e in packed[r*size:(r+1)*size]]
+            for r in range(size)]
 
 
 class Store:
 
-    def save(self, board: Board) -> None:
-        with open(DEFAULT_PATH, "w") as f:
-            f.write(self._serialize_board(board))
+    def __init__(self, path: Path = DEFAULT_PATH):
+        self._path = path
+
+    @timed(STORE_LATENCY, operation="save")
+    def save(self, game_id: str, board: Board) -> None:
+        games = self._load_all()
+        games[game_id] = board
+        with open(self._path, "w") as f:
+            f.write(self._serialize_games(games))
 
-    def load(self) -> Board:
-        with open(DEFAULT_PATH, "r") as f:
-            return self._deserialize_board(f.read())
+    @timed(STORE_LATENCY, operation="save_many")
+    def save_many(self, boards: Iterable[tuple[str, Board]]) -> None:
+        games = self._load_all()
+        games.update(boards)
+        with open(self._path, "w") as f:
+            f.write(self._serialize_games(games))
 
-    def _serialize_board(self, board: Board) -> str:
-        return json.dumps(board)
+    @timed(STORE_LATENCY, operation="load")
+    def load(self, game_id: str) -> Board:
+        games = self._load_all()
+        if game_id not in games:
+            raise GameNotFoundError(game_id)
+        return games[game_id]
 
-    def _deserialize_board(self, s: str) -> Board:
+    def _load_all(self) -> dict[str, Board]:
+        try:
+            with open(self._path, "r") as f:
+                return self._deserialize_games(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def _serialize_games(self, games: dict[str, Board]) -> str:
+        return json.dumps(games)
+
+    def _deserialize_games(self, s: str) -> dict[str, Board]:
         return json.loads(s)
+
+
+class SqliteStore(Store):
+
+    _CREATE = """CREATE TABLE IF NOT EXISTS games (
+        id TEXT PRIMARY KEY,
+        board BLOB NOT NULL
+    ) WITHOUT ROWID"""
+    _UPSERT = ("INSERT INTO games (id, board) VALUES (?, ?) "
+               "ON CONFLICT(id) DO UPDATE SET board = excluded.board")
+    _SELECT = "SELECT board FROM games WHERE id = ?"
+
+    def __init__(self, path: Path = DEFAULT_DB_PATH):
+        self._path = path
+        # One connection per thread: WAL lets readers run alongside the
+        # writer, and sqlite3 caches each connection's prepared statements.
+        self._local = threading.local()
+        self._connection().execute(self._CREATE)
+
+    @timed(STORE_LATENCY, operation="save")
+    def save(self, game_id: str, board: Board) -> None:
+        self._connection().execute(
+            self._UPSERT, (game_id, self._serialize_board(board)))
+
+    @timed(STORE_LATENCY, operation="save_many")
+    def save_many(self, boards: Iterable[tuple[str, Board]]) -> None:
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(self._UPSERT, [
+                (game_id, self._serialize_board(board))
+                for game_id, board in boards
+            ])
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @timed(STORE_LATENCY, operation="load")
+    def load(self, game_id: str) -> Board:
+        row = self._connection().execute(self._SELECT, (game_id,)).fetchone()
+        if row is None:
+            raise GameNotFoundError(game_id)
+        return self._deserialize_board(row[0])
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self._path)
+        return conn
+
+    def _serialize_board(self, board: Board) -> bytes:
+        return _pack_board(board)
+
+    def _deserialize_board(self, s: bytes) -> Board:
+        return _unpack_board(s)
+
+
+class CachedStore:
+
+    def __init__(self, store: Store, capacity: int = 1024,
+                 flush_interval: float = 1.0):
+        self._store = store
+        self._capacity = capacity
+        self._flush_interval = flush_interval
+        self._cache: OrderedDict[str, Board] = OrderedDict()
+        self._dirty: dict[str, Board] = {}
+        self._flushing: dict[str, Board] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_boards = 0
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="store-flush", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def save(self, game_id: str, board: Board) -> None:
+        board = [row[:] for row in board]
+        with self._lock:
+            self._dirty[game_id] = board
+            self._remember(game_id, board)
+
+    def load(self, game_id: str) -> Board:
+        with self._lock:
+            board = (self._cache.get(game_id) or self._dirty.get(game_id)
+                     or self._flushing.get(game_id))
+            if board is not None:
+                self.hits += 1
+                self._remember(game_id, board)
+                return [row[:] for row in board]
+            self.misses += 1
+        board = self._store.load(game_id)
+        with self._lock:
+            # A save may have raced with the read; never replace it.
+            if game_id not in self._cache and game_id not in self._dirty:
+                self._remember(game_id, board)
+        return [row[:] for row in board]
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._dirty = self._dirty, {}
+                self._flushing = batch
+            if not batch:
+                return 0
+            try:
+                self._store.save_many(batch.items())
+            except BaseException:
+                with self._lock:
+                    self._dirty = batch | self._dirty
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            with self._lock:
+                self.flushes += 1
+                self.flushed_boards += len(batch)
+            return len(batch)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "flushes": self.flushes,
+                "flushed_boards": self.flushed_boards,
+                "cached": len(self._cache),
+                "dirty": len(self._dirty),
+            }
+
+    def _remember(self, game_id: str, board: Board) -> None:
+        self._cache[game_id] = board
+        self._cache.move_to_end(game_id)
+        while len(self._cache) > self._capacity:
+            self._cache.popitem(last=False)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Background store flush failed")
+
+
+DIRECTIONS = list(Direction)
+
+
+def _pack_moves(directions: list[Direction]) -> bytes:
+    packed = bytearray((len(directions) + 3) // 4)
+    for i, direction in enumerate(directions):
+        packed[i // 4] |= DIRECTIONS.index(direction) << 2 * (i % 4)
+    return bytes(packed)
+
+
+def _unpack_moves(packed: bytes, count: int) -> list[Direction]:
+    return [DIRECTIONS[packed[i // 4] >> 2 * (i % 4) & 3]
+            for i in range(count)]
+
+
+def replay_moves(board: Board, seed: int, first_move: int,
+                 directions: list[Direction]) -> Board:
+    for move, direction in enumerate(directions, first_move):
+        board = logic.spawn_tile(
+            logic.slide(board, direction), logic.game_rng(seed, move))
+    return board
+
+
+class GameLog:
+    """Append-only SQLite log of each game's seed and moves.
+
+    Every `snapshot_interval` moves the board is also written, so any
+    position is rebuilt by replaying at most that many moves (plus the
+    rest of one append) from the nearest snapshot. Restarting a game
+    starts a new generation; earlier generations stay in the log. Undo
+    rewinds the current generation, dropping the moves it takes back."""
+
+    _CREATE = (
+        """CREATE TABLE IF NOT EXISTS game_starts (
+            game_id TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            seed INTEGER NOT NULL,
+            target INTEGER NOT NULL,
+            PRIMARY KEY (game_id, generation)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS game_moves (
+            game_id TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            first_move INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            moves BLOB NOT NULL,
+            PRIMARY KEY (game_id, generation, first_move)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS game_snapshots (
+            game_id TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            move INTEGER NOT NULL,
+            board BLOB NOT NULL,
+            PRIMARY KEY (game_id, generation, move)
+        ) WITHOUT ROWID""",
+    )
+    _INSERT_START = "INSERT INTO game_starts VALUES (?, ?, ?, ?)"
+    _INSERT_MOVES = "INSERT INTO game_moves VALUES (?, ?, ?, ?, ?)"
+    _INSERT_SNAPSHOT = "INSERT INTO game_snapshots VALUES (?, ?, ?, ?)"
+    _SELECT_START = ("SELECT generation, seed, target FROM game_starts "
+                     "WHERE game_id = ? ORDER BY generation DESC LIMIT 1")
+    _SELECT_SNAPSHOT = (
+        "SELECT move, board FROM game_snapshots WHERE game_id = ? "
+        "AND generation = ? AND move <= ? ORDER BY move DESC LIMIT 1")
+    _SELECT_MOVES = (
+        "SELECT first_move, count, moves FROM game_moves WHERE game_id = ? "
+        "AND generation = ? AND first_move + count > ? AND first_move <= ? "
+        "ORDER BY first_move")
+    _SELECT_LAST_MOVE = (
+        "SELECT COALESCE(MAX(first_move + count - 1), 0) FROM game_moves "
+        "WHERE game_id = ? AND generation = ?")
+
+    def __init__(self, path: Path = DEFAULT_LOG_PATH,
+                 snapshot_interval: int = 64, capacity: int = 1024):
+        self._path = path
+        self._snapshot_interval = snapshot_interval
+        self._capacity = capacity
+        self._local = threading.local()
+        self._heads: OrderedDict[str, GameHead] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.replayed_moves = 0
+        conn = self._connection()
+        for statement in self._CREATE:
+            conn.execute(statement)
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "replayed_moves": self.replayed_moves,
+                "cached": len(self._heads),
+            }
+
+    def load(self, game_id: str) -> Board:
+        return [row[:] for row in self.head(game_id).board]
+
+    def head(self, game_id: str) -> GameHead:
+        with self._lock:
+            head = self._heads.get(game_id)
+            if head is not None:
+                self.hits += 1
+                self._heads.move_to_end(game_id)
+                return head
+            self.misses += 1
+        head = self._load_head(game_id)
+        with self._lock:
+            # A create or append may have raced with the read; keep it.
+            head = self._heads.setdefault(game_id, head)
+            self._remember(game_id, head)
+        return head
+
+    @timed(STORE_LATENCY, operation="create")
+    def create(self, game_id: str, seed: int, board: Board,
+               target: int = DEFAULT_TARGET) -> GameHead:
+        conn = self._connection()
+        with self._lock:
+            row = conn.execute(self._SELECT_START, (game_id,)).fetchone()
+            head = GameHead(row[0] + 1 if row else 0, seed, 0,
+                            [r[:] for r in board], target)
+            conn.execute("BEGIN")
+            try:
+                conn.execute(self._INSERT_START,
+                             (game_id, head.generation, seed, target))
+                conn.execute(self._INSERT_SNAPSHOT, (
+                    game_id, head.generation, 0, _pack_board(board)))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._remember(game_id, head)
+        return head
+
+    @timed(STORE_LATENCY, operation="append")
+    def append(self, game_id: str, head: GameHead,
+               directions: list[Direction], board: Board) -> GameHead:
+        """Record `directions` as played from `head`, ending on `board`.
+
+        Raises GameConflictError if the game moved on since `head` was
+        read, since the moves were played with that head's spawns."""
+        conn = self._connection()
+        with self._lock:
+            moves = head.moves + len(directions)
+            # IMMEDIATE takes the write lock up front, so no other process
+            # can move the game between the check and the insert.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_head(conn, game_id, head)
+                conn.execute(self._INSERT_MOVES, (
+                    game_id, head.generation, head.moves + 1,
+                    len(directions), _pack_moves(directions)))
+                if (moves // self._snapshot_interval
+                        > head.moves // self._snapshot_interval):
+                    conn.execute(self._INSERT_SNAPSHOT, (
+                        game_id, head.generation, moves,
+                        _pack_board(board)))
+            except (GameConflictError, sqlite3.IntegrityError):
+                conn.execute("ROLLBACK")
+                # Another process moved the game; reload it next time.
+                self._heads.pop(game_id, None)
+                raise GameConflictError(game_id)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            head = GameHead(head.generation, head.seed, moves,
+                            [r[:] for r in board], head.target)
+            self._remember(game_id, head)
+        return head
+
+    @timed(STORE_LATENCY, operation="rewind")
+    def rewind(self, game_id: str, head: GameHead, move: int,
+               board: Board) -> GameHead:
+        """Drop the current game's moves after `move`, which left `board`.
+
+        Raises GameConflictError if the game moved on since `head` was
+        read."""
+        if not 0 <= move <= head.moves:
+            raise GameConflictError(game_id)
+        conn = self._connection()
+        with self._lock:
+            key = (game_id, head.generation)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_head(conn, game_id, head)
+                # The append that spans `move` keeps its earlier moves.
+                row = conn.execute(
+                    "SELECT first_move, count, moves FROM game_moves "
+                    "WHERE game_id = ? AND generation = ? AND first_move <= ? "
+                    "AND first_move + count - 1 > ?", (*key, move, move),
+                ).fetchone()
+                if row is not None:
+                    first, count, moves = row
+                    kept = _unpack_moves(moves, count)[:move - first + 1]
+                    conn.execute(
+                        "UPDATE game_moves SET count = ?, moves = ? "
+                        "WHERE game_id = ? AND generation = ? "
+                        "AND first_move = ?",
+                        (len(kept), _pack_moves(kept), *key, first))
+                conn.execute(
+                    "DELETE FROM game_moves WHERE game_id = ? "
+                    "AND generation = ? AND first_move > ?", (*key, move))
+                conn.execute(
+                    "DELETE FROM game_snapshots WHERE game_id = ? "
+                    "AND generation = ? AND move > ?", (*key, move))
+            except GameConflictError:
+                conn.execute("ROLLBACK")
+                self._heads.pop(game_id, None)
+                raise
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            head = GameHead(head.generation, head.seed, move,
+                            [r[:] for r in board], head.target)
+            self._remember(game_id, head)
+        return head
+
+    def verify(self, game_id: str, head: GameHead) -> None:
+        """Raise GameConflictError if the game moved on since `head` was
+        read, e.g. by another process. Requests that write nothing use it
+        to make sure they did not answer from a stale head."""
+        with self._lock:
+            try:
+                self._check_head(self._connection(), game_id, head)
+            except GameConflictError:
+                self._heads.pop(game_id, None)
+                raise
+
+    def replay(self, game_id: str, move: int) -> Board:
+        """Rebuild the board after `move` moves of the current game."""
+        head = self.head(game_id)
+        if not 0 <= move <= head.moves:
+            raise GameNotFoundError(f"{game_id} move {move}")
+        if move == head.moves:
+            return [row[:] for row in head.board]
+        return self._rebuild(game_id, head.generation, head.seed, move)
+
+    def _check_head(self, conn: sqlite3.Connection, game_id: str,
+                    head: GameHead) -> None:
+        """Raise GameConflictError unless `head` is the game's latest
+        generation and move as the log, not this process's cache, has it."""
+        row = conn.execute(self._SELECT_START, (game_id,)).fetchone()
+        if row is None or row[0] != head.generation:
+            raise GameConflictError(game_id)
+        (moves,) = conn.execute(
+            self._SELECT_LAST_MOVE, (game_id, head.generation)).fetchone()
+        if moves != head.moves:
+            raise GameConflictError(game_id)
+
+    def _remember(self, game_id: str, head: GameHead) -> None:
+        self._heads[game_id] = head
+        self._heads.move_to_end(game_id)
+        while len(self._heads) > self._capacity:
+            self._heads.popitem(last=False)
+
+    @timed(STORE_LATENCY, operation="load")
+    def _load_head(self, game_id: str) -> GameHead:
+        row = self._connection().execute(
+            self._SELECT_START, (game_id,)).fetchone()
+        if row is None:
+            raise GameNotFoundError(game_id)
+        generation, seed, target = row
+        (moves,) = self._connection().execute(
+            self._SELECT_LAST_MOVE, (game_id, generation)).fetchone()
+        board = self._rebuild(game_id, generation, seed, moves)
+        return GameHead(generation, seed, moves, board, target)
+
+    def _rebuild(self, game_id: str, generation: int, seed: int,
+                 move: int) -> Board:
+        conn = self._connection()
+        snapshot, packed = conn.execute(
+            self._SELECT_SNAPSHOT, (game_id, generation, move)).fetchone()
+        directions = []
+        for first, count, moves in conn.execute(
+                self._SELECT_MOVES, (game_id, generation, snapshot, move)):
+            unpacked = _unpack_moves(moves, count)
+            start = max(snapshot + 1, first)
+            directions += unpacked[start - first:move - first + 1]
+        with self._lock:
+            self.replayed_moves += len(directions)
+        return replay_moves(_unpack_board(packed), seed, snapshot + 1,
+                            directions)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self._path)
+        return conn
+
+
+class BoardLog:
+    """GameLog interface over a board store, which keeps only the latest
+    board: spawns are not seeded, win targets are not kept (every game
+    plays to DEFAULT_TARGET) and past positions cannot be replayed."""
+
+    def __init__(self, store: Store | CachedStore):
+        self._store = store
+
+    def start(self) -> None:
+        if isinstance(self._store, CachedStore):
+            self._store.start()
+
+    def close(self) -> None:
+        if isinstance(self._store, CachedStore):
+            self._store.close()
+
+    def stats(self) -> dict[str, int]:
+        if isinstance(self._store, CachedStore):
+            return self._store.stats()
+        return {}
+
+    def load(self, game_id: str) -> Board:
+        return self._store.load(game_id)
+
+    def head(self, game_id: str) -> GameHead:
+        return GameHead(0, None, 0, self._store.load(game_id))
+
+    def create(self, game_id: str, seed: int, board: Board,
+               target: int = DEFAULT_TARGET) -> GameHead:
+        self._store.save(game_id, board)
+        return GameHead(0, None, 0, board)
+
+    def append(self, game_id: str, head: GameHead,
+               directions: list[Direction], board: Board) -> GameHead:
+        self._store.save(game_id, board)
+        return GameHead(0, None, 0, board)
+
+    def rewind(self, game_id: str, head: GameHead, move: int,
+               board: Board) -> GameHead:
+        self._store.save(game_id, board)
+        return GameHead(0, None, 0, board)
+
+    def verify(self, game_id: str, head: GameHead) -> None:
+        pass
+
+    def replay(self, game_id: str, move: int) -> Board:
+        raise ReplayUnsupportedError("Board stores keep no move history")
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+from schemas import AgentResponse, Direction
+from symmetry import canonicalize
+
+
+class SuggestionCache:
+
+    def __init__(self, capacity: int = 1024, ttl: float = 300.0):
+        self._capacity = capacity
+        self._ttl = ttl
+        # Entries are stored for the canonical board, with move directions
+        # already mapped into the canonical orientation.
+        self._entries: OrderedDict[
+            tuple, tuple[float, AgentResponse, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency_ms = 0.0
+
+    def get(self, bits: int, key: Hashable) -> AgentResponse | None:
+        canonical, symmetry = canonicalize(bits)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((canonical, key))
+            if entry is not None and entry[0] < now:
+                del self._entries[(canonical, key)]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((canonical, key))
+            self.hits += 1
+            self.saved_latency_ms += entry[2]
+        return self._transform(entry[1], symmetry.unmap_direction)
+
+    def put(self, bits: int, key: Hashable, response: AgentResponse,
+            latency_ms: float) -> None:
+        canonical, symmetry = canonicalize(bits)
+        response = self._transform(response, symmetry.map_direction)
+        with self._lock:
+            self._entries[(canonical, key)] = (
+                time.monotonic() + self._ttl, response, latency_ms)
+            self._entries.move_to_end((canonical, key))
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_latency_ms": self.saved_latency_ms,
+                "entries": len(self._entries),
+            }
+
+    def _transform(self, response: AgentResponse,
+                   map_direction: Callable[[Direction], Direction]
+                   ) -> AgentResponse:
+        return response.model_copy(update={
+            "recommended_moves": [
+                move.model_copy(
+                    update={"direction": map_direction(move.direction)})
+                for move in response.recommended_moves
+            ]
+        })
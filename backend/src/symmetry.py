@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+
+import logic
+from schemas import Direction
+
+
+@dataclass(frozen=True)
+class Symmetry:
+    flip_horizontal: bool
+    flip_vertical: bool
+    transpose: bool
+
+    def apply(self, bits: int) -> int:
+        if self.flip_horizontal:
+            bits = flip_horizontal_bits(bits)
+        if self.flip_vertical:
+            bits = flip_vertical_bits(bits)
+        if self.transpose:
+            bits = logic.transpose_bits(bits)
+        return bits
+
+    def map_direction(self, direction: Direction) -> Direction:
+        if self.flip_horizontal:
+            direction = _FLIP_HORIZONTAL[direction]
+        if self.flip_vertical:
+            direction = _FLIP_VERTICAL[direction]
+        if self.transpose:
+            direction = _TRANSPOSE[direction]
+        return direction
+
+    def unmap_direction(self, direction: Direction) -> Direction:
+        if self.transpose:
+            direction = _TRANSPOSE[direction]
+        if self.flip_vertical:
+            direction = _FLIP_VERTICAL[direction]
+        if self.flip_horizontal:
+            direction = _FLIP_HORIZONTAL[direction]
+        return direction
+
+
+_FLIP_HORIZONTAL = {
+    Direction.UP: Direction.UP,
+    Direction.DOWN: Direction.DOWN,
+    Direction.LEFT: Direction.RIGHT,
+    Direction.RIGHT: Direction.LEFT,
+}
+_FLIP_VERTICAL = {
+    Direction.UP: Direction.DOWN,
+    Direction.DOWN: Direction.UP,
+    Direction.LEFT: Direction.LEFT,
+    Direction.RIGHT: Direction.RIGHT,
+}
+_TRANSPOSE = {
+    Direction.UP: Direction.LEFT,
+    Direction.DOWN: Direction.RIGHT,
+    Direction.LEFT: Direction.UP,
+    Direction.RIGHT: Direction.DOWN,
+}
+
+# The 8 rotations and reflections of the square.
+SYMMETRIES = [
+    Symmetry(h, v, t)
+    for t in (False, True) for v in (False, True) for h in (False, True)
+]
+
+
+def flip_horizontal_bits(bits: int) -> int:
+    bits = (bits & 0xF0F0F0F0F0F0F0F0) >> 4 | (bits & 0x0F0F0F0F0F0F0F0F) << 4
+    return (bits & 0xFF00FF00FF00FF00) >> 8 | (bits & 0x00FF00FF00FF00FF) << 8
+
+
+def flip_vertical_bits(bits: int) -> int:
+    return (bits >> 48 | bits >> 16 & 0xFFFF0000
+            | (bits & 0xFFFF0000) << 16 | (bits & 0xFFFF) << 48)
+
+
+def canonicalize(bits: int) -> tuple[int, Symmetry]:
+    return min(((s.apply(bits), s) for s in SYMMETRIES), key=lambda c: c[0])
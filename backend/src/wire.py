@@ -0,0 +1,99 @@
+import struct
+
+from schemas import Board, Direction, Status
+
+
+# Clients opt into a compact board through the Accept header. HEX keeps
+# the JSON body but sends the board as one hex digit per tile exponent,
+# row by row (16 characters for 4x4). BINARY sends the game packed into
+# bytes; see pack_game.
+JSON = "application/json"
+HEX = "application/vnd.2048.hex+json"
+BINARY = "application/octet-stream"
+
+# Binary layout: board size, status code, legal-move bitmask (bit i set if
+# DIRECTIONS[i] is legal), then the board as ceil(size² / 2) bytes of
+# exponent nibbles (a 4x4 board is its 8-byte bitboard, big-endian), then
+# the UTF-8 game id.
+HEADER = struct.Struct("<BBB")
+DIRECTIONS = list(Direction)
+STATUS_CODES = {None: 0, Status.WIN: 1, Status.LOSE: 2, Status.NOOP: 3}
+_STATUSES = {code: status for status, code in STATUS_CODES.items()}
+
+
+def negotiate(accept: str | None, offered: tuple[str, ...]) -> str:
+    """The offered media type the Accept header prefers. JSON is always
+    offered and is what wildcards or a missing header get."""
+    if not accept:
+        return JSON
+    preferences = []
+    for i, entry in enumerate(accept.split(",")):
+        media_type, *params = (part.strip() for part in entry.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        preferences.append((-q, i, media_type.lower()))
+    for q, _, media_type in sorted(preferences):
+        if q == 0:
+            break
+        if media_type in ("*/*", "application/*"):
+            return JSON
+        if media_type == JSON or media_type in offered:
+            return media_type
+    return JSON
+
+
+_DIGITS = "0123456789abcdef"
+
+
+def compact(board: Board) -> bool:
+    """Whether every tile fits a hex digit, i.e. none is above 2^15.
+    Boards bigger than 4x4 can go past it; those are sent as JSON."""
+    return all(v < 1 << 16 for row in board for v in row)
+
+
+def board_hex(board: Board) -> str:
+    if not compact(board):
+        raise ValueError("tiles above 2^15 do not fit a hex digit")
+    return "".join([_DIGITS[v.bit_length() - 1] if v else "0"
+                    for row in board for v in row])
+
+
+def board_from_hex(text: str) -> Board:
+    size = int(len(text) ** 0.5)
+    if size * size != len(text):
+        raise ValueError(f"{len(text)} digits do not make a square board")
+    exponents = [int(c, 16) for c in text]
+    return [[1 << e if e else 0 for e in exponents[r * size:(r + 1) * size]]
+            for r in range(size)]
+
+
+def encode_board(board: Board, media_type: str) -> Board | str:
+    """The board as it goes in a JSON body of `media_type`."""
+    return board_hex(board) if media_type == HEX else board
+
+
+def pack_game(game_id: str, board: Board, status: Status | None,
+              legal_moves: list[Direction]) -> bytes:
+    digits = board_hex(board)
+    mask = 0
+    for direction in legal_moves:
+        mask |= 1 << DIRECTIONS.index(direction)
+    return (HEADER.pack(len(board), STATUS_CODES[status], mask)
+            + bytes.fromhex(digits + "0" * (len(digits) % 2))
+            + game_id.encode())
+
+
+def unpack_game(data: bytes) -> tuple[str, Board, Status | None,
+                                      list[Direction]]:
+    size, code, mask = HEADER.unpack_from(data)
+    cells = size * size
+    end = HEADER.size + (cells + 1) // 2
+    board = board_from_hex(data[HEADER.size:end].hex()[:cells])
+    legal_moves = [d for i, d in enumerate(DIRECTIONS) if mask >> i & 1]
+    return data[end:].decode(), board, _STATUSES[code], legal_moves
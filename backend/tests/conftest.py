@@ -1,6 +1,13 @@
+import os
 import sys
 import pathlib
+import tempfile
 
 HERE = pathlib.Path(__file__).resolve().parent
 SRC = (HERE / ".." / "src").resolve()
 sys.path.insert(0, str(SRC))
+
+# api opens its store on import; keep the file out of the source tree.
+STORE_DIR = tempfile.TemporaryDirectory()
+os.environ.setdefault(
+    "STORE_PATH", str(pathlib.Path(STORE_DIR.name) / "games.db"))
@@ -1,9 +1,16 @@
+import asyncio
 import os
-from unittest.mock import MagicMock, patch
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 
-from schemas import AgentConfig, AgentResponse, Move
-from agent import GameAgent, SYSTEM_PROMPT
+from schemas import (
+    AgentConfig, AgentBackend, AgentResponse, Direction, Move,
+    SuggestionSource)
+import metrics
+from agent import GameAgent, SYSTEM_PROMPT, UnsupportedBoardError
+from rollout import MoveStats
 
 
 @pytest.fixture
@@ -13,7 +20,8 @@ def mock_store():
 
 @pytest.fixture
 def mock_groq():
-    with patch("agent.Groq") as mock:
+    with patch("groq.AsyncGroq") as mock:
+        mock.return_value.chat.completions.create = AsyncMock()
         yield mock
 
 
@@ -44,6 +52,10 @@ Board Metrics:
 - Empty spaces: 13
 - Highest tile: 8
 - Total value: 14
+- Possible merges: 0
+- Monotonic rows/columns: 8 of 8
+- Roughness (tile exponent steps, lower is smoother): 3
+- Highest tile in a corner: yes
 
 Provide exactly 1 move recommendation(s).
 
@@ -75,6 +87,7 @@ Respond with the following JSON format (valid JSON only):
 
     mock_client_instance = mock_groq.return_value
     mock_chat_completion = MagicMock()
+    mock_chat_completion.usage = None
     mock_chat_completion.choices[0].message.content = mock_response_content
     mock_client_instance.chat.completions.create.return_value = mock_chat_completion
 
@@ -82,22 +95,467 @@ Respond with the following JSON format (valid JSON only):
         recommended_moves=[
             Move(direction="UP", reasoning="test", confidence=0.8)
         ],
-        game_analysis="test"
+        game_analysis="test",
+        source=SuggestionSource.LLM
     )
 
-    assert agent.invoke(1) == expected_response
-    mock_store.load.assert_called_once()
+    assert agent.invoke("g1", 1) == expected_response
+    mock_store.load.assert_called_once_with("g1")
     mock_client_instance.chat.completions.create.assert_called_once_with(
         messages=expected_messages, model="a", temperature=0)
 
 
-def test_invoke_validation_error(agent, mock_store, mock_groq):
+def test_client_is_built_on_first_use(mock_store, mock_groq):
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(AgentConfig(model="a", temperature=0), mock_store)
+    mock_groq.assert_not_called()
+    agent.warm_up()
+    mock_groq.assert_called_once_with(api_key="fake_key", base_url=None)
+    agent.warm_up()
+    mock_groq.assert_called_once()
+
+
+@pytest.mark.parametrize("content", ['{"missing": "stuff!"}', "not json"])
+def test_invoke_validation_error(agent, mock_store, mock_groq, content):
     mock_store.load.return_value = [[0]*4]*4
+    failures = metrics.LLM_PARSE_FAILURES.value()
 
     mock_chat_completion = MagicMock()
-    mock_chat_completion.choices[0].message.content = '{"missing": "stuff!"}'
+    mock_chat_completion.usage = None
+    mock_chat_completion.choices[0].message.content = content
     mock_groq.return_value.chat.completions.create.return_value = mock_chat_completion
 
-    response = agent.invoke(1)
+    response = agent.invoke("g1", 1)
     assert len(response.recommended_moves) == 1
     assert response.recommended_moves[0].reasoning == "Default recommendation due to parsing error"
+    assert metrics.LLM_PARSE_FAILURES.value() == failures + 1
+
+
+def test_invoke_expectimax(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0,
+                         backend=AgentBackend.EXPECTIMAX, search_depth=2)
+    agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [
+        [2, 4, 2, 4],
+        [4, 2, 4, 2],
+        [2, 4, 2, 4],
+        [4, 2, 4, 0]
+    ]
+
+    response = agent.invoke("g1", 3)
+    assert [m.direction for m in response.recommended_moves] in (
+        [Direction.DOWN, Direction.RIGHT], [Direction.RIGHT, Direction.DOWN])
+    assert response.recommended_moves[0].confidence == 1.0
+    mock_groq.return_value.chat.completions.create.assert_not_called()
+
+
+def test_invoke_expectimax_no_legal_moves(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0,
+                         backend=AgentBackend.EXPECTIMAX)
+    agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [
+        [2, 4, 2, 4],
+        [4, 2, 4, 2],
+        [2, 4, 2, 4],
+        [4, 2, 4, 2]
+    ]
+
+    response = agent.invoke("g1", 1)
+    assert response.recommended_moves == []
+
+
+def test_invoke_expectimax_rejects_other_sizes(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0,
+                         backend=AgentBackend.EXPECTIMAX)
+    agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0, 0]] + [[0]*5]*4
+
+    with pytest.raises(UnsupportedBoardError):
+        agent.invoke("g1", 1)
+
+
+def test_invoke_rollout(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0,
+                         backend=AgentBackend.ROLLOUT)
+    with patch("agent.RolloutEvaluator") as mock_rollout:
+        agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4]
+    mock_rollout.return_value.rank.return_value = [
+        MoveStats(Direction.DOWN, 10, 500.0, 60.0, 20.0, 0.9),
+        MoveStats(Direction.RIGHT, 10, 400.0, 55.0, 20.0, 0.1),
+    ]
+
+    response = agent.invoke("g1", 1)
+    assert len(response.recommended_moves) == 1
+    assert response.recommended_moves[0].direction == Direction.DOWN
+    assert response.recommended_moves[0].confidence == 0.9
+    mock_rollout.return_value.rank.assert_called_once_with(
+        0x1000000000000000)
+    mock_groq.return_value.chat.completions.create.assert_not_called()
+
+
+def test_invoke_cache_hit_on_symmetric_board(agent, mock_store, mock_groq):
+    mock_chat_completion = MagicMock()
+    mock_chat_completion.usage = None
+    mock_chat_completion.choices[0].message.content = """{
+        "recommended_moves": [
+            {"direction": "LEFT", "reasoning": "test", "confidence": 0.8}
+        ],
+        "game_analysis": "test"
+    }"""
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = mock_chat_completion
+
+    mock_store.load.return_value = [[2, 4, 0, 0], [0]*4, [0]*4, [0]*4]
+    assert agent.invoke("g1", 1).recommended_moves[0].direction == "LEFT"
+    mock_store.load.return_value = [[0, 0, 4, 2], [0]*4, [0]*4, [0]*4]
+    assert agent.invoke("g2", 1).recommended_moves[0].direction == "RIGHT"
+    create.assert_called_once()
+    assert agent.cache_stats()["hits"] == 1
+
+
+def test_invoke_position_table_hit(mock_store, mock_groq, tmp_path):
+    from positions import write_table
+    from symmetry import canonicalize
+    import logic
+    board = [[2, 4, 0, 0], [0]*4, [0]*4, [0]*4]
+    # The canonical board is rotated half a turn, so the table's RIGHT is
+    # LEFT on the stored board.
+    canonical = canonicalize(logic.to_bitboard(board))[0]
+    write_table(tmp_path / "positions.bin",
+                {canonical: [1.0, 2.0, 30.0, 50.0]}, depth=3)
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        config = AgentConfig(model="a", temperature=0,
+                             position_table=str(tmp_path / "positions.bin"))
+        agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = board
+
+    response = agent.invoke("g1", 2)
+    assert [m.direction for m in response.recommended_moves] == [
+        Direction.LEFT, Direction.RIGHT]
+    assert response.recommended_moves[0].confidence == 1.0
+    assert response.recommended_moves[0].reasoning.endswith(
+        "3-move search solved offline")
+    assert agent.cache_stats()["position_hits"] == 1
+    mock_groq.return_value.chat.completions.create.assert_not_called()
+    agent.close()
+
+
+def test_invoke_parse_error_is_not_cached(agent, mock_store, mock_groq):
+    mock_store.load.return_value = [[0]*4]*4
+    mock_chat_completion = MagicMock()
+    mock_chat_completion.usage = None
+    mock_chat_completion.choices[0].message.content = '{"missing": "stuff!"}'
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = mock_chat_completion
+
+    agent.invoke("g1", 1)
+    agent.invoke("g1", 1)
+    assert create.call_count == 2
+
+
+def _completion(content, prompt_tokens=10, completion_tokens=5):
+    chat_completion = MagicMock()
+    chat_completion.choices[0].message.content = content
+    chat_completion.usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    return chat_completion
+
+
+def test_ainvoke_success(mock_store, mock_groq):
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(AgentConfig(model="a", temperature=0), mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4]
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = _completion("""{
+        "recommended_moves": [
+            {"direction": "DOWN", "reasoning": "test", "confidence": 0.7}
+        ],
+        "game_analysis": "test"
+    }""")
+
+    response = asyncio.run(agent.ainvoke("g1", 1))
+    assert response.recommended_moves[0].direction == Direction.DOWN
+    mock_store.load.assert_called_once_with("g1")
+    create.assert_awaited_once()
+
+
+@pytest.mark.parametrize("content", ['{"missing": "stuff!"}', "not json"])
+def test_ainvoke_records_llm_metrics(mock_store, mock_groq, content):
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(AgentConfig(model="a", temperature=0), mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4]
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = _completion(
+        content, prompt_tokens=120, completion_tokens=30)
+    prompt = metrics.LLM_TOKENS.value(kind="prompt")
+    completion = metrics.LLM_TOKENS.value(kind="completion")
+    failures = metrics.LLM_PARSE_FAILURES.value()
+    calls = metrics.LLM_LATENCY.count(mode="async")
+
+    response = asyncio.run(agent.ainvoke("g1", 1))
+    assert response.game_analysis == "Unable to analyze"
+    assert metrics.LLM_TOKENS.value(kind="prompt") == prompt + 120
+    assert metrics.LLM_TOKENS.value(kind="completion") == completion + 30
+    assert metrics.LLM_PARSE_FAILURES.value() == failures + 1
+    assert metrics.LLM_LATENCY.count(mode="async") == calls + 1
+
+
+def test_ainvoke_timeout(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0, call_timeout_s=0.01)
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4]
+
+    async def slow(**kwargs):
+        await asyncio.sleep(1)
+
+    mock_groq.return_value.chat.completions.create.side_effect = slow
+    with pytest.raises(TimeoutError):
+        asyncio.run(agent.ainvoke("g1", 1))
+
+
+def test_ainvoke_limits_concurrency(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0, max_concurrent_calls=2,
+                         cache_size=0)
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4]
+    in_flight, peak = 0, 0
+
+    async def tracked(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return _completion('{"missing": "stuff!"}')
+
+    mock_groq.return_value.chat.completions.create.side_effect = tracked
+
+    async def run_all():
+        return await asyncio.gather(*(agent.ainvoke("g1", 1) for _ in range(6)))
+
+    responses = asyncio.run(run_all())
+    assert len(responses) == 6
+    assert peak == 2
+
+
+_VALID = """{
+    "recommended_moves": [
+        {"direction": "UP", "reasoning": "test", "confidence": 0.7}
+    ],
+    "game_analysis": "test"
+}"""
+
+
+def _hedged_agent(mock_store, **config):
+    config = AgentConfig(model="a", temperature=0, hedge_timeout_ms=50,
+                         **config)
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(config, mock_store)
+    # Every direction is legal on this board.
+    mock_store.load.return_value = [[2, 2, 0, 0], [2, 2, 0, 0], [0]*4, [0]*4]
+    return agent
+
+
+def test_hedge_returns_llm_answer_in_time(mock_store, mock_groq):
+    agent = _hedged_agent(mock_store)
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = _completion(_VALID)
+    answered = metrics.HEDGED_SUGGESTIONS.value(outcome="llm")
+
+    response = asyncio.run(agent.ainvoke("g1", 1))
+    assert response.source == SuggestionSource.LLM
+    assert metrics.HEDGED_SUGGESTIONS.value(outcome="llm") == answered + 1
+
+
+def test_hedge_falls_back_after_deadline(mock_store, mock_groq):
+    agent = _hedged_agent(mock_store)
+
+    async def slow(**kwargs):
+        await asyncio.sleep(0.2)
+        return _completion(_VALID)
+
+    create = mock_groq.return_value.chat.completions.create
+    create.side_effect = slow
+
+    async def run():
+        start = time.perf_counter()
+        response = await agent.ainvoke("g1", 4)
+        elapsed = time.perf_counter() - start
+        # The late answer finishes in the background and is cached.
+        await asyncio.sleep(0.3)
+        return response, elapsed, await agent.ainvoke("g1", 4)
+
+    response, elapsed, later = asyncio.run(run())
+    assert elapsed < 0.15
+    assert response.source == SuggestionSource.GREEDY
+    assert response.game_analysis.startswith(
+        "The LLM did not answer within 50 ms")
+    assert len(response.recommended_moves) == 4
+    assert response.recommended_moves[0].confidence == 1.0
+    assert later.source == SuggestionSource.LLM
+    create.assert_awaited_once()
+
+
+@pytest.mark.parametrize("content", ['{"missing": "stuff!"}', "not json"])
+def test_hedge_falls_back_on_invalid_answer(mock_store, mock_groq, content):
+    agent = _hedged_agent(mock_store)
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = _completion(content)
+    failures = metrics.LLM_PARSE_FAILURES.value()
+    invalid = metrics.HEDGED_SUGGESTIONS.value(outcome="invalid")
+
+    response = asyncio.run(agent.ainvoke("g1", 1))
+    assert response.source == SuggestionSource.GREEDY
+    assert response.recommended_moves[0].confidence == 1.0
+    assert metrics.LLM_PARSE_FAILURES.value() == failures + 1
+    assert metrics.HEDGED_SUGGESTIONS.value(outcome="invalid") == invalid + 1
+
+
+def test_hedge_falls_back_on_error(mock_store, mock_groq):
+    agent = _hedged_agent(mock_store)
+    create = mock_groq.return_value.chat.completions.create
+    create.side_effect = ConnectionError("down")
+
+    response = asyncio.run(agent.ainvoke("g1", 1))
+    assert response.source == SuggestionSource.GREEDY
+    assert "ConnectionError" in response.game_analysis
+
+
+def test_invoke_hedges_like_ainvoke(mock_store, mock_groq):
+    agent = _hedged_agent(mock_store)
+    mock_groq.return_value.chat.completions.create.return_value = (
+        _completion('{"missing": "stuff!"}'))
+
+    response = agent.invoke("g1", 1)
+    assert response.source == SuggestionSource.GREEDY
+
+
+def test_ainvoke_local_backend_runs_off_loop(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0,
+                         backend=AgentBackend.EXPECTIMAX, search_depth=1)
+    agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4]
+
+    response = asyncio.run(agent.ainvoke("g1", 4))
+    assert {m.direction for m in response.recommended_moves} == {
+        Direction.DOWN, Direction.RIGHT}
+
+
+class FakeStream:
+
+    def __init__(self, pieces, usage=None):
+        self._pieces = iter(pieces)
+        self._usage = usage
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            piece = next(self._pieces)
+        except StopIteration:
+            if self._usage is None:
+                raise StopAsyncIteration
+            # Groq sends the usage on a final chunk without content.
+            chunk = SimpleNamespace(
+                choices=[], x_groq=SimpleNamespace(usage=self._usage))
+            self._usage = None
+            return chunk
+        chunk = MagicMock()
+        chunk.choices[0].delta.content = piece
+        chunk.x_groq = None
+        return chunk
+
+    async def close(self):
+        self.closed = True
+
+
+def _collect(agent, game_id, num_suggestions):
+    async def run():
+        events = await agent.astream(game_id, num_suggestions)
+        return [event async for event in events]
+    return asyncio.run(run())
+
+
+STREAMED_RESPONSE = """{
+  "recommended_moves": [
+    {"direction": "LEFT", "reasoning": "first", "confidence": 0.9},
+    {"direction": "UP", "reasoning": "second", "confidence": 0.4}
+  ],
+  "game_analysis": "fine"
+}"""
+
+
+def test_astream_yields_moves_incrementally(mock_store, mock_groq):
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(AgentConfig(model="a", temperature=0), mock_store)
+    mock_store.load.return_value = [[2, 4, 0, 0], [0]*4, [0]*4, [0]*4]
+    pieces = [STREAMED_RESPONSE[i:i + 7]
+              for i in range(0, len(STREAMED_RESPONSE), 7)]
+    seen = []
+
+    class RecordingStream(FakeStream):
+        async def __anext__(self):
+            chunk = await super().__anext__()
+            seen.append(chunk.choices[0].delta.content)
+            return chunk
+
+    stream = RecordingStream(pieces)
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = stream
+
+    async def run():
+        events = await agent.astream("g1", 2)
+        first = await anext(events)
+        received_before_first = "".join(seen)
+        rest = [event async for event in events]
+        return first, received_before_first, rest
+
+    first, received_before_first, rest = asyncio.run(run())
+    assert first == Move(direction="LEFT", reasoning="first", confidence=0.9)
+    assert "game_analysis" not in received_before_first
+    assert rest[0].direction == Direction.UP
+    assert rest[1].game_analysis == "fine"
+    assert stream.closed
+    assert create.call_args.kwargs["stream"] is True
+
+
+def test_astream_records_usage(mock_store, mock_groq):
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(AgentConfig(model="a", temperature=0), mock_store)
+    mock_store.load.return_value = [[2, 4, 0, 0], [0]*4, [0]*4, [0]*4]
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = FakeStream(
+        [STREAMED_RESPONSE],
+        SimpleNamespace(prompt_tokens=90, completion_tokens=40))
+    prompt = metrics.LLM_TOKENS.value(kind="prompt")
+
+    _collect(agent, "g1", 2)
+    assert metrics.LLM_TOKENS.value(kind="prompt") == prompt + 90
+    assert "stream_options" not in create.call_args.kwargs
+
+
+def test_astream_unparseable_output_falls_back(mock_store, mock_groq):
+    with patch.dict(os.environ, {"GROQ_API_KEY": "fake_key"}):
+        agent = GameAgent(AgentConfig(model="a", temperature=0), mock_store)
+    mock_store.load.return_value = [[2, 4, 0, 0], [0]*4, [0]*4, [0]*4]
+    mock_groq.return_value.chat.completions.create.return_value = (
+        FakeStream(['{"missing": ', '"stuff!"}']))
+
+    events = _collect(agent, "g1", 1)
+    assert events[0].reasoning == "Default recommendation due to parsing error"
+    assert events[-1].game_analysis == "Unable to analyze"
+
+
+def test_astream_local_backend(mock_store, mock_groq):
+    config = AgentConfig(model="a", temperature=0,
+                         backend=AgentBackend.EXPECTIMAX, search_depth=1)
+    agent = GameAgent(config, mock_store)
+    mock_store.load.return_value = [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4]
+
+    events = _collect(agent, "g1", 4)
+    assert [type(e) for e in events] == [Move, Move, AgentResponse]
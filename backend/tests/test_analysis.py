@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+
+from analysis import (
+    BatchAnalyzer, CHUNK_SIZE, analyze_board, analyze_boards, validate_board)
+from evaluation import board_metrics
+from expectimax import ExpectimaxSearch
+
+
+BOARD = [
+    [2, 4, 2, 4],
+    [4, 2, 4, 2],
+    [2, 4, 2, 4],
+    [4, 2, 4, 0],
+]
+
+
+@pytest.mark.parametrize("board", [
+    BOARD,
+    [[0]*3]*3,
+    [[2**15, 0, 0, 0]] + [[0]*4]*3,
+    [[2**20] + [0]*4] + [[0]*5]*4,
+])
+def test_validate_board(board):
+    validate_board(board)
+
+
+@pytest.mark.parametrize("board", [
+    [[2, 0], [0, 0]],
+    [[0]*9]*9,
+    [[0]*4]*3,
+    [[0]*4, [0]*3, [0]*4, [0]*4],
+    [[3, 0, 0, 0]] + [[0]*4]*3,
+    [[1, 0, 0, 0]] + [[0]*4]*3,
+    [[-2, 0, 0, 0]] + [[0]*4]*3,
+    [[2**16, 0, 0, 0]] + [[0]*4]*3,
+])
+def test_validate_board_rejects(board):
+    with pytest.raises(ValueError):
+        validate_board(board)
+
+
+def test_analyze_board():
+    result = analyze_board(ExpectimaxSearch(2, 1000), BOARD)
+    assert {m["direction"] for m in result["moves"]} == {"DOWN", "RIGHT"}
+    assert result["moves"][0]["value"] >= result["moves"][1]["value"]
+    assert result["search_depth"] == 2
+    assert result["metrics"] == board_metrics(BOARD)
+
+
+def test_analyze_board_other_sizes():
+    result = analyze_board(ExpectimaxSearch(2, 1000),
+                           [[2, 0, 2], [0]*3, [0]*3])
+    assert result["moves"][0]["direction"] in ("LEFT", "RIGHT")
+    assert result["search_depth"] == 1
+    lost = analyze_board(ExpectimaxSearch(2, 1000),
+                         [[2, 4, 2], [4, 2, 4], [2, 4, 2]])
+    assert (lost["moves"], lost["search_depth"]) == ([], 0)
+
+
+def test_batch_analyzer_streams_in_order():
+    boards = [[[2 ** (i % 11 + 1), 0, 0, 0]] + [[0]*4]*3
+              for i in range(2 * CHUNK_SIZE + 5)]
+    boards[3] = [[2, 0, 0, 0, 0]] + [[0]*5]*4
+    analyzer = BatchAnalyzer(1, 1000, workers=2)
+
+    async def collect():
+        return [result async for result in analyzer.analyze(boards)]
+
+    try:
+        results = asyncio.run(collect())
+    finally:
+        analyzer.close()
+    assert [r.pop("index") for r in results] == list(range(len(boards)))
+    assert results == analyze_boards(boards, 1, 1000)
@@ -1,9 +1,22 @@
-from unittest.mock import patch
+import asyncio
+import json
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
 import pytest
 
+import api
+import metrics
+import wire
+from agent import UnsupportedBoardError
+from analysis import BatchAnalyzer
+from history import HistoryError
 from api import app
-from schemas import Direction, Status, AgentResponse
+from schemas import Direction, Status, AgentResponse, Move
+from store import (
+    GameConflictError, GameNotFoundError, ReplayUnsupportedError)
 
 client = TestClient(app)
 
@@ -17,19 +30,91 @@ def mock_service():
 @pytest.fixture
 def mock_agent():
     with patch("api.agent") as mock:
+        mock.ainvoke = AsyncMock()
         yield mock
 
 
 def test_restart(mock_service):
     expected_board = [[0]*4]*4
-    mock_service.restart_game.return_value = expected_board
+    mock_service.restart_game.return_value = (
+        expected_board, [Direction.UP, Direction.LEFT])
 
     response = client.patch("/api/restart")
     assert response.status_code == 200
     data = response.json()
     assert data["board"] == expected_board
     assert data["status"] is None
-    mock_service.restart_game.assert_called_once()
+    assert data["legal_moves"] == ["UP", "LEFT"]
+    mock_service.restart_game.assert_called_once_with(
+        data["game_id"], 4, 2048)
+
+
+def test_restart_existing_game(mock_service):
+    mock_service.restart_game.return_value = ([[0]*4]*4, [Direction.UP])
+
+    response = client.patch("/api/restart?game_id=abc")
+    assert response.status_code == 200
+    assert response.json()["game_id"] == "abc"
+    mock_service.restart_game.assert_called_once_with("abc", 4, 2048)
+
+
+def test_restart_hex_board(mock_service):
+    mock_service.restart_game.return_value = (
+        [[2, 0, 0, 0]] + [[0]*4]*2 + [[0, 0, 0, 4]], [Direction.UP])
+
+    response = client.patch("/api/restart?game_id=abc",
+                            headers={"Accept": wire.HEX})
+    assert response.headers["content-type"] == wire.HEX
+    assert response.json() == {
+        "game_id": "abc", "board": "1000000000000002", "status": None,
+        "legal_moves": ["UP"]}
+
+
+def test_move_binary_board(mock_service):
+    board = [[2, 0, 0, 0]] + [[0]*4]*2 + [[0, 0, 0, 4]]
+    mock_service.make_move.return_value = (
+        board, Status.WIN, [Direction.LEFT])
+
+    response = client.patch("/api/move/LEFT?game_id=abc",
+                            headers={"Accept": wire.BINARY})
+    assert response.headers["content-type"] == wire.BINARY
+    assert len(response.content) == 3 + 8 + 3
+    assert wire.unpack_game(response.content) == (
+        "abc", board, Status.WIN, [Direction.LEFT])
+
+
+@pytest.mark.parametrize("accept", [wire.HEX, wire.BINARY])
+def test_move_large_tile_falls_back_to_json(mock_service, accept):
+    board = [[1 << 16] + [0]*4] + [[0]*5]*4
+    mock_service.make_move.return_value = (board, None, [Direction.LEFT])
+
+    response = client.patch("/api/move/LEFT?game_id=abc",
+                            headers={"Accept": accept})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == wire.JSON
+    assert response.json()["board"] == board
+
+
+def test_restart_invalid_game_id():
+    response = client.patch("/api/restart?game_id=a%20b")
+    assert response.status_code == 422
+
+
+def test_restart_custom_size_and_target(mock_service):
+    mock_service.restart_game.return_value = ([[0]*5]*5, [Direction.UP])
+
+    response = client.patch("/api/restart?game_id=abc&size=5&target=4096")
+    assert response.status_code == 200
+    assert response.json()["board"] == [[0]*5]*5
+    mock_service.restart_game.assert_called_once_with("abc", 5, 4096)
+
+
+@pytest.mark.parametrize("query", ["size=2", "size=9", "target=3000",
+                                   "target=2", "target=65536"])
+def test_restart_invalid_size_or_target(mock_service, query):
+    response = client.patch(f"/api/restart?{query}")
+    assert response.status_code == 422
+    mock_service.restart_game.assert_not_called()
 
 
 @pytest.mark.parametrize(
@@ -43,43 +128,415 @@ def test_restart(mock_service):
 )
 def test_move(mock_service, direction, status):
     expected_board = [[0]*4]*4
-    mock_service.make_move.return_value = (expected_board, status)
-    response = client.patch(f"/api/move/{direction.value}")
+    mock_service.make_move.return_value = (
+        expected_board, status, [Direction.DOWN])
+    response = client.patch(f"/api/move/{direction.value}?game_id=g1")
     assert response.status_code == 200
     data = response.json()
+    assert data["game_id"] == "g1"
     assert data["board"] == expected_board
     assert data["status"] == status
-    mock_service.make_move.assert_called_once_with(direction)
+    assert data["legal_moves"] == ["DOWN"]
+    mock_service.make_move.assert_called_once_with("g1", direction)
 
 
 def test_move_invalid_direction():
-    response = client.patch("/api/move/hi")
+    response = client.patch("/api/move/hi?game_id=g1")
+    assert response.status_code == 422
+
+
+def test_move_missing_game_id():
+    response = client.patch("/api/move/UP")
+    assert response.status_code == 422
+
+
+def test_move_unknown_game(mock_service):
+    mock_service.make_move.side_effect = GameNotFoundError("g1")
+    response = client.patch("/api/move/UP?game_id=g1")
+    assert response.status_code == 404
+
+
+def test_moves(mock_service):
+    expected_board = [[0]*4]*4
+    mock_service.make_moves.return_value = (
+        expected_board, [None, Status.NOOP, Status.LOSE], [])
+    response = client.patch(
+        "/api/moves?game_id=g1", json=["UP", "LEFT", "DOWN"])
+    assert response.status_code == 200
+    assert response.json() == {
+        "game_id": "g1",
+        "board": expected_board,
+        "statuses": [None, "NOOP", "LOSE"],
+        "legal_moves": [],
+    }
+    mock_service.make_moves.assert_called_once_with(
+        "g1", [Direction.UP, Direction.LEFT, Direction.DOWN])
+
+
+def test_moves_hex_board(mock_service):
+    mock_service.make_moves.return_value = (
+        [[2, 4, 0, 0]] + [[0]*4]*3, [None], [Direction.DOWN])
+    # Binary is only offered for single-board routes.
+    response = client.patch(
+        "/api/moves?game_id=g1", json=["UP"],
+        headers={"Accept": f"{wire.BINARY}, {wire.HEX};q=0.9"})
+    assert response.headers["content-type"] == wire.HEX
+    assert response.json()["board"] == "1200000000000000"
+
+
+@pytest.mark.parametrize("body", [[], ["UP", "SIDEWAYS"], "UP"])
+def test_moves_invalid_body(body):
+    response = client.patch("/api/moves?game_id=g1", json=body)
     assert response.status_code == 422
 
 
+def test_moves_unknown_game(mock_service):
+    mock_service.make_moves.side_effect = GameNotFoundError("g1")
+    response = client.patch("/api/moves?game_id=g1", json=["UP"])
+    assert response.status_code == 404
+
+
 def test_suggest_success(mock_agent):
     mock_output = {
         "recommended_moves": [
             {"direction": "UP", "reasoning": "Test", "confidence": 0.9}
         ],
-        "game_analysis": "Analysis"
+        "game_analysis": "Analysis",
+        "source": "LLM"
     }
-    mock_agent.invoke.return_value = AgentResponse(**mock_output)
+    mock_agent.ainvoke.return_value = AgentResponse(**mock_output)
 
-    response = client.post("/api/suggest/3")
+    response = client.post("/api/suggest/3?game_id=g1")
 
     assert response.status_code == 200
     assert response.json() == mock_output
-    mock_agent.invoke.assert_called_once_with(3)
+    mock_agent.ainvoke.assert_called_once_with("g1", 3)
 
 
 def test_suggest_agent_error(mock_agent):
-    mock_agent.invoke.side_effect = Exception("Agent error")
-    response = client.post("/api/suggest/3")
+    mock_agent.ainvoke.side_effect = Exception("Agent error")
+    response = client.post("/api/suggest/3?game_id=g1")
     assert response.status_code == 500
     assert response.json()["detail"] == "Agent invocation failed"
 
 
+def test_suggest_unknown_game(mock_agent):
+    mock_agent.ainvoke.side_effect = GameNotFoundError("g1")
+    response = client.post("/api/suggest/3?game_id=g1")
+    assert response.status_code == 404
+
+
+def test_suggest_unsupported_board(mock_agent):
+    mock_agent.ainvoke.side_effect = UnsupportedBoardError("4x4 only")
+    response = client.post("/api/suggest/3?game_id=g1")
+    assert response.status_code == 422
+    assert response.json()["detail"] == "4x4 only"
+
+
+def test_suggest_timeout(mock_agent):
+    mock_agent.ainvoke.side_effect = TimeoutError()
+    response = client.post("/api/suggest/3?game_id=g1")
+    assert response.status_code == 504
+
+
+def test_suggest_cancelled_on_disconnect(mock_agent, monkeypatch):
+    cancelled = asyncio.Event()
+
+    async def never_finishes(game_id, num_suggestions):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def disconnected(self):
+        return True
+
+    mock_agent.ainvoke.side_effect = never_finishes
+    monkeypatch.setattr("api.DISCONNECT_POLL_S", 0.01)
+    monkeypatch.setattr("api.Request.is_disconnected", disconnected)
+    response = client.post("/api/suggest/3?game_id=g1")
+    assert response.status_code == 499
+    assert cancelled.is_set()
+
+
 def test_suggest_input_error():
-    response = client.post("/api/suggest/hi")
+    response = client.post("/api/suggest/hi?game_id=g1")
+    assert response.status_code == 422
+
+
+def test_suggest_stream(mock_agent):
+    async def events():
+        yield Move(direction="UP", reasoning="Test", confidence=0.9)
+        yield AgentResponse(recommended_moves=[], game_analysis="Analysis")
+
+    mock_agent.astream = AsyncMock(return_value=events())
+    response = client.post("/api/suggest/1/stream?game_id=g1")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        'event: move\ndata: {"direction": "UP", "reasoning": "Test", '
+        '"confidence": 0.9}\n\n'
+        'event: analysis\ndata: {"game_analysis": "Analysis"}\n\n'
+    )
+    mock_agent.astream.assert_awaited_once_with("g1", 1)
+
+
+def test_suggest_stream_error_event(mock_agent):
+    async def events():
+        yield Move(direction="UP", reasoning="Test", confidence=0.9)
+        raise TimeoutError()
+
+    mock_agent.astream = AsyncMock(return_value=events())
+    response = client.post("/api/suggest/1/stream?game_id=g1")
+    assert response.text.endswith(
+        'event: error\ndata: {"detail": "Agent timed out"}\n\n')
+
+
+def test_suggest_stream_unknown_game(mock_agent):
+    mock_agent.astream = AsyncMock(side_effect=GameNotFoundError("g1"))
+    response = client.post("/api/suggest/1/stream?game_id=g1")
+    assert response.status_code == 404
+
+
+def test_metrics_records_route_latency(mock_service):
+    mock_service.make_move.return_value = ([[0]*4]*4, None, [])
+    before = metrics.REQUEST_LATENCY.count(route="move")
+    client.patch("/api/move/UP?game_id=g1")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert metrics.REQUEST_LATENCY.count(route="move") == before + 1
+    assert 'api_request_duration_seconds_count{route="move"}' in response.text
+    assert "# TYPE llm_tokens_total counter" in response.text
+
+
+def test_metrics_report_cache_stats(mock_agent):
+    mock_agent.cache_stats.return_value = {
+        "hits": 3, "misses": 1, "hit_rate": 0.75, "saved_latency_ms": 1500.0,
+        "entries": 2}
+    with patch.object(api.store, "stats", return_value={
+            "hits": 5, "misses": 2, "flushes": 1, "cached": 4}):
+        text = client.get("/metrics").text
+    for line in ['store_cache_events_total{event="hits"} 5',
+                 'store_cache_events_total{event="flushes"} 1',
+                 'store_cache_entries{state="cached"} 4',
+                 'suggestion_cache_lookups_total{result="hit"} 3',
+                 'suggestion_cache_lookups_total{result="miss"} 1',
+                 "suggestion_cache_hit_ratio 0.75",
+                 "suggestion_cache_saved_latency_seconds_total 1.5"]:
+        assert line in text.splitlines()
+
+
+def test_streamed_latency_is_recorded_when_the_body_ends(analyzer):
+    recorded_before_end = []
+
+    async def analyze(boards):
+        for i, board in enumerate(boards):
+            recorded_before_end.append(
+                metrics.REQUEST_LATENCY.observe.call_count)
+            yield {"index": i}
+
+    with patch.object(metrics, "REQUEST_LATENCY") as latency, \
+            patch.object(analyzer, "analyze", analyze):
+        response = client.post("/api/analyze", json=[[[0]*4]*4]*2)
+    assert len(response.text.splitlines()) == 2
+    assert recorded_before_end == [0, 0]
+    latency.observe.assert_called_once()
+    assert latency.observe.call_args.kwargs == {"route": "analyze"}
+
+
+def test_move_conflict(mock_service):
+    mock_service.make_move.side_effect = GameConflictError("g1")
+    response = client.patch("/api/move/UP?game_id=g1")
+    assert response.status_code == 409
+
+
+@pytest.mark.parametrize("route", ["undo", "redo"])
+def test_undo_redo(mock_service, route):
+    expected_board = [[2]*4]*4
+    getattr(mock_service, route).return_value = (
+        expected_board, [Direction.UP])
+    response = client.patch(f"/api/{route}?game_id=g1")
+    assert response.status_code == 200
+    assert response.json() == {"game_id": "g1", "board": expected_board,
+                               "status": None, "legal_moves": ["UP"]}
+    getattr(mock_service, route).assert_called_once_with("g1")
+
+
+@pytest.mark.parametrize(
+    "error, status_code, detail",
+    [(GameNotFoundError("g1"), 404, "Game not found"),
+     (GameConflictError("g1"), 409, "Game changed; retry"),
+     (HistoryError("Nothing to undo"), 409, "Nothing to undo")],
+)
+def test_undo_errors(mock_service, error, status_code, detail):
+    mock_service.undo.side_effect = error
+    response = client.patch("/api/undo?game_id=g1")
+    assert response.status_code == status_code
+    assert response.json()["detail"] == detail
+
+
+@pytest.fixture
+def analyzer():
+    with patch("api.analyzer", BatchAnalyzer(1, 1000, workers=1)) as mock:
+        yield mock
+    mock.close()
+
+
+def test_analyze(analyzer, mock_service, mock_agent):
+    boards = [[[2, 2, 0, 0]] + [[0]*4]*3, [[2, 0, 2], [0]*3, [0]*3]]
+    response = client.post("/api/analyze", json=boards)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["index"] for r in results] == [0, 1]
+    assert [r["search_depth"] for r in results] == [1, 1]
+    assert results[0]["metrics"]["max_tile"] == 2
+    assert results[1]["moves"][0]["direction"] in ("LEFT", "RIGHT")
+    mock_service.assert_not_called()
+    mock_agent.ainvoke.assert_not_called()
+
+
+@pytest.mark.parametrize("body, detail", [
+    ([[[0]*4]*4, [[3, 0], [0, 0]]], "Board 1: size must be 3 to 8"),
+    ([[[0]*4]*4, [[0]*4]*3], "Board 1: board must be square"),
+    ([[[5, 0, 0]] + [[0]*3]*2], "Board 0: 5 is not a tile"),
+])
+def test_analyze_invalid_board(analyzer, body, detail):
+    response = client.post("/api/analyze", json=body)
+    assert response.status_code == 422
+    assert response.json()["detail"] == detail
+
+
+@pytest.mark.parametrize("body", [[], [[["a"]]], "board"])
+def test_analyze_invalid_body(analyzer, body):
+    assert client.post("/api/analyze", json=body).status_code == 422
+
+
+def test_replay(mock_service):
+    expected_board = [[2]*4]*4
+    mock_service.replay.return_value = (expected_board, [])
+    response = client.get("/api/replay?game_id=g1&move=3")
+    assert response.status_code == 200
+    assert response.json()["board"] == expected_board
+    mock_service.replay.assert_called_once_with("g1", 3)
+
+
+@pytest.mark.parametrize(
+    "error, status_code",
+    [(GameNotFoundError("g1"), 404), (ReplayUnsupportedError(), 501)],
+)
+def test_replay_errors(mock_service, error, status_code):
+    mock_service.replay.side_effect = error
+    response = client.get("/api/replay?game_id=g1&move=3")
+    assert response.status_code == status_code
+
+
+def test_replay_negative_move():
+    response = client.get("/api/replay?game_id=g1&move=-1")
     assert response.status_code == 422
+
+
+def test_game_channel_moves(mock_service):
+    mock_service.state.return_value = ([[0]*4]*4, [Direction.UP])
+    mock_service.make_move.return_value = (
+        [[2]*4]*4, Status.WIN, [Direction.LEFT])
+
+    with client.websocket_connect("/api/ws?game_id=g1") as ws:
+        assert ws.receive_json() == {
+            "type": "GAME", "game_id": "g1", "board": [[0]*4]*4,
+            "status": None, "legal_moves": ["UP"]}
+        ws.send_json({"type": "MOVE", "direction": "LEFT"})
+        frame = ws.receive_json()
+    assert frame["type"] == "GAME"
+    assert frame["status"] == "WIN"
+    assert frame["legal_moves"] == ["LEFT"]
+    mock_service.make_move.assert_called_once_with("g1", Direction.LEFT)
+
+
+def test_game_channel_starts_unknown_game(mock_service):
+    mock_service.state.side_effect = GameNotFoundError("g1")
+    mock_service.restart_game.return_value = ([[0]*4]*4, [Direction.UP])
+
+    with client.websocket_connect("/api/ws?game_id=g1") as ws:
+        assert ws.receive_json()["board"] == [[0]*4]*4
+        ws.send_json({"type": "RESTART", "size": 5, "target": 4096})
+        ws.receive_json()
+    assert mock_service.restart_game.call_args_list[-1].args == (
+        "g1", 5, 4096)
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "MOVE"},
+    {"type": "JUMP"},
+    {"type": "RESTART", "target": 3000},
+    {"type": "RESTART", "target": 65536},
+])
+def test_game_channel_invalid_message(mock_service, message):
+    mock_service.state.return_value = ([[0]*4]*4, [Direction.UP])
+    mock_service.make_move.return_value = ([[0]*4]*4, None, [Direction.UP])
+
+    with client.websocket_connect("/api/ws?game_id=g1") as ws:
+        ws.receive_json()
+        ws.send_json(message)
+        assert ws.receive_json()["type"] == "ERROR"
+        # The channel stays open after a bad message.
+        ws.send_json({"type": "MOVE", "direction": "UP"})
+        assert ws.receive_json()["type"] == "GAME"
+
+
+def test_game_channel_conflict(mock_service):
+    mock_service.state.return_value = ([[0]*4]*4, [Direction.UP])
+    mock_service.make_move.side_effect = GameConflictError("g1")
+
+    with client.websocket_connect("/api/ws?game_id=g1") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "MOVE", "direction": "UP"})
+        assert ws.receive_json() == {
+            "type": "ERROR", "detail": "Game changed; retry"}
+
+
+def test_game_channel_pushes_suggestions(mock_service, mock_agent):
+    mock_service.state.return_value = ([[0]*4]*4, [Direction.UP])
+    mock_agent.ainvoke.return_value = AgentResponse(
+        recommended_moves=[
+            Move(direction=Direction.UP, reasoning="r", confidence=0.5)],
+        game_analysis="a")
+
+    with client.websocket_connect("/api/ws?game_id=g1") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "SUGGEST", "num_suggestions": 2})
+        frame = ws.receive_json()
+    assert frame["type"] == "SUGGESTION"
+    assert frame["recommended_moves"][0]["direction"] == "UP"
+    mock_agent.ainvoke.assert_awaited_once_with("g1", 2)
+
+
+def test_import_defers_llm_clients():
+    # A fresh interpreter, as on a cold start.
+    code = ("import sys, api; "
+            "print(any(m.split('.')[0] in ('groq', 'langchain_core') "
+            "for m in sys.modules), api.agent)")
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=Path(api.__file__).parent,
+        env={"STORE_BACKEND": "json", "STORE_PATH": "/nonexistent"},
+        capture_output=True, text=True)
+    assert result.stdout.split() == ["False", "None"]
+
+
+def test_get_agent_builds_once(monkeypatch):
+    monkeypatch.setattr(api, "agent", None)
+    with patch("api.GameAgent") as mock_agent_class:
+        first = api.get_agent()
+        assert api.get_agent() is first
+    mock_agent_class.assert_called_once_with(api.agent_config, api.store)
+    assert metrics.STARTUP_DURATION.value(phase="agent") >= 0
+
+
+def test_warm_up(monkeypatch):
+    mock = MagicMock()
+    monkeypatch.setattr(api, "agent", mock)
+    api.warm_up()
+    mock.warm_up.assert_called_once_with()
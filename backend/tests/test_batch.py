@@ -0,0 +1,117 @@
+import random
+import numpy as np
+import pytest
+
+import batch
+import logic
+from schemas import Direction
+
+
+LIST_MOVES = {
+    Direction.UP: logic.move_up,
+    Direction.DOWN: logic.move_down,
+    Direction.LEFT: logic.move_left,
+    Direction.RIGHT: logic.move_right,
+}
+
+
+@pytest.fixture
+def boards():
+    rng = random.Random(0)
+    return [
+        [[rng.choice([0, 0, 2, 4, 8, 16]) for _ in range(4)] for _ in range(4)]
+        for _ in range(200)
+    ]
+
+
+def test_round_trip(boards):
+    exponents = batch.from_boards(boards)
+    assert exponents.shape == (200, 4, 4)
+    assert exponents.dtype == np.uint8
+    assert batch.to_boards(exponents) == boards
+
+
+def test_init_boards():
+    boards = batch.init_boards(50, np.random.default_rng(0))
+    assert boards.shape == (50, 4, 4)
+    assert set(np.unique(boards)) <= {0, 1}
+
+
+@pytest.mark.parametrize("direction", list(Direction))
+def test_move_matches_logic(boards, direction):
+    moved, changed = batch.move(batch.from_boards(boards), direction)
+    expected = [LIST_MOVES[direction](board) for board in boards]
+    assert batch.to_boards(moved) == expected
+    assert changed.tolist() == [
+        after != before for after, before in zip(expected, boards)]
+
+
+def test_move_per_game_directions(boards):
+    directions = np.arange(len(boards)) % 4
+    moved, _ = batch.move(batch.from_boards(boards), directions)
+    assert batch.to_boards(moved) == [
+        LIST_MOVES[batch.DIRECTIONS[d]](board)
+        for d, board in zip(directions, boards)
+    ]
+
+
+def test_spawn_tiles_fills_one_empty_cell(boards):
+    before = batch.from_boards(boards)
+    after = batch.spawn_tiles(before, np.random.default_rng(0))
+    diff = after != before
+    assert (diff.sum(axis=(1, 2)) == 1).all()
+    assert (before[diff] == 0).all()
+    assert set(np.unique(after[diff])) <= {1, 2}
+
+
+def test_spawn_tiles_respects_mask_and_full_boards():
+    full = batch.from_boards([[[2, 4, 2, 4], [4, 2, 4, 2]] * 2])
+    empty = np.zeros((2, 4, 4), dtype=np.uint8)
+    boards = np.concatenate([full, empty])
+    mask = np.array([True, True, False])
+    after = batch.spawn_tiles(boards, np.random.default_rng(0), mask)
+    assert (after[0] == boards[0]).all()
+    assert (after[1] != 0).sum() == 1
+    assert (after[2] == 0).all()
+
+
+def test_spawn_tiles_is_reproducible(boards):
+    exponents = batch.from_boards(boards)
+    first = batch.spawn_tiles(exponents, np.random.default_rng(42))
+    second = batch.spawn_tiles(exponents, np.random.default_rng(42))
+    assert (first == second).all()
+
+
+def test_step_only_spawns_on_changed_games():
+    boards = batch.from_boards([
+        [[2, 0, 0, 0], [0]*4, [0]*4, [0]*4],
+        [[0, 0, 0, 2], [0]*4, [0]*4, [0]*4],
+    ])
+    after, changed = batch.step(
+        boards, Direction.RIGHT, np.random.default_rng(0))
+    assert changed.tolist() == [True, False]
+    assert (after[0] != 0).sum() == 2
+    assert (after[1] == boards[1]).all()
+
+
+def test_is_win_and_is_lose(boards):
+    exponents = batch.from_boards(boards + [
+        [[2048, 0, 0, 0], [0]*4, [0]*4, [0]*4],
+        [[2, 4, 2, 4], [4, 2, 4, 2], [2, 4, 2, 4], [4, 2, 4, 2]],
+    ])
+    assert batch.is_win(exponents).tolist() == [
+        logic.is_win(board) for board in batch.to_boards(exponents)]
+    assert batch.is_lose(exponents).tolist() == [
+        logic.is_lose(board) for board in batch.to_boards(exponents)]
+    assert batch.is_win(exponents)[-2]
+    assert batch.is_lose(exponents)[-1]
+
+
+def test_is_win_counts_tiles_past_the_target():
+    exponents = batch.from_boards([
+        [[4096, 0, 0, 0], [0]*4, [0]*4, [0]*4],
+        [[1024, 0, 0, 0], [0]*4, [0]*4, [0]*4],
+    ])
+    assert batch.is_win(exponents).tolist() == [True, False]
+    assert batch.is_win(exponents, 10).tolist() == [True, True]
+    assert batch.is_win(exponents, 13).tolist() == [False, False]
@@ -0,0 +1,67 @@
+import random
+import pytest
+import numpy as np
+
+import dataset
+import logic
+from schemas import Direction
+
+
+def test_move_reward():
+    bits = logic.to_bitboard([
+        [2, 2, 4, 4],
+        [8, 0, 8, 0],
+        [0, 0, 0, 0],
+        [2, 0, 0, 0]
+    ])
+    assert dataset.move_reward(bits, Direction.LEFT) == 4 + 8 + 16
+    assert dataset.move_reward(bits, Direction.RIGHT) == 4 + 8 + 16
+    assert dataset.move_reward(bits, Direction.UP) == 0
+    assert dataset.move_reward(bits, Direction.DOWN) == 0
+
+
+def test_play_game_records_legal_moves():
+    steps = dataset.play_game(dataset.random_policy, random.Random(1))
+    assert len(steps) > 0
+    for before, after in zip(steps[:-1], steps[1:]):
+        direction = dataset.DIRECTIONS[before["direction"]]
+        moved = logic.BIT_MOVES[direction](int(before["board"]))
+        assert moved != int(before["board"])
+        # The next board is the moved board plus one new 2 or 4.
+        spawned = int(after["board"]) - moved
+        shift = (spawned.bit_length() - 1) // 4 * 4
+        assert spawned in (1 << shift, 2 << shift)
+        assert not moved >> shift & 0xF
+    last = int(steps[-1]["board"])
+    final = logic.BIT_MOVES[dataset.DIRECTIONS[steps[-1]["direction"]]](last)
+    assert final != last
+
+
+def test_generate_and_read_back(tmp_path):
+    path = tmp_path / "games.bin"
+    total = dataset.generate(path, 5, dataset.greedy_policy, seed=3, chunk=2)
+
+    data = dataset.Dataset(path)
+    assert len(data) == 5
+    assert len(data.steps) == total
+    assert data.offsets[0] == 0 and data.offsets[-1] == total
+    assert sum(len(game) for game in data) == total
+    expected = dataset.play_game(dataset.greedy_policy, random.Random("3:2"))
+    assert np.array_equal(data.game(2), expected)
+    assert np.shares_memory(data.boards, data.steps)
+    assert isinstance(data.boards.base, np.ndarray)
+
+
+def test_generate_is_independent_of_workers(tmp_path):
+    dataset.generate(tmp_path / "a.bin", 6, dataset.random_policy, seed=7)
+    dataset.generate(tmp_path / "b.bin", 6, dataset.random_policy, seed=7,
+                     workers=2, chunk=2)
+    assert ((tmp_path / "a.bin").read_bytes()
+            == (tmp_path / "b.bin").read_bytes())
+
+
+def test_reader_rejects_other_files(tmp_path):
+    path = tmp_path / "store.json"
+    path.write_text('{"g1": [[0, 0, 0, 0]]}' * 2)
+    with pytest.raises(ValueError):
+        dataset.Dataset(path)
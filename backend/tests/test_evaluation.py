@@ -0,0 +1,97 @@
+import random
+import pytest
+
+import logic
+from evaluation import (
+    Evaluation, board_value, evaluate, evaluate_board, heuristic, rank_moves,
+    _line_features, _line_value, _points)
+from schemas import Direction
+
+
+def test_line_features():
+    # Exponents: 2 2 _ 3 -> one merge, ordered, steps 0 + 1.
+    assert _line_features([1, 1, 0, 2]) == (1, 1, 1, 1)
+    assert _line_features([3, 1, 2, 0]) == (1, 0, 0, 3)
+    assert _line_features([0, 0, 0, 0]) == (4, 0, 1, 0)
+
+
+def test_evaluate():
+    board = [
+        [1024, 512, 2, 2],
+        [4, 0, 2, 8],
+        [0, 0, 0, 0],
+        [0, 0, 0, 2],
+    ]
+    bits = logic.to_bitboard(board)
+    assert evaluate(bits) == Evaluation(
+        empty=8, merges=2, monotonic_lines=6, lines=8, roughness=24,
+        max_tile=1024, max_in_corner=True,
+        value=pytest.approx(heuristic(bits)))
+
+
+def test_max_tile_away_from_corner():
+    board = [[2, 0, 0, 0], [0, 8, 0, 0], [0]*4, [0]*4]
+    evaluation = evaluate(logic.to_bitboard(board))
+    assert evaluation.max_tile == 8
+    assert evaluation.max_in_corner is False
+
+
+def test_table_lookups_match_direct_evaluation():
+    rng = random.Random(0)
+    for _ in range(200):
+        board = [[rng.choice([0, 2, 4, 8, 16, 2048]) for _ in range(4)]
+                 for _ in range(4)]
+        # A 5x5 board padded with empty cells exercises the list path.
+        padded = [row + [0] for row in board] + [[0]*5]
+        direct = evaluate_board(padded)
+        lookup = evaluate(logic.to_bitboard(board))
+        assert lookup.merges == direct.merges
+        assert lookup.roughness == direct.roughness
+        assert lookup.max_tile == direct.max_tile
+        assert lookup.empty == direct.empty - 9
+
+
+def test_search_and_ranking_share_one_value():
+    rng = random.Random(0)
+    for _ in range(200):
+        board = [[rng.choice([0, 2, 4, 8, 16, 2048]) for _ in range(4)]
+                 for _ in range(4)]
+        exponents = [[v.bit_length() - 1 if v else 0 for v in row]
+                     for row in board]
+        lines = exponents + [list(column) for column in zip(*exponents)]
+        bits = logic.to_bitboard(board)
+        assert heuristic(bits) == pytest.approx(
+            board_value(evaluate_board(board)))
+        assert heuristic(bits) == pytest.approx(
+            sum(_line_value(line) for line in lines))
+
+
+@pytest.mark.parametrize("size", [3, 6])
+def test_evaluate_other_sizes(size):
+    board = [[0]*size for _ in range(size)]
+    board[0][0] = 65536
+    evaluation = evaluate_board(board)
+    assert evaluation.empty == size * size - 1
+    assert evaluation.lines == 2 * size
+    assert evaluation.max_tile == 65536
+    assert evaluation.max_in_corner is True
+
+
+def test_rank_moves():
+    # Both merge the 2s, but only sliding right keeps the 8 in a corner.
+    board = [[2, 2, 4, 8], [0]*4, [0]*4, [0]*4]
+    ranked = rank_moves(board)
+    assert [d for d, _ in ranked][0] == Direction.RIGHT
+    assert {d for d, _ in ranked} == logic.legal_moves(board)
+    assert [v for _, v in ranked] == sorted(
+        (v for _, v in ranked), reverse=True)
+
+
+def test_rank_moves_other_sizes():
+    assert rank_moves([[2, 0, 2], [0]*3, [0]*3])[0][0] in (
+        Direction.LEFT, Direction.RIGHT)
+    assert rank_moves([[2, 4, 2], [4, 2, 4], [2, 4, 2]]) == []
+
+
+def test_points():
+    assert _points([[2, 4, 8], [0, 16, 0], [0]*3]) == 0 + 4 + 16 + 48
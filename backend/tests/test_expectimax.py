@@ -0,0 +1,90 @@
+import threading
+
+import logic
+from expectimax import ExpectimaxSearch, heuristic
+from schemas import Direction
+
+
+def test_rank_returns_only_legal_moves():
+    board = [
+        [2, 4, 2, 4],
+        [4, 2, 4, 2],
+        [2, 4, 2, 4],
+        [4, 2, 4, 0]
+    ]
+    ranked, depth = ExpectimaxSearch(2, 1000).rank(logic.to_bitboard(board))
+    assert {direction for direction, _ in ranked} == {
+        Direction.DOWN, Direction.RIGHT}
+    assert depth == 2
+
+
+def test_rank_orders_best_first():
+    board = [
+        [0, 0, 0, 0],
+        [0, 0, 0, 0],
+        [0, 0, 0, 0],
+        [1024, 1024, 0, 0]
+    ]
+    ranked, _ = ExpectimaxSearch(1, 1000).rank(logic.to_bitboard(board))
+    values = [value for _, value in ranked]
+    assert values == sorted(values, reverse=True)
+    assert ranked[0][0] in (Direction.LEFT, Direction.RIGHT)
+
+
+def test_rank_no_legal_moves():
+    board = [
+        [2, 4, 2, 4],
+        [4, 2, 4, 2],
+        [2, 4, 2, 4],
+        [4, 2, 4, 2]
+    ]
+    assert ExpectimaxSearch(3, 1000).rank(logic.to_bitboard(board)) == ([], 0)
+
+
+def test_rank_completes_first_depth_past_budget(monkeypatch):
+    clock = iter(range(0, 1000000, 10))
+    monkeypatch.setattr("expectimax.time.perf_counter", lambda: next(clock))
+    board = [[2, 0, 0, 0], [0]*4, [0]*4, [0, 0, 0, 2]]
+    ranked, depth = ExpectimaxSearch(4, 1).rank(logic.to_bitboard(board))
+    assert depth == 1
+    assert len(ranked) == 4
+
+
+def test_rank_keeps_its_deadline_when_another_rank_starts(monkeypatch):
+    search = ExpectimaxSearch(10, 50)
+    board = logic.to_bitboard([[2, 0, 0, 0], [0]*4, [0]*4, [0, 0, 0, 2]])
+    clock = [0.0]
+    other = threading.Thread(target=search.rank, args=(board,))
+    other_started = threading.Event()
+    release = threading.Event()
+
+    def leaf(bits):
+        if threading.current_thread() is other:
+            # The other rank waits inside its first depth.
+            other_started.set()
+            release.wait(5)
+        elif other.ident is None and clock[0] >= 0.01:
+            other.start()
+            other_started.wait(5)
+        elif clock[0] >= 0.2:
+            release.set()
+        # Each leaf takes a millisecond.
+        clock[0] += 0.001
+        return 0.0
+
+    monkeypatch.setattr("expectimax.time.perf_counter", lambda: clock[0])
+    monkeypatch.setattr("expectimax.heuristic", leaf)
+    try:
+        _, depth = search.rank(board)
+        elapsed = clock[0]
+    finally:
+        release.set()
+        other.join()
+    assert depth >= 1
+    assert elapsed < 0.06
+
+
+def test_heuristic_prefers_empty_board():
+    sparse = logic.to_bitboard([[2, 0, 0, 0], [0]*4, [0]*4, [0]*4])
+    crowded = logic.to_bitboard([[2, 4, 2, 4], [4, 2, 4, 2], [0]*4, [0]*4])
+    assert heuristic(sparse) > heuristic(crowded)
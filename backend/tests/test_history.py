@@ -0,0 +1,61 @@
+import pytest
+
+from history import GameHistory, HistoryError
+from schemas import Direction
+
+
+def _board(n):
+    return [[2 ** (n % 15 + 1), 0, 0, 0], [0]*4, [0]*4, [0, 0, 0, 2]]
+
+
+def test_undo_and_redo():
+    history = GameHistory(_board(0), 0, capacity=8)
+    history.push(_board(1), Direction.UP)
+    history.push(_board(2), Direction.LEFT)
+    assert history.move == 2
+    assert history.peek_undo() == (_board(1), 1)
+    history.undo()
+    history.undo()
+    assert history.move == 0
+    assert history.matches(_board(0), 0)
+    with pytest.raises(HistoryError):
+        history.undo()
+    assert history.peek_redo() == (_board(1), Direction.UP)
+    history.redo()
+    assert history.peek_redo() == (_board(2), Direction.LEFT)
+    history.redo()
+    with pytest.raises(HistoryError):
+        history.redo()
+
+
+def test_push_drops_redo():
+    history = GameHistory(_board(0), 0, capacity=8)
+    history.push(_board(1), Direction.UP)
+    history.undo()
+    history.push(_board(2), Direction.DOWN)
+    with pytest.raises(HistoryError):
+        history.peek_redo()
+    assert history.peek_undo() == (_board(0), 0)
+
+
+def test_ring_keeps_last_positions():
+    history = GameHistory(_board(0), 10, capacity=4)
+    for n in range(1, 7):
+        history.push(_board(n), Direction.RIGHT)
+    assert history.move == 16
+    assert len(history._data) == 4 * 9
+    for n in (5, 4, 3):
+        assert history.peek_undo() == (_board(n), 10 + n)
+        history.undo()
+    with pytest.raises(HistoryError):
+        history.undo()
+    assert history.matches(_board(3), 13)
+
+
+def test_other_sizes():
+    board = [[2, 0, 0, 0, 4]] + [[0]*5]*3 + [[0, 0, 65536, 0, 0]]
+    history = GameHistory(board, 0, capacity=2)
+    history.push([[0]*5]*5, Direction.UP)
+    assert history.peek_undo() == (board, 0)
+    assert not history.matches(board, 1)
+    assert not history.matches(_board(0), 1)
@@ -1,6 +1,9 @@
+import random
 from unittest.mock import patch, call
+import pytest
 
 import logic
+from schemas import Direction
 
 
 def test_init_board():
@@ -111,11 +114,45 @@ def test_spawn_tile():
         ]
 
 
+def test_seeded_games_are_reproducible():
+    def play(seed):
+        board = logic.init_board(logic.game_rng(seed, 0))
+        for move in range(1, 4):
+            board = logic.spawn_tile(logic.move_left(board),
+                                     logic.game_rng(seed, move))
+        return board
+
+    assert play(7) == play(7)
+    assert any(play(7) != play(seed) for seed in range(8, 12))
+
+
+def test_bitboard_spawns_match_list_spawns():
+    for seed in range(20):
+        board = logic.init_board(logic.game_rng(seed, 0))
+        bits = logic.init_bits(logic.game_rng(seed, 0))
+        assert bits == logic.to_bitboard(board)
+        for move in range(1, 6):
+            if not logic.empty_cells_bits(bits):
+                break
+            board = logic.spawn_tile(board, logic.game_rng(seed, move))
+            bits = logic.spawn_bits(bits, logic.game_rng(seed, move))
+            assert bits == logic.to_bitboard(board)
+
+
+def test_empty_cells_bits():
+    bits = logic.to_bitboard([[2, 0, 0, 4]] + [[8]*4]*2 + [[0, 8, 8, 8]])
+    assert logic.empty_cells_bits(bits) == [56, 52, 12]
+
+
 def test_is_win():
     board_win = [[2048, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
     assert logic.is_win(board_win) is True
     board_no_win = [[1024, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
     assert logic.is_win(board_no_win) is False
+    assert logic.is_win(board_no_win, target=1024) is True
+    assert logic.is_win_bits(logic.to_bitboard(board_win)) is True
+    assert logic.is_win_bits(logic.to_bitboard(board_no_win)) is False
+    assert logic.is_win_bits(logic.to_bitboard(board_no_win), 10) is True
 
 
 def test_is_lose():
@@ -154,3 +191,129 @@ def test_is_lose():
         [4, 2, 4, 0]
     ]
     assert logic.is_lose(board_empty) is False
+
+
+def test_bitboard_round_trip():
+    board = [
+        [2, 4, 0, 0],
+        [0, 0, 0, 0],
+        [0, 0, 0, 0],
+        [8, 0, 0, 2048]
+    ]
+    bits = logic.to_bitboard(board)
+    assert bits == 0x120000000000300B
+    assert logic.from_bitboard(bits) == board
+
+
+@pytest.mark.parametrize("value", [3, 1, -2, 65536])
+def test_to_bitboard_invalid_tile(value):
+    with pytest.raises(ValueError):
+        logic.to_bitboard([[value, 0, 0, 0]] + [[0]*4]*3)
+
+
+@pytest.mark.parametrize(
+    "list_move, bits_move",
+    [
+        (logic.move_left, logic.move_left_bits),
+        (logic.move_right, logic.move_right_bits),
+        (logic.move_up, logic.move_up_bits),
+        (logic.move_down, logic.move_down_bits),
+    ],
+)
+def test_bitboard_moves_match_list_moves(list_move, bits_move):
+    rng = random.Random(0)
+    for _ in range(200):
+        board = [[rng.choice([0, 0, 2, 4, 8, 16]) for _ in range(4)]
+                 for _ in range(4)]
+        bits = logic.to_bitboard(board)
+        assert logic.from_bitboard(bits_move(bits)) == list_move(board)
+
+
+def test_is_lose_bits():
+    board_lose = [
+        [2, 4, 2, 4],
+        [4, 2, 4, 2],
+        [2, 4, 2, 4],
+        [4, 2, 4, 2]
+    ]
+    assert logic.is_lose_bits(logic.to_bitboard(board_lose)) is True
+    board_v = [
+        [2, 4, 2, 4],
+        [2, 8, 16, 32],
+        [2, 4, 8, 16],
+        [4, 8, 16, 32]
+    ]
+    assert logic.is_lose_bits(logic.to_bitboard(board_v)) is False
+
+
+def test_legal_moves():
+    board = [
+        [2, 4, 2, 4],
+        [4, 2, 4, 2],
+        [2, 4, 2, 4],
+        [4, 2, 4, 0]
+    ]
+    assert logic.legal_moves(board) == {Direction.DOWN, Direction.RIGHT}
+    assert logic.legal_moves_bits(logic.to_bitboard(board)) == {
+        Direction.DOWN, Direction.RIGHT}
+
+
+def test_legal_moves_bits_match_moves():
+    rng = random.Random(0)
+    for _ in range(500):
+        board = [[rng.choice([0, 2, 2, 4, 8, 16]) for _ in range(4)]
+                 for _ in range(4)]
+        bits = logic.to_bitboard(board)
+        expected = {d for d, fn in logic.BIT_MOVES.items() if fn(bits) != bits}
+        assert logic.legal_moves_bits(bits) == expected
+        assert logic.legal_moves(board) == expected
+
+
+def test_legal_moves_bits_never_merge_32768():
+    board = [[32768, 32768, 2, 4], [4, 2, 4, 2], [2, 4, 2, 4], [4, 2, 4, 2]]
+    bits = logic.to_bitboard(board)
+    assert logic.move_left_bits(bits) == bits
+    assert logic.legal_moves_bits(bits) == set()
+    assert logic.is_lose_bits(bits)
+
+
+def _reference_move(board, direction):
+    # Rotate so the move is a left move, compress, rotate back.
+    turns = {Direction.LEFT: 0, Direction.DOWN: 1, Direction.RIGHT: 2,
+             Direction.UP: 3}[direction]
+    rotate = lambda b: [list(row) for row in zip(*b[::-1])]
+    for _ in range(turns):
+        board = rotate(board)
+    board = [logic._compress_line_left(row) for row in board]
+    for _ in range(-turns % 4):
+        board = rotate(board)
+    return board
+
+
+@pytest.mark.parametrize("size", range(3, 9))
+def test_moves_on_any_size_match_reference(size):
+    rng = random.Random(size)
+    for _ in range(50):
+        board = [[rng.choice([0, 0, 2, 2, 4, 8]) for _ in range(size)]
+                 for _ in range(size)]
+        for direction, move in logic.MOVES.items():
+            assert move(board) == _reference_move(board, direction)
+            assert logic.slide(board, direction) == move(board)
+        assert logic.legal_moves(board) == {
+            d for d, move in logic.MOVES.items() if move(board) != board}
+
+
+def test_line_table_is_capped(monkeypatch):
+    monkeypatch.setattr(logic, "_LINE_TABLE_LIMIT", 1)
+    logic._line_table.cache_clear()
+    try:
+        assert logic._move_line_left([2, 2, 0, 0, 4]) == (4, 4, 0, 0, 0)
+        assert logic._move_line_left([0, 2, 0, 0, 2]) == (4, 0, 0, 0, 0)
+        assert len(logic._line_table(5)) == 1
+    finally:
+        logic._line_table.cache_clear()
+
+
+def test_init_board_size():
+    board = logic.init_board(random.Random(0), size=6)
+    assert len(board) == 6 and all(len(row) == 6 for row in board)
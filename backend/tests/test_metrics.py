@@ -0,0 +1,89 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_counter_render(registry):
+    counter = registry.counter("things_total", "Things.", ("kind",))
+    counter.inc(kind="a")
+    counter.inc(2, kind="a")
+    counter.inc(kind="b")
+    assert counter.value(kind="a") == 3
+    assert registry.render() == (
+        "# HELP things_total Things.\n"
+        "# TYPE things_total counter\n"
+        'things_total{kind="a"} 3\n'
+        'things_total{kind="b"} 1\n'
+    )
+
+
+def test_counter_without_labels(registry):
+    counter = registry.counter("events_total", "Events.")
+    counter.inc()
+    assert registry.render().endswith("events_total 1\n")
+
+
+def test_gauge_keeps_last_value(registry):
+    gauge = registry.gauge("phase_seconds", "Phases.", ("phase",))
+    gauge.set(0.5, phase="a")
+    gauge.set(0.25, phase="a")
+    assert gauge.value(phase="a") == 0.25
+    assert registry.render() == (
+        "# HELP phase_seconds Phases.\n"
+        "# TYPE phase_seconds gauge\n"
+        'phase_seconds{phase="a"} 0.25\n')
+
+
+def test_collector_reads_values_at_render(registry):
+    stats = {"hits": 1}
+    collector = registry.collector(
+        "cache_total", "Cache.", "counter", ("event",))
+    assert registry.render() == (
+        "# HELP cache_total Cache.\n# TYPE cache_total counter\n")
+    collector.collect_from(
+        lambda: {(name,): value for name, value in stats.items()})
+    stats.update(hits=3, misses=2)
+    assert registry.render().splitlines()[2:] == [
+        'cache_total{event="hits"} 3', 'cache_total{event="misses"} 2']
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram(
+        "latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="move")
+    histogram.observe(0.1, route="move")
+    histogram.observe(0.5, route="move")
+    histogram.observe(3.0, route="move")
+    assert histogram.count(route="move") == 4
+    assert histogram.count(route="suggest") == 0
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_seconds_bucket{route="move",le="0.1"} 2',
+        'latency_seconds_bucket{route="move",le="1.0"} 3',
+        'latency_seconds_bucket{route="move",le="+Inf"} 4',
+        'latency_seconds_sum{route="move"} 3.65',
+        'latency_seconds_count{route="move"} 4',
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    counter = registry.counter("odd_total", "Odd.", ("name",))
+    counter.inc(name='a"b\\c')
+    assert 'odd_total{name="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_timed_records_even_on_error(registry):
+    histogram = registry.histogram("op_seconds", "Op.", ("operation",))
+
+    @metrics.timed(histogram, operation="load")
+    def fail():
+        raise KeyError("missing")
+
+    with pytest.raises(KeyError):
+        fail()
+    assert histogram.count(operation="load") == 1
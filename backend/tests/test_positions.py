@@ -0,0 +1,88 @@
+import math
+import pytest
+
+import logic
+from positions import (
+    DIRECTIONS, PositionTable, common_positions, solve, write_table)
+from schemas import Direction
+from symmetry import canonicalize, flip_horizontal_bits
+
+
+BOARD = logic.to_bitboard([
+    [2, 4, 2, 4],
+    [4, 2, 4, 2],
+    [2, 4, 2, 4],
+    [4, 2, 4, 0],
+])
+
+
+@pytest.fixture
+def table(tmp_path):
+    solved, depth = solve(
+        [canonicalize(BOARD)[0]], depth=2, time_budget_ms=1000)
+    write_table(tmp_path / "positions.bin", solved, depth)
+    table = PositionTable(tmp_path / "positions.bin")
+    yield table
+    table.close()
+
+
+def test_lookup_solved_board(table):
+    ranked = table.lookup(BOARD)
+    assert {d for d, _ in ranked} == {Direction.DOWN, Direction.RIGHT}
+    assert ranked[0][1] >= ranked[1][1]
+    assert len(table) == 1
+    assert table.depth == 2
+
+
+def test_lookup_maps_directions_back(table):
+    ranked = table.lookup(flip_horizontal_bits(BOARD))
+    assert {d for d, _ in ranked} == {Direction.DOWN, Direction.LEFT}
+
+
+def test_lookup_miss(table):
+    assert table.lookup(logic.to_bitboard([[2, 0, 0, 0]] + [[0]*4]*3)) is None
+    assert table.stats() == {"hits": 0, "misses": 1, "entries": 1}
+
+
+def test_lookup_searches_sorted_boards(tmp_path):
+    solved = {board: [float(board), math.nan, 0.0, 1.0]
+              for board in range(1, 2000, 7)}
+    write_table(tmp_path / "positions.bin", solved, depth=1)
+    table = PositionTable(tmp_path / "positions.bin")
+    for board in (1, 8, 1996):
+        assert table._find(board) is not None
+    for board in (0, 2, 2000):
+        assert table._find(board) is None
+    table.close()
+
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / "positions.bin"
+    path.write_bytes(b"not a table at all, no")
+    with pytest.raises(ValueError):
+        PositionTable(path)
+
+
+def test_common_positions_merges_symmetric_boards():
+    mirrored = flip_horizontal_bits(BOARD)
+    other = logic.to_bitboard([[2, 0, 0, 0]] + [[0]*4]*3)
+    assert common_positions([other, BOARD, mirrored], 1) == [
+        canonicalize(BOARD)[0]]
+
+
+def test_solve_skips_lost_boards():
+    lost = logic.to_bitboard([[2, 4, 2, 4], [4, 2, 4, 2]] * 2)
+    solved, _ = solve([lost, canonicalize(BOARD)[0]], 1, 1000)
+    assert list(solved) == [canonicalize(BOARD)[0]]
+    values = solved[canonicalize(BOARD)[0]]
+    assert len(values) == len(DIRECTIONS)
+    assert sum(not math.isnan(v) for v in values) == 2
+
+
+def test_solve_reports_depth_reached(monkeypatch):
+    clock = iter(range(0, 1000000, 10))
+    monkeypatch.setattr("expectimax.time.perf_counter", lambda: next(clock))
+    # Every search runs out of time after its first depth.
+    solved, depth = solve([canonicalize(BOARD)[0]], 4, 1)
+    assert len(solved) == 1
+    assert depth == 1
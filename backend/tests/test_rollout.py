@@ -0,0 +1,95 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import logic
+import rollout
+from rollout import RolloutEvaluator, MoveStats
+from schemas import Direction, RolloutPolicy
+
+
+@pytest.fixture
+def evaluator():
+    evaluator = RolloutEvaluator(8, RolloutPolicy.RANDOM, 5000, workers=2)
+    yield evaluator
+    evaluator.close()
+
+
+def test_score_counts_merges():
+    # An 8 built from 2s took merges worth 4 + 4 + 8; a 4 took one worth 4.
+    bits = logic.to_bitboard([[8, 4, 0, 0], [0]*4, [0]*4, [0]*4])
+    assert rollout._score(bits, fours=0) == 16 + 4
+    assert rollout._score(bits, fours=1) == 16
+
+
+def test_playout_ends_on_lost_board():
+    bits = logic.to_bitboard([[2, 4, 2, 4], [4, 2, 4, 2],
+                              [2, 4, 2, 4], [4, 2, 4, 0]])
+    score, moves = rollout._playout(bits, RolloutPolicy.GREEDY,
+                                    random.Random(0))
+    assert moves >= 1
+    assert score >= 0
+
+
+def test_run_playouts_is_reproducible():
+    children = [logic.to_bitboard([[2, 0, 0, 0], [0]*4, [0]*4, [0]*4])]
+    first = rollout.run_playouts(children, RolloutPolicy.RANDOM, 3, 7, 1e18)
+    second = rollout.run_playouts(children, RolloutPolicy.RANDOM, 3, 7, 1e18)
+    assert first == second
+    assert len(first[0]) == 3
+
+
+def test_run_playouts_stops_at_deadline():
+    children = [logic.to_bitboard([[2, 0, 0, 0], [0]*4, [0]*4, [0]*4])] * 2
+    results = rollout.run_playouts(children, RolloutPolicy.RANDOM, 50, 7, 0)
+    assert [len(r) for r in results] == [1, 1]
+
+
+def test_rank(evaluator):
+    bits = logic.to_bitboard([[2, 4, 2, 4], [4, 2, 4, 2],
+                              [2, 4, 2, 4], [4, 2, 4, 0]])
+    ranked = evaluator.rank(bits)
+    assert {s.direction for s in ranked} == {Direction.DOWN, Direction.RIGHT}
+    assert all(s.playouts == 8 for s in ranked)
+    assert ranked[0].mean_score >= ranked[1].mean_score
+    assert all(0 <= s.confidence <= 1 for s in ranked)
+
+
+def test_rank_no_legal_moves(evaluator):
+    bits = logic.to_bitboard([[2, 4, 2, 4], [4, 2, 4, 2],
+                              [2, 4, 2, 4], [4, 2, 4, 2]])
+    assert evaluator.rank(bits) == []
+
+
+def test_rank_builds_one_pool_across_threads(monkeypatch):
+    pools = []
+
+    def slow_pool(max_workers):
+        # Widen the window in which another thread could build its own.
+        time.sleep(0.05)
+        pools.append(ThreadPoolExecutor(max_workers))
+        return pools[-1]
+
+    monkeypatch.setattr("rollout.ProcessPoolExecutor", slow_pool)
+    evaluator = RolloutEvaluator(4, RolloutPolicy.RANDOM, 5000, workers=2)
+    bits = logic.to_bitboard([[2, 0, 0, 0], [0]*4, [0]*4, [0, 0, 0, 2]])
+    threads = [threading.Thread(target=evaluator.rank, args=(bits,))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    evaluator.close()
+    assert len(pools) == 1
+
+
+def test_probability_greater():
+    a = MoveStats(Direction.UP, 10, 100.0, 10.0, 5.0)
+    b = MoveStats(Direction.DOWN, 10, 100.0, 10.0, 5.0)
+    assert rollout._probability_greater(a, b) == pytest.approx(0.5)
+    b.mean_score = 0.0
+    assert rollout._probability_greater(a, b) > 0.99
+    assert rollout._probability_greater(b, a) < 0.01
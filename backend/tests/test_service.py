@@ -1,18 +1,21 @@
 from unittest.mock import MagicMock, patch
 import pytest
 
+import logic
 from schemas import Direction, Status
+from history import HistoryError
 from service import Service
+from store import GameConflictError, GameHead
 
 
 @pytest.fixture
-def mock_store():
+def mock_games():
     return MagicMock()
 
 
 @pytest.fixture
-def service(mock_store):
-    return Service(mock_store)
+def service(mock_games):
+    return Service(mock_games)
 
 
 @pytest.fixture
@@ -21,74 +24,259 @@ def mock_logic():
         yield mock
 
 
-def test_restart_game(service, mock_store, mock_logic):
+def test_restart_game(service, mock_games, mock_logic):
     expected_board = [[0]*4]*4
     mock_logic.init_board.return_value = expected_board
-    board = service.restart_game()
+    mock_logic.legal_moves.return_value = {Direction.LEFT, Direction.UP}
+    board, legal = service.restart_game("g1")
     assert board == expected_board
-    mock_logic.init_board.assert_called_once()
-    mock_store.save.assert_called_once_with(expected_board)
+    assert legal == [Direction.UP, Direction.LEFT]
+    seed = mock_logic.game_rng.call_args.args[0]
+    mock_logic.game_rng.assert_called_once_with(seed, 0)
+    mock_logic.init_board.assert_called_once_with(
+        mock_logic.game_rng.return_value, 4)
+    mock_logic.legal_moves.assert_called_once_with(expected_board)
+    mock_games.create.assert_called_once_with(
+        "g1", seed, expected_board, 2048)
 
 
-def test_make_move_noop(service, mock_store, mock_logic):
+def test_restart_game_custom_size(service, mock_games, mock_logic):
+    mock_logic.legal_moves.return_value = set()
+    service.restart_game("g1", 6, 4096)
+    mock_logic.init_board.assert_called_once_with(
+        mock_logic.game_rng.return_value, 6)
+    assert mock_games.create.call_args.args[3] == 4096
+
+
+def test_make_move_larger_board_uses_list_engine(service, mock_games):
+    board = [[2, 2, 0, 0, 0]] + [[0]*5 for _ in range(4)]
+    mock_games.head.return_value = GameHead(0, 5, 3, board, target=4)
+
+    moved, status, legal = service.make_move("g1", Direction.LEFT)
+    assert moved[0][0] == 4
+    assert status == Status.WIN
+    assert sum(v != 0 for row in moved for v in row) == 2
+    mock_games.append.assert_not_called()
+
+
+def test_make_move_retries_a_conflict_once(service, mock_games):
+    board = [[2, 2, 0, 0]] + [[0]*4 for _ in range(3)]
+    stale = GameHead(0, 5, 3, board)
+    current = GameHead(0, 5, 4, board)
+    mock_games.head.side_effect = [stale, current]
+    mock_games.append.side_effect = [GameConflictError("g1"), current]
+
+    _, status, _ = service.make_move("g1", Direction.LEFT)
+    assert status is None
+    assert mock_games.append.call_args.args[1] is current
+
+
+def test_make_move_lost_race_conflicts(service, mock_games):
+    board = [[2, 2, 0, 0]] + [[0]*4 for _ in range(3)]
+    mock_games.head.return_value = GameHead(0, 5, 3, board)
+    mock_games.append.side_effect = GameConflictError("g1")
+
+    with pytest.raises(GameConflictError):
+        service.make_move("g1", Direction.LEFT)
+    assert mock_games.append.call_count == 2
+
+
+def test_make_move_noop(service, mock_games, mock_logic):
     initial_board = [[0]*4]*4
-    mock_store.load.return_value = initial_board
-    mock_logic.move_up.return_value = initial_board
-    board, status = service.make_move(Direction.UP)
+    head = GameHead(0, 5, 3, initial_board)
+    mock_games.head.return_value = head
+    mock_logic.to_bitboard.return_value = 0
+    mock_logic.legal_moves_bits.return_value = {Direction.DOWN}
+    board, status, legal = service.make_move("g1", Direction.UP)
     assert board == initial_board
     assert status == Status.NOOP
-    mock_logic.move_up.assert_called_once_with(initial_board)
-    mock_store.save.assert_not_called()
+    assert legal == [Direction.DOWN]
+    mock_logic.to_bitboard.assert_called_once_with(initial_board)
+    mock_logic.legal_moves_bits.assert_called_once_with(0)
+    mock_logic.BIT_MOVES.__getitem__.assert_not_called()
+    mock_games.append.assert_not_called()
 
 
-def test_make_move_success(service, mock_store, mock_logic):
+def test_make_move_success(service, mock_games, mock_logic):
     initial_board = [[0]*4]*4
     intermediate_board = [[4]*4]*4
     expected_board = [[2]*4]*4
-    mock_store.load.return_value = initial_board
-    mock_logic.move_down.return_value = intermediate_board
+    head = GameHead(0, 5, 3, initial_board)
+    mock_games.head.return_value = head
+    mock_logic.to_bitboard.side_effect = [1, 3]
+    mock_logic.legal_moves_bits.side_effect = [
+        {Direction.DOWN}, {Direction.UP, Direction.RIGHT}]
+    move = mock_logic.BIT_MOVES.__getitem__.return_value
+    move.return_value = 2
+    mock_logic.from_bitboard.return_value = intermediate_board
     mock_logic.spawn_tile.return_value = expected_board
     mock_logic.is_win.return_value = False
-    mock_logic.is_lose.return_value = False
 
-    board, status = service.make_move(Direction.DOWN)
+    board, status, legal = service.make_move("g1", Direction.DOWN)
     assert board == expected_board
     assert status is None
-    mock_logic.move_down.assert_called_once_with(initial_board)
-    mock_logic.spawn_tile.assert_called_once_with(intermediate_board)
-    mock_store.save.assert_called_once_with(expected_board)
+    assert legal == [Direction.UP, Direction.RIGHT]
+    mock_logic.BIT_MOVES.__getitem__.assert_called_once_with(
+        Direction.DOWN)
+    move.assert_called_once_with(1)
+    mock_logic.from_bitboard.assert_called_once_with(2)
+    mock_logic.spawn_tile.assert_called_once_with(
+        intermediate_board, mock_logic.game_rng.return_value)
+    mock_logic.game_rng.assert_called_once_with(5, 4)
+    mock_logic.legal_moves_bits.assert_called_with(3)
+    mock_games.append.assert_called_once_with(
+        "g1", head, [Direction.DOWN], expected_board)
 
 
-def test_make_move_win(service, mock_store, mock_logic):
+def test_make_move_win(service, mock_games, mock_logic):
     initial_board = [[0]*4]*4
     intermediate_board = [[4]*4]*4
     expected_board = [[2]*4]*4
-    mock_store.load.return_value = initial_board
-    mock_logic.move_left.return_value = intermediate_board
+    head = GameHead(0, 5, 3, initial_board)
+    mock_games.head.return_value = head
+    mock_logic.to_bitboard.side_effect = [1, 3]
+    mock_logic.legal_moves_bits.side_effect = [
+        {Direction.LEFT}, {Direction.UP}]
+    move = mock_logic.BIT_MOVES.__getitem__.return_value
+    move.return_value = 2
+    mock_logic.from_bitboard.return_value = intermediate_board
     mock_logic.spawn_tile.return_value = expected_board
     mock_logic.is_win.return_value = True
 
-    board, status = service.make_move(Direction.LEFT)
+    board, status, legal = service.make_move("g1", Direction.LEFT)
     assert board == expected_board
     assert status == Status.WIN
-    mock_logic.move_left.assert_called_once_with(initial_board)
-    mock_logic.spawn_tile.assert_called_once_with(intermediate_board)
-    mock_store.save.assert_not_called()
+    assert legal == [Direction.UP]
+    mock_logic.BIT_MOVES.__getitem__.assert_called_once_with(
+        Direction.LEFT)
+    move.assert_called_once_with(1)
+    mock_logic.from_bitboard.assert_called_once_with(2)
+    mock_logic.spawn_tile.assert_called_once_with(
+        intermediate_board, mock_logic.game_rng.return_value)
+    mock_logic.game_rng.assert_called_once_with(5, 4)
+    mock_games.append.assert_not_called()
 
 
-def test_make_move_lose(service, mock_store, mock_logic):
+def test_make_move_lose(service, mock_games, mock_logic):
     initial_board = [[0]*4]*4
     intermediate_board = [[4]*4]*4
     expected_board = [[2]*4]*4
-    mock_store.load.return_value = initial_board
-    mock_logic.move_right.return_value = intermediate_board
+    head = GameHead(0, 5, 3, initial_board)
+    mock_games.head.return_value = head
+    mock_logic.to_bitboard.side_effect = [1, 3]
+    mock_logic.legal_moves_bits.side_effect = [{Direction.RIGHT}, set()]
+    move = mock_logic.BIT_MOVES.__getitem__.return_value
+    move.return_value = 2
+    mock_logic.from_bitboard.return_value = intermediate_board
     mock_logic.spawn_tile.return_value = expected_board
     mock_logic.is_win.return_value = False
-    mock_logic.is_lose.return_value = True
 
-    board, status = service.make_move(Direction.RIGHT)
+    board, status, legal = service.make_move("g1", Direction.RIGHT)
     assert board == expected_board
     assert status == Status.LOSE
-    mock_logic.move_right.assert_called_once_with(initial_board)
-    mock_logic.spawn_tile.assert_called_once_with(intermediate_board)
-    mock_store.save.assert_not_called()
+    assert legal == []
+    mock_logic.BIT_MOVES.__getitem__.assert_called_once_with(
+        Direction.RIGHT)
+    move.assert_called_once_with(1)
+    mock_logic.from_bitboard.assert_called_once_with(2)
+    mock_logic.spawn_tile.assert_called_once_with(
+        intermediate_board, mock_logic.game_rng.return_value)
+    mock_logic.game_rng.assert_called_once_with(5, 4)
+    mock_logic.legal_moves_bits.assert_called_with(3)
+    mock_games.append.assert_not_called()
+
+
+@pytest.fixture
+def mock_step(service):
+    with patch.object(service, "_step") as mock:
+        yield mock
+
+
+def test_make_moves_saves_once(service, mock_games, mock_step):
+    boards = [[[2 ** n]*4]*4 for n in range(1, 5)]
+    head = GameHead(0, 5, 3, boards[0])
+    mock_games.head.return_value = head
+    mock_step.side_effect = [
+        (boards[1], None, {Direction.LEFT}),
+        (boards[1], Status.NOOP, {Direction.LEFT}),
+        (boards[2], None, {Direction.DOWN, Direction.UP}),
+    ]
+
+    board, statuses, legal = service.make_moves(
+        "g1", [Direction.UP, Direction.UP, Direction.LEFT])
+    assert board == boards[2]
+    assert statuses == [None, Status.NOOP, None]
+    assert legal == [Direction.UP, Direction.DOWN]
+    mock_games.head.assert_called_once_with("g1")
+    mock_games.append.assert_called_once_with(
+        "g1", head, [Direction.UP, Direction.LEFT], boards[2])
+    rngs = [c.args[2] for c in mock_step.call_args_list]
+    assert [r.random() for r in rngs] == [
+        logic.game_rng(5, n).random() for n in (4, 5, 5)]
+
+
+def test_make_moves_stops_at_terminal_status(service, mock_games, mock_step):
+    boards = [[[2 ** n]*4]*4 for n in range(1, 5)]
+    head = GameHead(0, 5, 3, boards[0])
+    mock_games.head.return_value = head
+    mock_step.side_effect = [
+        (boards[1], None, {Direction.UP}),
+        (boards[2], Status.WIN, {Direction.UP}),
+    ]
+
+    board, statuses, _ = service.make_moves(
+        "g1", [Direction.UP, Direction.DOWN, Direction.LEFT])
+    assert board == boards[2]
+    assert statuses == [None, Status.WIN]
+    assert mock_step.call_count == 2
+    mock_games.append.assert_called_once_with(
+        "g1", head, [Direction.UP], boards[1])
+
+
+def test_make_moves_all_noop(service, mock_games, mock_step):
+    initial_board = [[0]*4]*4
+    head = GameHead(0, 5, 3, initial_board)
+    mock_games.head.return_value = head
+    mock_step.return_value = (initial_board, Status.NOOP, {Direction.DOWN})
+
+    board, statuses, _ = service.make_moves(
+        "g1", [Direction.UP, Direction.UP])
+    assert board == initial_board
+    assert statuses == [Status.NOOP, Status.NOOP]
+    mock_games.append.assert_not_called()
+
+
+def test_board_store_spawns_are_not_seeded(service, mock_games, mock_logic):
+    initial_board = [[0]*4]*4
+    mock_games.head.return_value = GameHead(0, None, 0, initial_board)
+    mock_logic.to_bitboard.side_effect = [1, 3]
+    mock_logic.legal_moves_bits.side_effect = [{Direction.UP}, {Direction.UP}]
+    mock_logic.is_win.return_value = False
+
+    service.make_move("g1", Direction.UP)
+    assert mock_logic.spawn_tile.call_args.args[1] is None
+    mock_logic.game_rng.assert_not_called()
+
+
+def test_state(service, mock_games):
+    board = [[2, 4, 2, 4], [4, 2, 4, 2], [2, 4, 2, 4], [4, 2, 4, 0]]
+    mock_games.head.return_value = GameHead(0, 5, 3, board)
+    assert service.state("g1") == (board, [Direction.DOWN, Direction.RIGHT])
+
+
+def test_history_is_limited_to_recent_games(mock_games):
+    service = Service(mock_games, history_games=2)
+    for game_id in ("g1", "g2", "g3"):
+        mock_games.create.return_value = GameHead(0, 5, 0, [[2] + [0]*3] * 4)
+        service.restart_game(game_id)
+    assert list(service._histories) == ["g2", "g3"]
+
+
+def test_history_disabled(mock_games):
+    service = Service(mock_games, history_size=0)
+    head = GameHead(0, 5, 0, [[2, 0, 0, 0]] + [[0]*4]*3)
+    mock_games.create.return_value = mock_games.head.return_value = head
+    service.restart_game("g1")
+    service.make_move("g1", Direction.DOWN)
+    with pytest.raises(HistoryError):
+        service.undo("g1")
@@ -1,11 +1,20 @@
-from unittest.mock import patch, mock_open, ANY
+import random
+import threading
+from unittest.mock import MagicMock, patch, mock_open, ANY
 import pytest
 
-from store import Store
+import logic
+from schemas import Direction, Status
+from history import HistoryError
+from service import Service
+from store import (
+    Store, SqliteStore, CachedStore, BoardLog, GameConflictError, GameLog,
+    GameNotFoundError, ReplayUnsupportedError, _pack_board, _pack_moves,
+    _unpack_board, _unpack_moves)
 
 
 board = [[1, 2], [3, 4]]
-serialized = "[[1, 2], [3, 4]]"
+serialized = '{"g1": [[1, 2], [3, 4]]}'
 
 
 @pytest.fixture
@@ -14,14 +23,399 @@ def store():
 
 
 def test_save(store):
-    with patch("builtins.open", mock_open()) as m:
-        store.save(board)
-        m.assert_called_once_with(ANY, "w")
+    with patch("builtins.open", mock_open(read_data="{}")) as m:
+        store.save("g1", board)
+        m.assert_any_call(ANY, "w")
         handle = m.return_value
         handle.write.assert_called_once_with(serialized)
 
 
+def test_save_keeps_other_games(store):
+    existing = '{"g0": [[0]]}'
+    with patch("builtins.open", mock_open(read_data=existing)) as m:
+        store.save("g1", board)
+        handle = m.return_value
+        handle.write.assert_called_once_with(
+            '{"g0": [[0]], "g1": [[1, 2], [3, 4]]}')
+
+
 def test_load(store):
     with patch("builtins.open", mock_open(read_data=serialized)) as m:
-        assert store.load() == board
+        assert store.load("g1") == board
         m.assert_called_once_with(ANY, "r")
+
+
+def test_load_unknown_game(store):
+    with patch("builtins.open", mock_open(read_data=serialized)):
+        with pytest.raises(GameNotFoundError):
+            store.load("g2")
+
+
+def test_json_round_trip(tmp_path):
+    store = Store(tmp_path / "store.json")
+    with pytest.raises(GameNotFoundError):
+        store.load("g1")
+    store.save("g1", board)
+    store.save("g2", [[0]])
+    assert store.load("g1") == board
+    assert store.load("g2") == [[0]]
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    return SqliteStore(tmp_path / "store.db")
+
+
+def test_sqlite_round_trip(sqlite_store):
+    game = [[2, 4, 0, 0], [0]*4, [0]*4, [8, 0, 0, 2048]]
+    sqlite_store.save("g1", game)
+    assert sqlite_store.load("g1") == game
+
+    sqlite_store.save("g1", [[0]*4]*4)
+    assert sqlite_store.load("g1") == [[0]*4]*4
+
+
+def test_sqlite_unknown_game(sqlite_store):
+    with pytest.raises(GameNotFoundError):
+        sqlite_store.load("missing")
+
+
+def test_sqlite_uses_wal(sqlite_store):
+    mode = sqlite_store._connection().execute(
+        "PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_sqlite_stores_eight_byte_boards(sqlite_store):
+    sqlite_store.save("g1", [[2, 4, 0, 0], [0]*4, [0]*4, [0]*4])
+    size = sqlite_store._connection().execute(
+        "SELECT length(board) FROM games WHERE id = 'g1'").fetchone()[0]
+    assert size == 8
+
+
+def test_sqlite_save_many(sqlite_store):
+    sqlite_store.save_many([("g1", [[2]*4]*4), ("g2", [[4]*4]*4)])
+    assert sqlite_store.load("g1") == [[2]*4]*4
+    assert sqlite_store.load("g2") == [[4]*4]*4
+
+
+def test_json_save_many(tmp_path):
+    store = Store(tmp_path / "store.json")
+    store.save("g0", [[0]])
+    store.save_many([("g1", board), ("g2", [[2]])])
+    assert store.load("g0") == [[0]]
+    assert store.load("g1") == board
+    assert store.load("g2") == [[2]]
+
+
+@pytest.fixture
+def backing_store():
+    return MagicMock()
+
+
+@pytest.fixture
+def cached_store(backing_store):
+    return CachedStore(backing_store, capacity=2)
+
+
+def test_cached_load_miss_then_hit(cached_store, backing_store):
+    backing_store.load.return_value = board
+    assert cached_store.load("g1") == board
+    assert cached_store.load("g1") == board
+    backing_store.load.assert_called_once_with("g1")
+    assert cached_store.stats()["hits"] == 1
+    assert cached_store.stats()["misses"] == 1
+
+
+def test_cached_load_returns_copies(cached_store, backing_store):
+    backing_store.load.return_value = [[2, 0], [0, 0]]
+    cached_store.load("g1")[0][0] = 4
+    assert cached_store.load("g1") == [[2, 0], [0, 0]]
+
+
+def test_cached_save_is_written_behind(cached_store, backing_store):
+    cached_store.save("g1", board)
+    assert cached_store.load("g1") == board
+    backing_store.save_many.assert_not_called()
+    backing_store.load.assert_not_called()
+
+    assert cached_store.flush() == 1
+    backing_store.save_many.assert_called_once()
+    assert list(backing_store.save_many.call_args.args[0]) == [("g1", board)]
+    assert cached_store.flush() == 0
+    assert cached_store.stats()["flushes"] == 1
+
+
+def test_cached_eviction_keeps_dirty_boards(cached_store, backing_store):
+    cached_store.save("g1", [[1]])
+    cached_store.save("g2", [[2]])
+    cached_store.save("g3", [[3]])
+    assert cached_store.stats()["cached"] == 2
+    assert cached_store.load("g1") == [[1]]
+    backing_store.load.assert_not_called()
+
+    cached_store.flush()
+    assert dict(backing_store.save_many.call_args.args[0]) == {
+        "g1": [[1]], "g2": [[2]], "g3": [[3]]}
+
+
+def test_cached_flush_failure_keeps_boards_dirty(cached_store, backing_store):
+    backing_store.save_many.side_effect = OSError("disk full")
+    cached_store.save("g1", board)
+    with pytest.raises(OSError):
+        cached_store.flush()
+    assert cached_store.stats()["dirty"] == 1
+
+    backing_store.save_many.side_effect = None
+    assert cached_store.flush() == 1
+
+
+def test_cached_close_flushes(backing_store):
+    cached_store = CachedStore(backing_store, flush_interval=60)
+    cached_store.start()
+    cached_store.save("g1", board)
+    cached_store.close()
+    backing_store.save_many.assert_called_once()
+
+
+def test_cached_background_flush(backing_store):
+    flushed = threading.Event()
+    backing_store.save_many.side_effect = lambda boards: flushed.set()
+    cached_store = CachedStore(backing_store, flush_interval=0.01)
+    cached_store.start()
+    cached_store.save("g1", board)
+    assert flushed.wait(5)
+    cached_store.close()
+
+
+@pytest.fixture
+def game_log(tmp_path):
+    return GameLog(tmp_path / "games.db", snapshot_interval=4)
+
+
+def _play(service, game_id, count, seed=0, **restart):
+    rng = random.Random(seed)
+    boards = [service.restart_game(game_id, **restart)[0]]
+    while len(boards) <= count:
+        board, status, legal = service.make_move(
+            game_id, rng.choice(list(Direction)))
+        if status is None:
+            boards.append(board)
+        elif status != Status.NOOP:
+            break
+    return boards
+
+
+def test_pack_moves_round_trip():
+    directions = [Direction.UP, Direction.RIGHT, Direction.LEFT,
+                  Direction.DOWN, Direction.RIGHT]
+    packed = _pack_moves(directions)
+    assert len(packed) == 2
+    assert _unpack_moves(packed, len(directions)) == directions
+
+
+def test_game_log_rebuilds_from_snapshot(tmp_path, game_log):
+    boards = _play(Service(game_log), "g1", 10)
+    reopened = GameLog(tmp_path / "games.db", snapshot_interval=4)
+    assert reopened.load("g1") == boards[-1]
+    assert reopened.head("g1").moves == len(boards) - 1
+    # The newest snapshot is at move 8, so only the last moves replay.
+    assert reopened.stats()["replayed_moves"] == len(boards) - 1 - 8
+
+
+def test_game_log_replays_any_move(game_log):
+    boards = _play(Service(game_log), "g1", 10)
+    for move, board in enumerate(boards):
+        assert game_log.replay("g1", move) == board
+    with pytest.raises(GameNotFoundError):
+        game_log.replay("g1", len(boards))
+
+
+def test_game_log_batches_are_replayed(tmp_path, game_log):
+    service = Service(game_log)
+    service.restart_game("g1")
+    board, statuses, _ = service.make_moves("g1", list(Direction) * 3)
+    saved = statuses.count(None)
+    reopened = GameLog(tmp_path / "games.db")
+    assert reopened.head("g1").moves == saved
+    if Status.WIN not in statuses and Status.LOSE not in statuses:
+        assert reopened.load("g1") == board
+
+
+def test_game_log_appends_only(game_log):
+    _play(Service(game_log), "g1", 6)
+    conn = game_log._connection()
+    rows = conn.execute("SELECT COUNT(*) FROM game_moves").fetchone()[0]
+    snapshots = conn.execute(
+        "SELECT move FROM game_snapshots ORDER BY move").fetchall()
+    assert rows == 6
+    assert snapshots == [(0,), (4,)]
+
+
+def test_game_log_restart_starts_new_generation(tmp_path, game_log):
+    service = Service(game_log)
+    _play(service, "g1", 3)
+    board, _ = service.restart_game("g1")
+    reopened = GameLog(tmp_path / "games.db")
+    head = reopened.head("g1")
+    assert (head.generation, head.moves, head.board) == (1, 0, board)
+
+
+def test_game_log_rejects_stale_head(tmp_path, game_log):
+    service = Service(game_log)
+    service.restart_game("g1")
+    head = game_log.head("g1")
+    board = logic.from_bitboard(logic.to_bitboard(head.board))
+    game_log.append("g1", head, [Direction.UP], board)
+    with pytest.raises(GameConflictError):
+        game_log.append("g1", head, [Direction.LEFT], board)
+    # The same check holds when the head is not cached.
+    with pytest.raises(GameConflictError):
+        GameLog(tmp_path / "games.db").append(
+            "g1", head, [Direction.LEFT], board)
+
+
+def _legal_move(service, game_id):
+    return service.state(game_id)[1][0]
+
+
+def test_game_log_recovers_from_another_instance(tmp_path):
+    services = [Service(GameLog(tmp_path / "games.db")) for _ in range(2)]
+    random.seed(0)
+    services[0].restart_game("g1")
+    # Each move finds the other instance's cached head stale; the service
+    # reloads it and retries instead of failing.
+    for turn in range(20):
+        board = GameLog(tmp_path / "games.db").head("g1").board
+        direction = sorted(logic.legal_moves(board))[0]
+        _, status, _ = services[turn % 2].make_move("g1", direction)
+        assert status is None
+    assert GameLog(tmp_path / "games.db").head("g1").moves == 20
+
+
+def test_game_log_rejects_stale_head_after_rewind(tmp_path, game_log):
+    random.seed(0)
+    service = Service(game_log)
+    service.restart_game("g1")
+    _, statuses, _ = service.make_moves("g1", list(Direction) * 2)
+    assert statuses.count(None) >= 3
+    head = game_log.head("g1")
+    other = GameLog(tmp_path / "games.db")
+    other.rewind("g1", other.head("g1"), 1, head.board)
+    # The one row left starts at move 1, so a stale append from move 2 or
+    # later would not clash with it.
+    with pytest.raises(GameConflictError):
+        game_log.append("g1", head, [Direction.UP], head.board)
+    assert game_log.head("g1").moves == 1
+
+
+def test_game_log_rewind(tmp_path, game_log):
+    service = Service(game_log)
+    # Seeds the game, so the batch below saves enough moves.
+    random.seed(0)
+    service.restart_game("g1")
+    _, statuses, _ = service.make_moves("g1", list(Direction) * 4)
+    moves = statuses.count(None)
+    assert moves > 5
+    boards = [game_log.replay("g1", move) for move in range(moves + 1)]
+    head = game_log.head("g1")
+
+    head = game_log.rewind("g1", head, 5, boards[5])
+    assert (head.moves, head.board) == (5, boards[5])
+    reopened = GameLog(tmp_path / "games.db", snapshot_interval=4)
+    assert reopened.head("g1").moves == 5
+    assert reopened.load("g1") == boards[5]
+    assert [reopened.replay("g1", move) for move in range(6)] == boards[:6]
+    conn = game_log._connection()
+    assert conn.execute(
+        "SELECT MAX(move) FROM game_snapshots").fetchone()[0] <= 5
+    # The game carries on from the rewound move.
+    board, status, _ = service.make_move("g1", Direction.UP)
+    if status is None:
+        assert GameLog(tmp_path / "games.db").load("g1") == board
+
+
+def test_game_log_rewind_rejects_stale_head(game_log):
+    boards = _play(Service(game_log), "g1", 3)
+    head = game_log.head("g1")
+    game_log.rewind("g1", head, 2, boards[2])
+    with pytest.raises(GameConflictError):
+        game_log.rewind("g1", head, 1, boards[1])
+
+
+def test_undo_redo(tmp_path, game_log):
+    service = Service(game_log)
+    boards = _play(service, "g1", 6)
+    assert service.undo("g1")[0] == boards[5]
+    board, legal = service.undo("g1")
+    assert board == boards[4]
+    assert legal == service._ordered(logic.legal_moves(boards[4]))
+    reopened = GameLog(tmp_path / "games.db")
+    assert reopened.load("g1") == boards[4]
+    assert service.redo("g1")[0] == boards[5]
+    assert service.redo("g1")[0] == boards[6]
+    with pytest.raises(HistoryError):
+        service.redo("g1")
+    # Redone moves are logged with their original spawns.
+    reopened = GameLog(tmp_path / "games.db")
+    assert [reopened.replay("g1", move) for move in range(7)] == boards
+
+
+def test_undo_needs_history(game_log):
+    service = Service(game_log)
+    service.restart_game("g1")
+    with pytest.raises(HistoryError):
+        service.undo("g1")
+    _play(service, "g1", 2)
+    # A fresh service, e.g. after a restart, has no history yet.
+    with pytest.raises(HistoryError):
+        Service(game_log).undo("g1")
+
+
+def test_undo_board_store(tmp_path):
+    service = Service(BoardLog(SqliteStore(tmp_path / "store.db")))
+    boards = _play(service, "g1", 3)
+    assert service.undo("g1")[0] == boards[2]
+    assert service.undo("g1")[0] == boards[1]
+    assert SqliteStore(tmp_path / "store.db").load("g1") == boards[1]
+    assert service.redo("g1")[0] == boards[2]
+
+
+def test_game_log_unknown_game(game_log):
+    with pytest.raises(GameNotFoundError):
+        game_log.load("nope")
+
+
+def test_seeded_games_replay_identically(tmp_path):
+    log = GameLog(tmp_path / "games.db")
+    boards = _play(Service(log), "g1", 20)
+    head = log.head("g1")
+    expected = logic.init_board(logic.game_rng(head.seed, 0))
+    assert boards[0] == expected
+
+
+@pytest.mark.parametrize("board", [
+    [[2, 4, 0], [0, 8, 0], [0, 0, 2]],
+    [[65536, 0, 0, 0], [0]*4, [0]*4, [0, 0, 0, 2]],
+    [[2**n for n in range(r + 1, r + 6)] for r in range(5)],
+])
+def test_pack_board_round_trip(board):
+    assert _unpack_board(_pack_board(board)) == board
+
+
+def test_game_log_keeps_size_and_target(tmp_path, game_log):
+    boards = _play(Service(game_log), "g1", 10, size=5, target=256)
+    reopened = GameLog(tmp_path / "games.db", snapshot_interval=4)
+    head = reopened.head("g1")
+    assert head.target == 256
+    assert len(head.board) == 5
+    for move, board in enumerate(boards):
+        assert reopened.replay("g1", move) == board
+
+
+def test_board_log_has_no_history(backing_store):
+    log = BoardLog(backing_store)
+    log.create("g1", 1, board)
+    backing_store.save.assert_called_once_with("g1", board)
+    with pytest.raises(ReplayUnsupportedError):
+        log.replay("g1", 0)
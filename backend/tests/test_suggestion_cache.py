@@ -0,0 +1,76 @@
+import pytest
+
+import logic
+from schemas import AgentResponse, Direction, Move
+from suggestion_cache import SuggestionCache
+from symmetry import flip_horizontal_bits
+
+
+BITS = logic.to_bitboard([
+    [2, 4, 0, 0],
+    [0, 0, 0, 0],
+    [0, 0, 0, 0],
+    [8, 0, 0, 0]
+])
+RESPONSE = AgentResponse(
+    recommended_moves=[
+        Move(direction=Direction.LEFT, reasoning="a", confidence=0.9),
+        Move(direction=Direction.UP, reasoning="b", confidence=0.5),
+    ],
+    game_analysis="test"
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("suggestion_cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_miss_then_hit():
+    cache = SuggestionCache()
+    assert cache.get(BITS, "k") is None
+    cache.put(BITS, "k", RESPONSE, 250.0)
+    assert cache.get(BITS, "k") == RESPONSE
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["saved_latency_ms"] == 250.0
+
+
+def test_key_is_part_of_lookup():
+    cache = SuggestionCache()
+    cache.put(BITS, "k", RESPONSE, 1.0)
+    assert cache.get(BITS, "other") is None
+
+
+def test_hit_on_mirrored_board_maps_directions():
+    cache = SuggestionCache()
+    cache.put(BITS, "k", RESPONSE, 1.0)
+    mirrored = cache.get(flip_horizontal_bits(BITS), "k")
+    assert [m.direction for m in mirrored.recommended_moves] == [
+        Direction.RIGHT, Direction.UP]
+    assert mirrored.recommended_moves[0].confidence == 0.9
+
+
+def test_ttl_expiry(clock):
+    cache = SuggestionCache(ttl=10)
+    cache.put(BITS, "k", RESPONSE, 1.0)
+    clock[0] = 9
+    assert cache.get(BITS, "k") is not None
+    clock[0] = 11
+    assert cache.get(BITS, "k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction():
+    cache = SuggestionCache(capacity=2)
+    cache.put(BITS, 1, RESPONSE, 1.0)
+    cache.put(BITS, 2, RESPONSE, 1.0)
+    cache.get(BITS, 1)
+    cache.put(BITS, 3, RESPONSE, 1.0)
+    assert cache.get(BITS, 2) is None
+    assert cache.get(BITS, 1) is not None
+    assert cache.get(BITS, 3) is not None
@@ -0,0 +1,64 @@
+import random
+import pytest
+
+import logic
+from schemas import Direction
+from symmetry import (
+    SYMMETRIES, Symmetry, canonicalize, flip_horizontal_bits,
+    flip_vertical_bits)
+
+
+BOARD = [
+    [2, 4, 0, 0],
+    [0, 0, 8, 0],
+    [0, 0, 0, 0],
+    [16, 0, 0, 32]
+]
+
+
+def test_flip_horizontal():
+    expected = [row[::-1] for row in BOARD]
+    assert logic.from_bitboard(
+        flip_horizontal_bits(logic.to_bitboard(BOARD))) == expected
+
+
+def test_flip_vertical():
+    expected = BOARD[::-1]
+    assert logic.from_bitboard(
+        flip_vertical_bits(logic.to_bitboard(BOARD))) == expected
+
+
+def test_symmetries_are_distinct():
+    bits = logic.to_bitboard(BOARD)
+    assert len({s.apply(bits) for s in SYMMETRIES}) == 8
+
+
+@pytest.mark.parametrize("symmetry", SYMMETRIES)
+@pytest.mark.parametrize("direction", list(Direction))
+def test_map_direction_commutes_with_moves(symmetry, direction):
+    rng = random.Random(0)
+    for _ in range(50):
+        bits = logic.to_bitboard(
+            [[rng.choice([0, 0, 2, 4, 8]) for _ in range(4)]
+             for _ in range(4)])
+        moved = logic.BIT_MOVES[direction](bits)
+        mapped = logic.BIT_MOVES[symmetry.map_direction(direction)]
+        assert symmetry.apply(moved) == mapped(symmetry.apply(bits))
+    assert symmetry.unmap_direction(
+        symmetry.map_direction(direction)) == direction
+
+
+def test_canonicalize_is_shared_by_all_orientations():
+    bits = logic.to_bitboard(BOARD)
+    canonical, symmetry = canonicalize(bits)
+    assert symmetry.apply(bits) == canonical
+    for s in SYMMETRIES:
+        assert canonicalize(s.apply(bits))[0] == canonical
+
+
+def test_rotation_direction_mapping():
+    # Transposing after a vertical flip rotates the board a quarter turn.
+    rotation = Symmetry(flip_horizontal=False, flip_vertical=True,
+                        transpose=True)
+    assert rotation.map_direction(Direction.UP) == Direction.RIGHT
+    assert rotation.unmap_direction(Direction.RIGHT) == Direction.UP
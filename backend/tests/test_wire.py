@@ -0,0 +1,75 @@
+import pytest
+
+import logic
+import wire
+from schemas import Direction, Status
+
+
+BOARD = [
+    [2, 4, 8, 0],
+    [0, 2, 16, 4],
+    [4, 0, 2, 32768],
+    [2, 8, 0, 2],
+]
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, wire.JSON),
+    ("", wire.JSON),
+    ("*/*", wire.JSON),
+    ("application/json", wire.JSON),
+    (wire.HEX, wire.HEX),
+    (wire.BINARY, wire.BINARY),
+    (f"{wire.BINARY};q=0.5, {wire.HEX}", wire.HEX),
+    (f"{wire.HEX};q=0.5, */*;q=0.8", wire.JSON),
+    (f"{wire.BINARY};q=0", wire.JSON),
+    ("text/html", wire.JSON),
+])
+def test_negotiate(accept, expected):
+    assert wire.negotiate(accept, (wire.HEX, wire.BINARY)) == expected
+
+
+def test_negotiate_skips_types_not_offered():
+    accept = f"{wire.BINARY}, {wire.HEX};q=0.9"
+    assert wire.negotiate(accept, (wire.HEX,)) == wire.HEX
+
+
+def test_board_hex():
+    text = wire.board_hex(BOARD)
+    assert text == "12300142201f1301"
+    assert text == f"{logic.to_bitboard(BOARD):016x}"
+    assert wire.board_from_hex(text) == BOARD
+
+
+def test_board_hex_needs_compact_tiles():
+    board = [[1 << 15] + [0]*4, [1 << 16] + [0]*4] + [[0]*5]*3
+    assert wire.compact(BOARD)
+    assert not wire.compact(board)
+    with pytest.raises(ValueError):
+        wire.board_hex(board)
+
+
+def test_board_from_hex_needs_square():
+    with pytest.raises(ValueError):
+        wire.board_from_hex("123")
+
+
+def test_encode_board():
+    assert wire.encode_board(BOARD, wire.HEX) == "12300142201f1301"
+    assert wire.encode_board(BOARD, wire.JSON) is BOARD
+
+
+def test_pack_game():
+    data = wire.pack_game("g1", BOARD, Status.NOOP,
+                          [Direction.UP, Direction.RIGHT])
+    assert len(data) == 3 + 8 + 2
+    assert data[3:11] == logic.to_bitboard(BOARD).to_bytes(8, "big")
+    assert wire.unpack_game(data) == (
+        "g1", BOARD, Status.NOOP, [Direction.UP, Direction.RIGHT])
+
+
+def test_pack_game_odd_size():
+    board = [[2, 0, 0, 0, 4]] + [[0]*5]*4
+    data = wire.pack_game("abc", board, None, [])
+    assert len(data) == 3 + 13 + 3
+    assert wire.unpack_game(data) == ("abc", board, None, [])
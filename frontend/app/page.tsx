@@ -1,18 +1,28 @@
 'use client'
-import React, { useEffect, useState } from 'react'
+import React, { useEffect, useRef, useState } from 'react'
 
 type Board = number[][]
+type Direction = 'LEFT' | 'RIGHT' | 'UP' | 'DOWN'
 interface GameResponse {
+  game_id: string
   board: Board
   status?: 'WIN' | 'LOSE' | 'NOOP'
+  legal_moves: Direction[]
 }
+type ChannelFrame =
+  | ({ type: 'GAME' } & GameResponse)
+  | ({ type: 'SUGGESTION' } & Record<string, any>)
+  | { type: 'ERROR', detail: string }
 
 export default function Home(): React.JSX.Element {
   const [board, setBoard] = useState<Board>(Array(4).fill(Array(4).fill(0)))
+  const [gameId, setGameId] = useState<string | null>(null)
+  const [legalMoves, setLegalMoves] = useState<Direction[]>([])
   const [gameState, setGameState] = useState<'WIN' | 'LOSE' | 'NOOP' | null>(null)
   const [agentResponse, setAgentResponse] = useState<any | null>(null)
   const [error, setError] = useState<string | null>(null)
   const [loading, setLoading] = useState<boolean>(false)
+  const channel = useRef<WebSocket | null>(null)
 
   function setCell(r: number, c: number, val: string) {
     const nb = board.map(row => row.slice())
@@ -57,22 +67,85 @@ export default function Home(): React.JSX.Element {
 
   async function restart() {
     if (loading) return
-    setBoard(await makeBackendCall('/api/restart', 'PATCH').then((data: GameResponse) => data.board))
+    const query = gameId ? `?game_id=${gameId}` : ''
+    const data: GameResponse = await makeBackendCall(`/api/restart${query}`, 'PATCH')
+    setGameId(data.game_id)
+    setBoard(data.board)
+    setLegalMoves(data.legal_moves)
+  }
+
+  async function stepHistory(route: 'undo' | 'redo') {
+    if (loading || !gameId) return
+    const data: GameResponse = await makeBackendCall(`/api/${route}?game_id=${gameId}`, 'PATCH')
+    if (!data) return
+    setBoard(data.board)
+    setLegalMoves(data.legal_moves)
+  }
+
+  // Moves and suggestions go over the game's WebSocket while it is open,
+  // and fall back to HTTP otherwise.
+  function channelOpen(): boolean {
+    return channel.current?.readyState === WebSocket.OPEN
+  }
+
+  function send(message: object) {
+    setError(null)
+    setGameState(null)
+    channel.current!.send(JSON.stringify(message))
+  }
+
+  function onFrame(event: MessageEvent) {
+    const { type, ...frame } = JSON.parse(event.data) as ChannelFrame
+    if (type === 'GAME') {
+      const data = frame as GameResponse
+      setBoard(data.board)
+      setGameState(data.status ?? null)
+      setLegalMoves(data.legal_moves)
+    } else if (type === 'SUGGESTION') {
+      setAgentResponse(frame)
+    } else {
+      setError((frame as { detail: string }).detail)
+    }
   }
 
   async function suggest() {
     if (loading || isTerminalState()) return
-    setAgentResponse(await makeBackendCall('/api/suggest/2', 'POST'))
+    if (channelOpen()) {
+      setAgentResponse(null)
+      send({ type: 'SUGGEST', num_suggestions: 2 })
+      return
+    }
+    setAgentResponse(await makeBackendCall(`/api/suggest/2?game_id=${gameId}`, 'POST'))
   }
 
-  async function performMove(direction: 'LEFT' | 'RIGHT' | 'UP' | 'DOWN') {
+  async function performMove(direction: Direction) {
     if (loading || isTerminalState()) return
-    const data: GameResponse = await makeBackendCall(`/api/move/${direction}`, 'PATCH')
+    if (!legalMoves.includes(direction)) {
+      setGameState('NOOP')
+      return
+    }
+    if (channelOpen()) {
+      send({ type: 'MOVE', direction })
+      return
+    }
+    const data: GameResponse = await makeBackendCall(`/api/move/${direction}?game_id=${gameId}`, 'PATCH')
     setBoard(data.board)
     setGameState(data.status)
+    setLegalMoves(data.legal_moves)
   }
 
   useEffect(() => { restart() }, [])
+  useEffect(() => {
+    if (!gameId) return
+    const url = `${process.env.NEXT_PUBLIC_BACKEND_URL}`.replace(/^http/, 'ws')
+    const socket = new WebSocket(`${url}/api/ws?game_id=${gameId}`)
+    socket.onmessage = onFrame
+    channel.current = socket
+    return () => {
+      socket.close()
+      channel.current = null
+    }
+  }, [gameId])
   useEffect(() => {
     function handler(e: KeyboardEvent) {
       if (e.key === 'ArrowLeft') {
@@ -91,7 +164,7 @@ export default function Home(): React.JSX.Element {
     }
     window.addEventListener('keydown', handler)
     return () => window.removeEventListener('keydown', handler)
-  }, [loading, board])
+  }, [loading, board, gameId])
 
   return (
     <div className="container">
@@ -122,6 +195,8 @@ export default function Home(): React.JSX.Element {
 
       <div className="controls">
         <button onClick={restart}>{'Restart'}</button>
+        <button onClick={() => stepHistory('undo')}>{'Undo'}</button>
+        <button onClick={() => stepHistory('redo')}>{'Redo'}</button>
         <button onClick={suggest}>{'Suggest Move'}</button>
       </div>
 